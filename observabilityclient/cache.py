@@ -0,0 +1,440 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import array
+import bisect
+import collections
+from concurrent import futures
+import logging
+import math
+import re
+import sys
+import threading
+import time
+
+from observabilityclient import prometheus_client
+from observabilityclient.utils import time_utils
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_FRESHNESS = 60
+DEFAULT_RESOLUTION = 15
+
+# Quoted strings are kept intact, whitespace runs outside of them
+# get collapsed.
+_QUERY_NORMALIZATION_REGEX = re.compile(
+    r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|`[^`]*`)|\s+"
+)
+
+
+def normalize_query(query):
+    """Return query with insignificant whitespace collapsed."""
+    return _QUERY_NORMALIZATION_REGEX.sub(
+        lambda m: m.group(1) or " ", query
+    ).strip()
+
+
+def _labels_size(labels):
+    size = sys.getsizeof(labels)
+    for key, value in labels.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+    return size
+
+
+def _metric_size(metric):
+    return _labels_size(metric.labels) + 16 * len(metric)
+
+
+def _instant_metric_size(metric):
+    # NOTE: Instant queries of range vector selectors return a matrix.
+    if isinstance(metric, prometheus_client.PrometheusRangeMetric):
+        return _metric_size(metric)
+    return _labels_size(metric.labels) + sys.getsizeof(metric.value) + 16
+
+
+def _copy_slice(values, first, last):
+    if isinstance(values, array.array):
+        return values[first:last]
+    # NOTE: Slices of NumPy arrays are views, returning them would let
+    # callers modify the cached samples in place.
+    return values[first:last].copy()
+
+
+def _slice_metric(metric, start, end):
+    first = bisect.bisect_left(metric.timestamps, start)
+    last = bisect.bisect_right(metric.timestamps, end)
+    return prometheus_client.PrometheusRangeMetric.from_arrays(
+        dict(metric.labels),
+        _copy_slice(metric.timestamps, first, last),
+        _copy_slice(metric.values, first, last)
+    )
+
+
+def _copy_instant_metric(metric):
+    if isinstance(metric, prometheus_client.PrometheusRangeMetric):
+        return prometheus_client.PrometheusRangeMetric.from_arrays(
+            dict(metric.labels),
+            _copy_slice(metric.timestamps, 0, len(metric)),
+            _copy_slice(metric.values, 0, len(metric))
+        )
+    return prometheus_client.PrometheusMetric({
+        'metric': dict(metric.labels),
+        'value': [metric.timestamp, metric.value]
+    })
+
+
+def _slice_result(result, start, end):
+    ret = []
+    for metric in result:
+        sliced = _slice_metric(metric, start, end)
+        if len(sliced) != 0:
+            ret.append(sliced)
+    return ret
+
+
+class LRUCache:
+    """Thread safe mapping keeping at most maxsize recently used items.
+
+    :ivar hits: number of get() calls, which found the key
+    :ivar misses: number of get() calls, which didn't find the key
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class SingleFlight:
+    """Collapses concurrent identical calls into a single one.
+
+    A call made while another one with the same key is in flight waits
+    for it and gets its result, or its exception, instead of running
+    the function again. Nothing is kept once a call finishes, so the
+    following calls run the function again.
+
+    :ivar calls: number of calls, which ran the function
+    :ivar coalesced: number of calls, which waited for another call
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def do(self, key, fn):
+        """Return fn(), shared with concurrent calls with the same key.
+
+        :param key: anything hashable identifying the call
+        :param fn: function to call
+        :type fn: callable
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                waiting = True
+            else:
+                future = futures.Future()
+                self._in_flight[key] = future
+                self.calls += 1
+                waiting = False
+        if waiting:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+class _Extent:
+    """Result of a range query over [start, end]."""
+
+    def __init__(self, start, end, result):
+        self.start = start
+        self.end = end
+        self.result = result
+        self.size = sum(_metric_size(m) for m in result)
+
+
+class RangeQueryCache:
+    """Step aligned cache of range query results.
+
+    Works in a similar way as the results cache of the Thanos query
+    frontend. The start and end of every cached query are aligned to
+    multiples of the step, so the samples of repeated queries with
+    a sliding time window line up. Only the parts of the window,
+    which aren't cached yet get fetched from Prometheus. Samples newer
+    than max_freshness seconds aren't cached, because Prometheus might
+    not have received all the data for them yet.
+
+    Extents are evicted in LRU order once their estimated size exceeds
+    max_bytes. A single cache instance can be shared by multiple
+    PrometheusAPIClient instances. The clients add the URL of their
+    Prometheus server to the scope, so results of different servers
+    are kept apart.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES,
+                 max_freshness=DEFAULT_MAX_FRESHNESS):
+        self.max_bytes = max_bytes
+        self.max_freshness = max_freshness
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._extents = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._extents)
+
+    def _get(self, key):
+        with self._lock:
+            extent = self._extents.get(key)
+            if extent is not None:
+                self._extents.move_to_end(key)
+            return extent
+
+    def _put(self, key, extent):
+        with self._lock:
+            old = self._extents.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            if extent.size > self.max_bytes:
+                return
+            self._extents[key] = extent
+            self.size += extent.size
+            while self.size > self.max_bytes:
+                _, evicted = self._extents.popitem(last=False)
+                self.size -= evicted.size
+
+    def clear(self):
+        with self._lock:
+            self._extents.clear()
+            self.size = 0
+
+    def query_range(self, fetch, query, start, end, step, scope=None):
+        """Return a range query result, fetching only missing parts.
+
+        :param fetch: function fetching the result from Prometheus,
+                      called as fetch(start, end) with unix timestamps
+        :type fetch: callable
+        :param query: the query to send
+        :type query: str
+        :param start: start of the queried time range
+        :type start: rfc3339 or unix_timestamp
+        :param end: end of the queried time range
+        :type end: rfc3339 or unix_timestamp
+        :param step: query resolution step width
+        :type step: duration or float number of seconds
+        :param scope: anything hashable identifying the access scope
+                      of the query, like rbac labels
+        """
+        start = time_utils.parse_timestamp(start)
+        end = time_utils.parse_timestamp(end)
+        step = time_utils.parse_duration(step)
+        start = math.floor(start / step) * step
+        end = math.floor(end / step) * step
+        key = (normalize_query(query), step, scope)
+
+        extent = self._get(key)
+        if (extent is None or extent.start > end + step or
+                extent.end < start - step):
+            with self._lock:
+                self.misses += 1
+            full = _Extent(start, end, fetch(start, end))
+        else:
+            with self._lock:
+                self.hits += 1
+            windows = []
+            if start < extent.start:
+                LOG.debug("Fetching head of cached range [%s, %s]",
+                          start, extent.start - step)
+                windows.append(fetch(start, extent.start - step))
+            windows.append(extent.result)
+            if end > extent.end:
+                LOG.debug("Fetching tail of cached range [%s, %s]",
+                          extent.end + step, end)
+                windows.append(fetch(extent.end + step, end))
+            full = _Extent(
+                min(start, extent.start),
+                max(end, extent.end),
+                prometheus_client.merge_range_results(windows)
+            )
+
+        # Don't cache samples, which might still change.
+        fresh_end = math.floor(
+            (time.time() - self.max_freshness) / step
+        ) * step
+        if full.end <= fresh_end:
+            self._put(key, full)
+        elif full.start <= fresh_end:
+            self._put(key, _Extent(
+                full.start,
+                fresh_end,
+                _slice_result(full.result, full.start, fresh_end)
+            ))
+
+        return _slice_result(full.result, start, end)
+
+
+class _InstantResult:
+    """Result of an instant query fetched at created."""
+
+    def __init__(self, created, result):
+        self.created = created
+        self.result = result
+        self.size = sum(_instant_metric_size(m) for m in result)
+
+
+class InstantQueryCache:
+    """Time aligned cache of instant query results.
+
+    Instead of the time a request reaches Prometheus, queries are
+    evaluated at the current time rounded down to a multiple of
+    resolution. Repeated queries within the same resolution window are
+    then identical and served from the cache. Results are kept for at
+    most ttl seconds, because samples arriving late can still change
+    them, and evicted in LRU order once their estimated size exceeds
+    max_bytes. A single cache instance can be shared by multiple
+    PrometheusAPIClient instances. The clients add the URL of their
+    Prometheus server to the scope, so results of different servers
+    are kept apart.
+    """
+
+    def __init__(self, resolution=DEFAULT_RESOLUTION, ttl=None,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        """Create a new InstantQueryCache.
+
+        :param resolution: seconds the evaluation time is aligned to
+        :type resolution: duration or float number of seconds
+        :param ttl: maximum age of cached results in seconds, defaults
+                    to resolution
+        :type ttl: duration or float number of seconds
+        :param max_bytes: maximum estimated size of the cached results
+        :type max_bytes: int
+        """
+        self.resolution = time_utils.parse_duration(resolution)
+        if ttl is None:
+            self.ttl = self.resolution
+        else:
+            self.ttl = time_utils.parse_duration(ttl)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def _pop(self, key):
+        entry = self._results.pop(key)
+        self.size -= entry.size
+
+    def _put(self, key, entry, now):
+        with self._lock:
+            if key in self._results:
+                self._pop(key)
+            # NOTE: Results of earlier aligned times are never used
+            # again after expiring, drop them before evicting fresh ones.
+            expired = []
+            for old_key, old in self._results.items():
+                if now - old.created <= self.ttl:
+                    break
+                expired.append(old_key)
+            for old_key in expired:
+                self._pop(old_key)
+            if entry.size > self.max_bytes:
+                return
+            self._results[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._results)))
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.size = 0
+
+    def query(self, fetch, query, scope=None):
+        """Return an instant query result evaluated at an aligned time.
+
+        :param fetch: function fetching the result from Prometheus,
+                      called as fetch(time) with a unix timestamp
+        :type fetch: callable
+        :param query: the query to send
+        :type query: str
+        :param scope: anything hashable identifying the access scope
+                      of the query, like rbac labels
+        """
+        now = time.time()
+        aligned = math.floor(now / self.resolution) * self.resolution
+        key = (normalize_query(query), aligned, scope)
+
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and now - entry.created <= self.ttl:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return [_copy_instant_metric(m) for m in entry.result]
+            self.misses += 1
+
+        result = fetch(aligned)
+        self._put(key, _InstantResult(now, result), now)
+        return [_copy_instant_metric(m) for m in result]
@@ -0,0 +1,256 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import collections
+from concurrent import futures
+import gzip
+import json
+import logging
+import os
+import re
+import time
+
+from observabilityclient import prometheus_client
+from observabilityclient import promql
+from observabilityclient.utils import time_utils
+
+try:
+    from pyarrow import parquet
+except ImportError:
+    parquet = None
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_EXPORT_WINDOW = 24 * 60 * 60
+DEFAULT_EXPORT_WORKERS = 4
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+# Output formats and the extensions of their chunk files. The "frame"
+# format is the MetricFrame binary layout compressed with gzip, see
+# frame.FRAME_MAGIC.
+FORMATS = {
+    'parquet': '.parquet',
+    'frame': '.frame.gz',
+}
+
+ExportChunk = collections.namedtuple(
+    'ExportChunk', ['name', 'query', 'start', 'end']
+)
+
+ExportProgress = collections.namedtuple(
+    'ExportProgress', ['done', 'total', 'samples', 'bytes', 'elapsed']
+)
+ExportProgress.__doc__ = """Progress of an export, passed to its callback.
+
+:ivar done: number of exported chunks, including the ones exported
+            before resuming
+:ivar total: total number of chunks
+:ivar samples: number of samples exported since the start or resume
+:ivar bytes: size of the files written since the start or resume
+:ivar elapsed: seconds since the start or resume
+"""
+
+
+def default_format():
+    """Return "parquet" if pyarrow is installed, "frame" otherwise."""
+    return 'parquet' if parquet is not None else 'frame'
+
+
+class Checkpoint:
+    """State of an export, stored as JSON next to the chunks.
+
+    Holds the queries of the series shards and the names of the exported
+    chunks. The file is replaced atomically after each chunk, so an
+    interrupted export can be resumed from the last completed chunk
+    with the same shards.
+    """
+
+    def __init__(self, path, params):
+        self.path = path
+        # NOTE: Compare the parameters in the form they're loaded in.
+        self.params = json.loads(json.dumps(params))
+        self.queries = None
+        self.done = set()
+
+    def load(self):
+        """Load the state, if the file exists.
+
+        Raises ValueError if the file was written by an export with
+        different parameters.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        if data['params'] != self.params:
+            raise ValueError(f"{self.path} belongs to an export with "
+                             f"different parameters: {data['params']}")
+        self.queries = data['queries']
+        self.done = set(data['done'])
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'params': self.params, 'queries': self.queries,
+                       'done': sorted(self.done)}, f)
+        os.replace(tmp_path, self.path)
+
+    def add(self, name):
+        self.done.add(name)
+        self.save()
+
+
+def shard_queries(manager, selector, start, end, shard_label=None, shards=1,
+                  disable_rbac=True):
+    """Return queries each selecting a part of the series of a selector.
+
+    The values of shard_label of the series with samples between start
+    and end are retrieved from Prometheus and divided into the shards.
+    Each query selects the series with the label set to one of the
+    values of its shard.
+
+    Raises ValueError if the series are split into shards and selector
+    isn't a series selector.
+
+    :returns: list of queries
+    """
+    if shard_label is None or shards <= 1:
+        return [selector]
+    tree = promql.parse(selector)
+    if not isinstance(tree, promql.VectorSelector):
+        raise ValueError(f"Only a series selector can be split into "
+                         f"shards, not {selector}")
+    match = selector
+    if not disable_rbac:
+        match = manager.client.rbac.modify_query(selector)
+    values = sorted({labels.get(shard_label, "") for labels in
+                     manager.prom.series([match], stream=True,
+                                         start=start, end=end)})
+
+    def matcher(shard):
+        # NOTE: An empty value in the regex matches the series without
+        # the label too.
+        regex = "|".join(re.escape(value) for value in shard)
+        return f"{shard_label}=~{promql.quote(regex)}"
+
+    return [promql.add_label_matcher(selector, matcher(values[i::shards]),
+                                     tree)
+            for i in range(min(shards, len(values)))]
+
+
+def plan_chunks(queries, start, end, step, window):
+    """Split an export into chunks of a time window and a series shard.
+
+    The windows are aligned to step like the windows of split range
+    queries.
+
+    :param queries: queries of the series shards, see shard_queries()
+    :type queries: [str]
+    :returns: list of ExportChunk
+    """
+    points = max(1, min(int(window // step),
+                        prometheus_client.MAX_POINTS_PER_SERIES))
+    windows = prometheus_client._split_range(start, end, step, points)
+    return [ExportChunk(f"{w:05d}-{s:03d}", query, window_start, window_end)
+            for w, (window_start, window_end) in enumerate(windows)
+            for s, query in enumerate(queries)]
+
+
+def _write_chunk(frame, path, output_format):
+    tmp_path = path + ".tmp"
+    if output_format == 'parquet':
+        parquet.write_table(frame.to_arrow(), tmp_path, compression='zstd')
+    else:
+        with gzip.open(tmp_path, 'wb') as f:
+            frame.write(f)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def _export_chunk(manager, chunk, step, directory, output_format,
+                  disable_rbac):
+    frame = manager.query_range(chunk.query, chunk.start, chunk.end, step,
+                                disable_rbac=disable_rbac, frame=True)
+    if len(frame) == 0:
+        return 0, 0
+    path = os.path.join(directory, chunk.name + FORMATS[output_format])
+    return len(frame), _write_chunk(frame, path, output_format)
+
+
+def export(manager, selector, start, end, step, directory,
+           window=DEFAULT_EXPORT_WINDOW, shard_label=None, shards=1,
+           max_workers=DEFAULT_EXPORT_WORKERS, output_format=None,
+           resume=True, disable_rbac=True, progress=None):
+    """Export the result of a range query into chunk files.
+
+    See QueryManager.export() for the description of the arguments.
+    """
+    start = time_utils.parse_timestamp(start)
+    end = time_utils.parse_timestamp(end)
+    step = time_utils.parse_duration(step)
+    window = time_utils.parse_duration(window)
+    if output_format is None:
+        output_format = default_format()
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown export format {output_format}")
+    if output_format == 'parquet' and parquet is None:
+        raise ImportError("pyarrow is required for the parquet format")
+
+    os.makedirs(directory, exist_ok=True)
+    checkpoint = Checkpoint(
+        os.path.join(directory, CHECKPOINT_FILE_NAME),
+        dict(selector=selector, start=start, end=end, step=step,
+             window=window, shard_label=shard_label, shards=shards,
+             format=output_format)
+    )
+    if resume:
+        checkpoint.load()
+    if checkpoint.queries is None:
+        checkpoint.queries = shard_queries(manager, selector, start, end,
+                                           shard_label, shards, disable_rbac)
+        checkpoint.done = set()
+        checkpoint.save()
+
+    chunks = plan_chunks(checkpoint.queries, start, end, step, window)
+    pending = [c for c in chunks if c.name not in checkpoint.done]
+    LOG.debug("Exporting %d chunks, %d already exported", len(pending),
+              len(chunks) - len(pending))
+
+    started = time.monotonic()
+    done = len(chunks) - len(pending)
+    samples = 0
+    size = 0
+    status = ExportProgress(done, len(chunks), 0, 0, 0.0)
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {executor.submit(_export_chunk, manager, chunk, step,
+                                   directory, output_format,
+                                   disable_rbac): chunk
+                   for chunk in pending}
+        try:
+            for future in futures.as_completed(running):
+                chunk_samples, chunk_size = future.result()
+                checkpoint.add(running[future].name)
+                done += 1
+                samples += chunk_samples
+                size += chunk_size
+                status = ExportProgress(done, len(chunks), samples, size,
+                                        time.monotonic() - started)
+                if progress is not None:
+                    progress(status)
+        except BaseException:
+            for future in running:
+                future.cancel()
+            raise
+    return status
@@ -0,0 +1,292 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import array
+import decimal
+import math
+import struct
+import sys
+
+from observabilityclient import prometheus_client
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+try:
+    import pyarrow
+    import pyarrow.compute
+except ImportError:
+    pyarrow = None
+
+
+# Binary layout written by MetricFrame.write(), all integers and floats
+# are little-endian:
+#   header: FRAME_MAGIC, uint8 flags (1 for range frames),
+#           uint64 number of rows, uint32 number of label columns
+#   for each label column:
+#       string name, uint32 number of categories, string categories,
+#       int32 code for each row, -1 if the row doesn't have the label
+#   float64 timestamp for each row
+#   float64 value for each row
+# Strings are stored as uint32 length followed by utf-8 bytes.
+FRAME_MAGIC = b"OBSFRM01"
+_HEADER = struct.Struct("<BQI")
+_LENGTH = struct.Struct("<I")
+
+
+def _write_array(fileobj, values, typecode):
+    values = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    fileobj.write(values.tobytes())
+
+
+def _read_exactly(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated MetricFrame data")
+    return data
+
+
+def _read_array(fileobj, typecode, count):
+    values = array.array(typecode)
+    values.frombytes(_read_exactly(fileobj, values.itemsize * count))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _write_string(fileobj, string):
+    data = string.encode('utf-8')
+    fileobj.write(_LENGTH.pack(len(data)))
+    fileobj.write(data)
+
+
+def _read_string(fileobj):
+    length, = _LENGTH.unpack(_read_exactly(fileobj, _LENGTH.size))
+    return _read_exactly(fileobj, length).decode('utf-8')
+
+
+def format_value(value):
+    """Format a float the same way as Prometheus does in its responses."""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    formatted = repr(float(value))
+    if 'e' in formatted:
+        # Prometheus never uses the exponent notation
+        formatted = format(decimal.Decimal(formatted), 'f')
+    if '.' in formatted:
+        formatted = formatted.rstrip('0').rstrip('.')
+    return formatted
+
+
+def _numpy_array(values, dtype):
+    if isinstance(values, array.array):
+        # Shares the memory of the array.array
+        return numpy.frombuffer(values, dtype=dtype)
+    return numpy.asarray(values, dtype=dtype)
+
+
+class MetricFrame:
+    """Columnar container of a query result.
+
+    Holds one row per sample. Every label is stored as a dictionary
+    encoded column: an int32 array of codes pointing into the list of
+    distinct values of the label, -1 for rows without the label.
+    Timestamps and values are stored in float64 arrays.
+
+    Create frames with from_metrics().
+
+    :ivar columns: sorted names of the labels
+    :ivar is_range: True if the frame holds a range query result
+    """
+
+    def __init__(self, columns, codes, categories, timestamps, values,
+                 is_range=False):
+        self.columns = columns
+        self.codes = codes
+        self.categories = categories
+        self.timestamps = timestamps
+        self.values = values
+        self.is_range = is_range
+
+    @classmethod
+    def from_metrics(cls, metrics):
+        """Create a frame from a query result.
+
+        :param metrics: result of a query or a range query
+        :type metrics: iterable of PrometheusMetric or PrometheusRangeMetric
+        """
+        metrics = list(metrics)
+        is_range = any(isinstance(m, prometheus_client.PrometheusRangeMetric)
+                       for m in metrics)
+        counts = [len(m) if is_range else 1 for m in metrics]
+        rows = sum(counts)
+        columns = sorted(set().union(*(m.labels.keys() for m in metrics)))
+        codes = {c: array.array('i', [-1]) * rows for c in columns}
+        categories = {c: [] for c in columns}
+        lookups = {c: {} for c in columns}
+
+        row = 0
+        for metric, count in zip(metrics, counts):
+            for key, value in metric.labels.items():
+                lookup = lookups[key]
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(categories[key])
+                    categories[key].append(value)
+                codes[key][row:row + count] = array.array('i', [code]) * count
+            row += count
+
+        if is_range:
+            timestamps = array.array('d')
+            values = array.array('d')
+            for metric in metrics:
+                timestamps.extend(metric.timestamps)
+                values.extend(metric.values)
+        else:
+            timestamps = array.array('d', (float(m.timestamp)
+                                           for m in metrics))
+            values = array.array('d', (m.float_value for m in metrics))
+        return cls(columns, codes, categories, timestamps, values,
+                   is_range)
+
+    def __len__(self):
+        return len(self.values)
+
+    def label(self, name):
+        """Return the values of a label, None for rows without it."""
+        categories = self.categories[name]
+        return [categories[code] if code >= 0 else None
+                for code in self.codes[name]]
+
+    def to_numpy(self):
+        """Return a dictionary of NumPy arrays, one for each column.
+
+        The timestamp and value arrays share the memory of the frame.
+        Label columns are object arrays with None for rows without
+        the label.
+        """
+        if numpy is None:
+            raise ImportError("NumPy is required for MetricFrame.to_numpy")
+        ret = {}
+        for column in self.columns:
+            categories = numpy.array(self.categories[column] + [None],
+                                     dtype=object)
+            ret[column] = categories[_numpy_array(self.codes[column],
+                                                  numpy.int32)]
+        ret["timestamp"] = _numpy_array(self.timestamps, numpy.float64)
+        ret["value"] = _numpy_array(self.values, numpy.float64)
+        return ret
+
+    def to_pandas(self):
+        """Return a pandas DataFrame with categorical label columns.
+
+        The codes of the label columns and the timestamp and value
+        columns are passed to pandas without copying when possible.
+        """
+        if pandas is None or numpy is None:
+            raise ImportError("pandas and NumPy are required for "
+                              "MetricFrame.to_pandas")
+        data = {}
+        for column in self.columns:
+            data[column] = pandas.Categorical.from_codes(
+                _numpy_array(self.codes[column], numpy.int32),
+                categories=self.categories[column]
+            )
+        data["timestamp"] = _numpy_array(self.timestamps, numpy.float64)
+        data["value"] = _numpy_array(self.values, numpy.float64)
+        return pandas.DataFrame(data, copy=False)
+
+    def to_arrow(self):
+        """Return a pyarrow Table with dictionary encoded label columns.
+
+        The buffers of the codes, timestamp and value columns are shared
+        with the frame.
+        """
+        if pyarrow is None:
+            raise ImportError("pyarrow is required for MetricFrame.to_arrow")
+        rows = len(self)
+        arrays = []
+        for column in self.columns:
+            codes = self.codes[column]
+            indices = pyarrow.Array.from_buffers(
+                pyarrow.int32(), rows, [None, pyarrow.py_buffer(codes)]
+            )
+            mask = pyarrow.compute.less(indices, 0)
+            arrays.append(pyarrow.DictionaryArray.from_arrays(
+                indices, pyarrow.array(self.categories[column],
+                                       type=pyarrow.string()),
+                mask=mask
+            ))
+        for values in (self.timestamps, self.values):
+            arrays.append(pyarrow.Array.from_buffers(
+                pyarrow.float64(), rows, [None, pyarrow.py_buffer(values)]
+            ))
+        return pyarrow.Table.from_arrays(
+            arrays, names=self.columns + ["timestamp", "value"]
+        )
+
+    def write(self, fileobj):
+        """Write the frame to a binary file, see FRAME_MAGIC.
+
+        :param fileobj: file opened for writing in binary mode
+        """
+        fileobj.write(FRAME_MAGIC)
+        fileobj.write(_HEADER.pack(int(self.is_range), len(self),
+                                   len(self.columns)))
+        for column in self.columns:
+            _write_string(fileobj, column)
+            categories = self.categories[column]
+            fileobj.write(_LENGTH.pack(len(categories)))
+            for category in categories:
+                _write_string(fileobj, category)
+            _write_array(fileobj, self.codes[column], 'i')
+        _write_array(fileobj, self.timestamps, 'd')
+        _write_array(fileobj, self.values, 'd')
+
+    @classmethod
+    def read(cls, fileobj):
+        """Read a frame written by write().
+
+        :param fileobj: file opened for reading in binary mode
+        """
+        if fileobj.read(len(FRAME_MAGIC)) != FRAME_MAGIC:
+            raise ValueError("Not a MetricFrame file")
+        is_range, rows, column_count = _HEADER.unpack(
+            _read_exactly(fileobj, _HEADER.size)
+        )
+        columns = []
+        codes = {}
+        categories = {}
+        for _ in range(column_count):
+            column = _read_string(fileobj)
+            count, = _LENGTH.unpack(_read_exactly(fileobj, _LENGTH.size))
+            columns.append(column)
+            categories[column] = [_read_string(fileobj)
+                                  for _ in range(count)]
+            codes[column] = _read_array(fileobj, 'i', rows)
+        timestamps = _read_array(fileobj, 'd', rows)
+        values = _read_array(fileobj, 'd', rows)
+        return cls(columns, codes, categories, timestamps, values,
+                   bool(is_range))
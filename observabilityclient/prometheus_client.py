@@ -12,13 +12,127 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import array
+import bisect
+from concurrent import futures
+import itertools
 import logging
+import math
+import socket
+from urllib import parse
 
 import requests
+from requests import adapters
+from urllib3 import connection
+from urllib3.util import retry
+
+from observabilityclient.utils import json_utils
+from observabilityclient.utils import time_utils
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 LOG = logging.getLogger(__name__)
 
+# NOTE: Prometheus refuses range queries, which would return more
+# than 11000 points per series.
+MAX_POINTS_PER_SERIES = 11000
+DEFAULT_SPLIT_WORKERS = 4
+DEFAULT_ASYNC_MAX_CONNECTIONS = 100
+DEFAULT_POOL_CONNECTIONS = adapters.DEFAULT_POOLSIZE
+DEFAULT_POOL_MAXSIZE = adapters.DEFAULT_POOLSIZE
+DEFAULT_COMPRESSION_MIN_SIZE = 4096
+STREAM_CHUNK_SIZE = 64 * 1024
+# NOTE: Proxies commonly refuse URLs longer than 4-8 KiB, so larger
+# parameters are sent in the body of a POST request.
+DEFAULT_POST_THRESHOLD = 2048
+DEFAULT_MATCHES_PER_REQUEST = 100
+# Endpoints accepting the parameters as a form encoded POST body
+_POST_ENDPOINTS = frozenset(("query", "query_range", "series", "labels"))
+# Responses of overloaded or restarting Prometheus and proxies in front
+# of it, which are worth retrying.
+RETRY_STATUSES = (502, 503, 504)
+
+
+def _float_array(values):
+    """Return a compact float64 array built from an iterable of numbers.
+
+    A NumPy array is returned when NumPy is installed, an array.array
+    otherwise. Both store the numbers unboxed, 8 bytes per item.
+    """
+    if numpy is not None:
+        return numpy.fromiter(values, dtype=numpy.float64)
+    return array.array('d', values)
+
+
+def _concat_arrays(arrays):
+    if numpy is not None:
+        return numpy.concatenate(arrays)
+    ret = array.array('d')
+    for a in arrays:
+        ret.extend(a)
+    return ret
+
+
+def _series_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def merge_range_results(results):
+    """Stitch results of consecutive time windows into one result.
+
+    :param results: lists of PrometheusRangeMetric, one list per window
+                    in chronological order
+    """
+    timestamps = {}
+    values = {}
+    labels = {}
+    last = {}
+    for result in results:
+        for metric in result:
+            if len(metric) == 0:
+                continue
+            key = _series_key(metric.labels)
+            if key not in labels:
+                labels[key] = metric.labels
+                timestamps[key] = []
+                values[key] = []
+                first = 0
+            else:
+                # Skip samples already returned by the previous window.
+                first = bisect.bisect_right(metric.timestamps, last[key])
+            timestamps[key].append(metric.timestamps[first:])
+            values[key].append(metric.values[first:])
+            last[key] = max(last.get(key, metric.timestamps[-1]),
+                            metric.timestamps[-1])
+    return [PrometheusRangeMetric.from_arrays(labels[key],
+                                              _concat_arrays(timestamps[key]),
+                                              _concat_arrays(values[key]))
+            for key in labels]
+
+
+def _split_range(start, end, step, points):
+    """Split [start, end] into windows of at most points samples each.
+
+    The windows are aligned to the step grid starting at start, so
+    no sample is evaluated twice.
+    """
+    window_start = start
+    windows = 0
+    while window_start <= end:
+        window_end = min(window_start + step * (points - 1), end)
+        yield window_start, window_end
+        windows += 1
+        window_start = start + step * points * windows
+
 
 class PrometheusAPIClientError(Exception):
     def __init__(self, response):
@@ -31,12 +145,16 @@ class PrometheusAPIClientError(Exception):
                     decoded = self.resp.json()
                     if 'error' in decoded:
                         return f'[{self.resp.status_code}] {decoded["error"]}'
-                except requests.JSONDecodeError:
+                except ValueError:
                     # If an https endpoint is accessed as http,
                     # we get 400 status with plain text instead of
                     # json and decoding it raises exception.
                     return f'[{self.resp.status_code}] {self.resp.text}'
-            return f'[{self.resp.status_code}] {self.resp.reason}'
+            # NOTE: httpx responses call the reason "reason_phrase"
+            reason = getattr(self.resp, 'reason', None)
+            if reason is None:
+                reason = self.resp.reason_phrase
+            return f'[{self.resp.status_code}] {reason}'
         else:
             decoded = self.resp.json()
             return f'[{decoded.status}]'
@@ -45,15 +163,228 @@ class PrometheusAPIClientError(Exception):
         return self.__str__()
 
 
+def _decode_response(resp, decoder, require_status=True):
+    if resp.status_code != requests.codes.ok:
+        raise PrometheusAPIClientError(resp)
+    decoded = decoder(resp.content)
+    if ((require_status or 'status' in decoded) and
+            decoded['status'] != 'success'):
+        raise PrometheusAPIClientError(resp)
+    return decoded
+
+
+def _decode_query_result(decoded):
+    result_type = decoded['data']['resultType']
+    strings = {}
+    if result_type == 'vector':
+        return [PrometheusMetric(i, strings)
+                for i in decoded['data']['result']]
+    elif result_type == 'matrix':
+        return [PrometheusRangeMetric(i, strings)
+                for i in decoded['data']['result']]
+    elif result_type in ('scalar', 'string'):
+        return [PrometheusMetric({'metric': {},
+                                  'value': decoded['data']['result']})]
+    raise ValueError(f"Unknown query result type {result_type}")
+
+
+class _CompressionPolicy:
+    """Decides whether to ask Prometheus for gzip compressed responses.
+
+    Compression is negotiated unless the previous response of the same
+    endpoint was smaller than min_size bytes. Compressing such responses
+    costs more time than it saves on the transfer.
+    """
+
+    def __init__(self, enabled=True,
+                 min_size=DEFAULT_COMPRESSION_MIN_SIZE):
+        self.enabled = enabled
+        self.min_size = min_size
+        self._sizes = {}
+
+    def accept_encoding(self, endpoint):
+        if (self.enabled and
+                self._sizes.get(endpoint, self.min_size) >= self.min_size):
+            return 'gzip'
+        return 'identity'
+
+    def record(self, endpoint, size):
+        self._sizes[endpoint] = size
+
+
+def _iter_query_result(items):
+    # NOTE: The labels aren't interned, the strings dictionary would keep
+    # every distinct label value of the stream in memory.
+    scalar = []
+    for item in items:
+        if not isinstance(item, dict):
+            # Scalar and string results are a single [timestamp, value]
+            # pair instead of an array of series.
+            scalar.append(item)
+        elif 'values' in item:
+            yield PrometheusRangeMetric(item)
+        else:
+            yield PrometheusMetric(item)
+    if scalar:
+        yield PrometheusMetric({'metric': {}, 'value': scalar})
+
+
+def _metadata_params(matches, start, end, limit=None):
+    params = {}
+    if matches is not None:
+        params["match[]"] = matches
+    if start is not None:
+        params["start"] = start
+    if end is not None:
+        params["end"] = end
+    if limit is not None:
+        params["limit"] = limit
+    return params
+
+
+def _params_key(params):
+    """Return a hashable representation of request parameters."""
+    if not params:
+        return ()
+    return tuple(sorted(
+        (k, tuple(v) if isinstance(v, list) else v)
+        for k, v in params.items()
+    ))
+
+
+def _copy_decoded(decoded):
+    """Copy a decoded response, so it can be modified by its receiver.
+
+    The lists of series, label names and values returned to the caller
+    are copied with the label sets in them. Query results are only
+    copied at the top level, since they're decoded into new metric
+    objects anyway.
+    """
+    data = decoded.get('data')
+    if isinstance(data, list):
+        data = [dict(item) if isinstance(item, dict) else item
+                for item in data]
+    elif isinstance(data, dict):
+        data = dict(data)
+    return dict(decoded, data=data)
+
+
+def _use_post(endpoint, params, threshold):
+    return (threshold is not None and bool(params) and
+            endpoint in _POST_ENDPOINTS and
+            len(parse.urlencode(params, doseq=True)) > threshold)
+
+
+def _unique_series(series, limit=None):
+    """Yield the label sets of series, skipping repeated ones."""
+    seen = set()
+    for labels in series:
+        key = _series_key(labels)
+        if key in seen:
+            continue
+        if limit is not None and len(seen) >= limit:
+            return
+        seen.add(key)
+        yield labels
+
+
+def _is_too_many_points_error(exc):
+    return (exc.resp.status_code == requests.codes.bad_request and
+            'exceeded maximum resolution' in str(exc))
+
+
+def _intern_labels(labels, strings):
+    """Return labels sharing equal keys and values through strings.
+
+    :param strings: dictionary mapping strings to themselves, shared
+                    by all metrics of a result set
+    """
+    if strings is None:
+        return labels
+    setdefault = strings.setdefault
+    return {setdefault(key, key): setdefault(value, value)
+            for key, value in labels.items()}
+
+
 class PrometheusMetric:
-    def __init__(self, input):
+    """A single sample of a vector result.
+
+    :ivar value: the value as returned by Prometheus, a string
+    :ivar float_value: the value parsed as a float, NaN if it isn't
+                       a number
+    """
+
+    __slots__ = ('timestamp', 'labels', 'value', 'float_value')
+
+    def __init__(self, input, strings=None):
+        """Create a new PrometheusMetric.
+
+        :param input: sample as decoded from the Prometheus response
+        :type input: dict
+        :param strings: dictionary shared by the metrics of a result set,
+                        used to store each distinct label key and value
+                        only once, see _intern_labels()
+        :type strings: dict
+        """
         self.timestamp = input['value'][0]
-        self.labels = input['metric']
+        self.labels = _intern_labels(input['metric'], strings)
         self.value = input['value'][1]
+        try:
+            self.float_value = float(self.value)
+        except (TypeError, ValueError):
+            self.float_value = math.nan
+
+
+class PrometheusRangeMetric:
+    """A single series of a matrix result.
+
+    Instead of keeping the list of [timestamp, value] pairs returned by
+    Prometheus, the samples are decoded into two parallel float arrays.
+    """
+
+    __slots__ = ('labels', 'timestamps', 'values')
+
+    def __init__(self, input, strings=None):
+        self.labels = _intern_labels(input['metric'], strings)
+        samples = input.get('values', [])
+        self.timestamps = _float_array(s[0] for s in samples)
+        self.values = _float_array(float(s[1]) for s in samples)
+
+    @classmethod
+    def from_arrays(cls, labels, timestamps, values):
+        metric = cls.__new__(cls)
+        metric.labels = labels
+        metric.timestamps = timestamps
+        metric.values = values
+        return metric
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+class _PoolAdapter(adapters.HTTPAdapter):
+    """HTTPAdapter setting socket options of the pooled connections."""
+
+    def __init__(self, *args, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
 
 
 class PrometheusAPIClient:
-    def __init__(self, host, session=None, root_path=""):
+    def __init__(self, host, session=None, root_path="",
+                 pool_connections=None, pool_maxsize=None, max_retries=None,
+                 retry_backoff=None, tcp_keepalive=None):
+        """Create a new PrometheusAPIClient.
+
+        The connection pool options are passed to set_connection_pool().
+        When none of them are set, the connection pool of the session
+        is left unchanged.
+        """
         self._host = host
         if not self._host.endswith('/'):
             self._host += '/'
@@ -65,6 +396,22 @@ class PrometheusAPIClient:
         self._root_path = root_path
         if root_path != "" and not self._root_path.endswith('/'):
             self._root_path += '/'
+        self._range_cache = None
+        self._instant_cache = None
+        self._single_flight = None
+        self._compression = _CompressionPolicy()
+        self._json_decoder = json_utils.get_decoder()
+        self._post_threshold = DEFAULT_POST_THRESHOLD
+
+        pool_options = dict(pool_connections=pool_connections,
+                            pool_maxsize=pool_maxsize,
+                            max_retries=max_retries,
+                            retry_backoff=retry_backoff,
+                            tcp_keepalive=tcp_keepalive)
+        pool_options = {k: v for k, v in pool_options.items()
+                        if v is not None}
+        if pool_options:
+            self.set_connection_pool(**pool_options)
 
     def set_ca_cert(self, ca_cert):
         self._session.verify = ca_cert
@@ -75,80 +422,521 @@ class PrometheusAPIClient:
     def set_basic_auth(self, auth_user, auth_password):
         self._session.auth = (auth_user, auth_password)
 
+    def set_connection_pool(self, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                            pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                            max_retries=0, retry_backoff=0,
+                            tcp_keepalive=False):
+        """Configure the pool of connections to Prometheus.
+
+        Connections are kept open and reused by later requests, so
+        concurrent use of the client doesn't need a new connection
+        and TLS handshake for each request.
+
+        :param pool_connections: number of hosts to keep pools for
+        :type pool_connections: int
+        :param pool_maxsize: maximum number of kept connections per host
+        :type pool_maxsize: int
+        :param max_retries: how many times to retry requests failing
+                            to connect, to read the response or with
+                            a 502, 503 or 504 status code. Queries sent
+                            as POST requests, see set_post_threshold(),
+                            are retried like GET ones. So are the admin
+                            requests, a retried snapshot() can create
+                            an additional snapshot.
+        :type max_retries: int
+        :param retry_backoff: backoff factor of the retries, the sleep
+                              before n-th retry is
+                              retry_backoff * 2 ** (n - 1) seconds
+        :type retry_backoff: float
+        :param tcp_keepalive: enables TCP keep-alive probes, so idle
+                              pooled connections aren't dropped by
+                              firewalls or load balancers
+        :type tcp_keepalive: boolean
+        """
+        if max_retries:
+            retries = retry.Retry(
+                total=max_retries,
+                backoff_factor=retry_backoff,
+                status_forcelist=RETRY_STATUSES,
+                # NOTE: Long queries are sent in a POST body, but they
+                # don't change anything, so they're safe to retry.
+                allowed_methods=(retry.Retry.DEFAULT_ALLOWED_METHODS |
+                                 {'POST'}),
+                raise_on_status=False,
+            )
+        else:
+            # The requests default, which raises read errors as they are
+            retries = retry.Retry(0, read=False)
+        socket_options = None
+        if tcp_keepalive:
+            socket_options = list(
+                connection.HTTPConnection.default_socket_options)
+            socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        adapter = _PoolAdapter(pool_connections=pool_connections,
+                               pool_maxsize=pool_maxsize,
+                               max_retries=retries,
+                               socket_options=socket_options)
+        session = self._requests_session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def _requests_session(self):
+        # NOTE: keystoneauth1 sessions wrap a requests session
+        return getattr(self._session, 'session', self._session)
+
+    def pool_stats(self):
+        """Return statistics of the connection pools.
+
+        Returns a list with a dictionary for each host with a pool,
+        holding the number of connections created, requests sent,
+        idle connections kept in the pool, connections currently in use
+        and the maximum number of kept connections.
+        """
+        adapter = self._requests_session().get_adapter(self._get_url(""))
+        pools = adapter.poolmanager.pools
+        ret = []
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            queued = list(pool.pool.queue)
+            ret.append({
+                'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': sum(1 for c in queued if c is not None),
+                'in_use': pool.pool.maxsize - len(queued),
+                'maxsize': pool.pool.maxsize,
+            })
+        return ret
+
+    def set_compression(self, enabled=True,
+                        min_size=DEFAULT_COMPRESSION_MIN_SIZE):
+        """Configure compression of the responses.
+
+        By default gzip compressed responses are requested. They're
+        decompressed chunk by chunk while being read, so the compressed
+        body isn't kept in memory. Endpoints, which returned less than
+        min_size bytes the last time, are asked for uncompressed
+        responses.
+
+        :param enabled: False to always request uncompressed responses
+        :type enabled: boolean
+        :param min_size: size of uncompressed responses in bytes, from
+                         which compression is requested
+        :type min_size: int
+        """
+        self._compression = _CompressionPolicy(enabled, min_size)
+
+    def set_post_threshold(self, threshold=DEFAULT_POST_THRESHOLD):
+        """Configure when the parameters are sent in a POST body.
+
+        Requests to the query, query_range, series and labels endpoints
+        with URL encoded parameters longer than threshold bytes are sent
+        as POST requests with a form encoded body, so long queries and
+        selectors don't hit URL length limits of proxies.
+
+        :param threshold: length of the encoded parameters in bytes,
+                          from which POST is used, None to always use GET
+        :type threshold: int
+        """
+        self._post_threshold = threshold
+
+    def set_json_decoder(self, decoder=None):
+        """Set the decoder of JSON responses.
+
+        By default the fastest installed decoder is used, orjson or
+        simdjson when installed, the json module of the standard library
+        otherwise.
+
+        :param decoder: name of the decoder, see json_utils.get_decoder(),
+                        or a function decoding JSON from bytes
+        :type decoder: str or callable
+        """
+        if decoder is None or isinstance(decoder, str):
+            decoder = json_utils.get_decoder(decoder)
+        self._json_decoder = decoder
+
+    def set_range_cache(self, range_cache):
+        """Cache results of range queries.
+
+        :param range_cache: cache to use, None to disable caching
+        :type range_cache: observabilityclient.cache.RangeQueryCache
+        """
+        self._range_cache = range_cache
+
+    def set_instant_cache(self, instant_cache):
+        """Cache results of instant queries.
+
+        :param instant_cache: cache to use, None to disable caching
+        :type instant_cache: observabilityclient.cache.InstantQueryCache
+        """
+        self._instant_cache = instant_cache
+
+    def set_single_flight(self, single_flight):
+        """Coalesce identical concurrent requests.
+
+        Requests sent while an identical one is in flight wait for it
+        and get its decoded response instead of sending another HTTP
+        request. Requests are identical when they have the same endpoint
+        and parameters and are sent with the same session, which holds
+        the credentials. Streamed responses aren't coalesced.
+
+        :param single_flight: coalescing to use, None to disable it
+        :type single_flight: observabilityclient.cache.SingleFlight
+        """
+        self._single_flight = single_flight
+
     def _get_url(self, endpoint):
         scheme = 'https' if self._session.verify else 'http'
         return f"{scheme}://{self._host}{self._root_path}api/v1/{endpoint}"
 
-    def _get(self, endpoint, params=None):
+    def _cache_scope(self, cache_scope):
+        # NOTE: Caches can be shared by clients of different Prometheus
+        # servers. Their results must not be served to each other.
+        return (self._get_url(""), cache_scope)
+
+    def _send(self, endpoint, params, **kwargs):
+        """Send a GET request, or a POST one if the params are too long."""
         url = self._get_url(endpoint)
-        resp = self._session.get(url, params=params,
-                                 headers={'Accept': 'application/json',
-                                          'Accept-Encoding': 'identity'})
+        headers = {'Accept': 'application/json',
+                   'Accept-Encoding':
+                       self._compression.accept_encoding(endpoint)}
+        if _use_post(endpoint, params, self._post_threshold):
+            LOG.debug("Sending the parameters of %s in a POST body",
+                      endpoint)
+            return self._session.post(url, data=params, headers=headers,
+                                      **kwargs)
+        return self._session.get(url, params=params, headers=headers,
+                                 **kwargs)
+
+    def _get(self, endpoint, params=None):
+        if self._single_flight is None:
+            return self._request(endpoint, params)
+        # NOTE: The session is a part of the key, so requests sent with
+        # different credentials are never coalesced.
+        key = (self._session, self._get_url(endpoint), _params_key(params))
+        decoded = self._single_flight.do(
+            key, lambda: self._request(endpoint, params)
+        )
+        # NOTE: All the coalesced callers get the same decoded response,
+        # each of them gets its own copy to modify.
+        return _copy_decoded(decoded)
+
+    def _request(self, endpoint, params):
+        resp = self._send(endpoint, params)
+        decoded = _decode_response(resp, self._json_decoder)
+        self._compression.record(endpoint, len(resp.content))
+        return decoded
+
+    def _get_stream(self, endpoint, params, path):
+        """Send a GET request and iterate over an array of its response.
+
+        The request is sent right away, so errors returned by Prometheus
+        are raised by this call. The response body is read and decoded
+        incrementally while iterating, see json_utils.iter_items().
+        """
+        resp = self._send(endpoint, params, stream=True)
         if resp.status_code != requests.codes.ok:
             raise PrometheusAPIClientError(resp)
-        decoded = resp.json()
-        if decoded['status'] != 'success':
-            raise PrometheusAPIClientError(resp)
+        return self._iter_stream(endpoint, resp, path)
 
-        return decoded
+    def _iter_stream(self, endpoint, resp, path):
+        size = 0
+
+        def chunks():
+            nonlocal size
+            for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                yield chunk
+
+        meta = {}
+        try:
+            yield from json_utils.iter_items(chunks(), path, meta)
+        finally:
+            resp.close()
+        if meta.get('status', 'success') != 'success':
+            raise PrometheusAPIClientError(resp)
+        self._compression.record(endpoint, size)
 
     def _post(self, endpoint, params=None):
         url = self._get_url(endpoint)
         resp = self._session.post(url, params=params,
                                   headers={'Accept': 'application/json'})
-        if resp.status_code != requests.codes.ok:
-            raise PrometheusAPIClientError(resp)
-        decoded = resp.json()
-        if 'status' in decoded and decoded['status'] != 'success':
-            raise PrometheusAPIClientError(resp)
-        return decoded
+        return _decode_response(resp, self._json_decoder,
+                                require_status=False)
 
-    def query(self, query):
+    def query(self, query, stream=False, time=None, cache_scope=None):
         """Send custom queries to Prometheus.
 
+        When an instant cache is set with set_instant_cache() and time
+        isn't set, the query is evaluated at the current time aligned to
+        the resolution of the cache and repeated queries are served from
+        the cache.
+
         :param query: the query to send
         :type query: str
+        :param stream: If True, an iterator is returned instead of a list.
+                       It decodes the response incrementally and yields
+                       each metric as soon as it's received, so the whole
+                       response is never kept in memory. The instant
+                       cache isn't used.
+        :type stream: boolean
+        :param time: evaluation time, the time the query reaches
+                     Prometheus if not set
+        :type time: rfc3339 or unix_timestamp
+        :param cache_scope: anything hashable identifying the access scope
+                            of the query, which is used as a part of the
+                            instant cache key
         """
-        LOG.debug("Querying prometheus with query: %s", query)
-        decoded = self._get("query", dict(query=query))
+        if stream:
+            LOG.debug("Querying prometheus with query: %s", query)
+            return _iter_query_result(self._get_stream(
+                "query", self._query_params(query, time), ("data", "result")
+            ))
+        if time is None and self._instant_cache is not None:
+            return self._instant_cache.query(
+                lambda t: self._query(query, t), query,
+                scope=self._cache_scope(cache_scope)
+            )
+        return self._query(query, time)
 
-        if decoded['data']['resultType'] == 'vector':
-            result = [PrometheusMetric(i) for i in decoded['data']['result']]
-        else:
-            result = [PrometheusMetric(decoded)]
-        return result
+    def _query_params(self, query, time):
+        params = dict(query=query)
+        if time is not None:
+            params['time'] = time
+        return params
 
-    def series(self, matches):
+    def _query(self, query, time):
+        LOG.debug("Querying prometheus with query: %s, time: %s",
+                  query, time)
+        decoded = self._get("query", self._query_params(query, time))
+        return _decode_query_result(decoded)
+
+    def query_range(self, query, start, end, step, split_interval=None,
+                    max_workers=DEFAULT_SPLIT_WORKERS, cache_scope=None,
+                    stream=False):
+        """Send a range query to Prometheus.
+
+        The matrix result is decoded into a list of PrometheusRangeMetric
+        objects, each holding the samples of one series in compact
+        timestamp and value arrays.
+
+        When split_interval is set, the time range is cut into step
+        aligned windows no longer than split_interval, which are queried
+        in parallel and stitched back together. Windows rejected by
+        Prometheus for returning too many points are split further.
+
+        When a range cache is set with set_range_cache(), the start and
+        end are aligned to multiples of step and only the parts of the
+        time range missing in the cache are fetched from Prometheus.
+
+        :param query: the query to send
+        :type query: str
+        :param start: start of the queried time range
+        :type start: rfc3339 or unix_timestamp
+        :param end: end of the queried time range
+        :type end: rfc3339 or unix_timestamp
+        :param step: query resolution step width
+        :type step: duration or float number of seconds
+        :param split_interval: maximum length of a single queried window,
+                               None to send a single request
+        :type split_interval: duration or float number of seconds
+        :param max_workers: maximum number of windows queried in parallel
+        :type max_workers: int
+        :param cache_scope: anything hashable identifying the access scope
+                            of the query, which is used as a part of the
+                            range cache key
+        :param stream: If True, an iterator decoding the response
+                       incrementally is returned instead of a list, like
+                       with query(). The range cache isn't used and
+                       split_interval can't be set.
+        :type stream: boolean
+        """
+        if stream:
+            if split_interval is not None:
+                raise ValueError("split_interval can't be used with stream")
+            LOG.debug("Range querying prometheus with query: %s, start: %s, "
+                      "end: %s, step: %s", query, start, end, step)
+            return _iter_query_result(self._get_stream(
+                "query_range",
+                dict(query=query, start=start, end=end, step=step),
+                ("data", "result")
+            ))
+        if self._range_cache is not None:
+            return self._range_cache.query_range(
+                lambda s, e: self._fetch_range(query, s, e, step,
+                                               split_interval, max_workers),
+                query, start, end, step,
+                scope=self._cache_scope(cache_scope)
+            )
+        return self._fetch_range(query, start, end, step, split_interval,
+                                 max_workers)
+
+    def _fetch_range(self, query, start, end, step, split_interval,
+                     max_workers):
+        if split_interval is None:
+            return self._query_range(query, start, end, step)
+
+        start = time_utils.parse_timestamp(start)
+        end = time_utils.parse_timestamp(end)
+        step = time_utils.parse_duration(step)
+        points = int(time_utils.parse_duration(split_interval) // step)
+        points = max(1, min(points, MAX_POINTS_PER_SERIES))
+        windows = list(_split_range(start, end, step, points))
+        LOG.debug("Splitting range query into %d windows", len(windows))
+        if len(windows) <= 1:
+            return self._query_range_window(query, start, end, step)
+
+        with futures.ThreadPoolExecutor(
+                max_workers=min(max_workers, len(windows))) as executor:
+            results = executor.map(
+                lambda w: self._query_range_window(query, *w, step),
+                windows
+            )
+            return merge_range_results(list(results))
+
+    def _query_range(self, query, start, end, step):
+        LOG.debug("Range querying prometheus with query: %s, start: %s, "
+                  "end: %s, step: %s", query, start, end, step)
+        decoded = self._get("query_range", dict(query=query, start=start,
+                                                end=end, step=step))
+
+        return [PrometheusRangeMetric(i) for i in decoded['data']['result']]
+
+    def _query_range_window(self, query, start, end, step):
+        try:
+            return self._query_range(query, start, end, step)
+        except PrometheusAPIClientError as exc:
+            points = int((end - start) // step) + 1
+            if points < 2 or not _is_too_many_points_error(exc):
+                raise exc
+        # NOTE: The server can be configured with a lower limit than
+        # the default one, so halve the window until it's accepted.
+        half = points // 2
+        LOG.debug("Window [%s, %s] was rejected for returning too many "
+                  "points, splitting it into two", start, end)
+        middle = start + step * half
+        return merge_range_results([
+            self._query_range_window(query, start, middle - step, step),
+            self._query_range_window(query, middle, end, step),
+        ])
+
+    def series(self, matches, stream=False, start=None, end=None,
+               limit=None, matches_per_request=DEFAULT_MATCHES_PER_REQUEST,
+               max_workers=DEFAULT_SPLIT_WORKERS):
         """Query the /series/ endpoint of prometheus.
 
+        Without start and end, Prometheus searches all of its data.
+        Setting them to a recent time range limits the search to
+        the blocks covering it, which is much faster.
+
+        More than matches_per_request matches are split into chunks,
+        which are requested in parallel. Series selected by more than
+        one chunk are returned only once.
+
         :param matches: List of matches to send as parameters
         :type matches: [str]
+        :param stream: If True, an iterator yielding the labels of each
+                       series as soon as they're received is returned
+                       instead of a list.
+        :type stream: boolean
+        :param start: start of the searched time range
+        :type start: rfc3339 or unix_timestamp
+        :param end: end of the searched time range
+        :type end: rfc3339 or unix_timestamp
+        :param limit: maximum number of returned series, requires
+                      Prometheus 2.52 or newer
+        :type limit: int
+        :param matches_per_request: maximum number of matches sent
+                                    in a single request
+        :type matches_per_request: int
+        :param max_workers: maximum number of chunks requested
+                            in parallel
+        :type max_workers: int
         """
         LOG.debug("Querying prometheus for series with matches: %s", matches)
-        decoded = self._get("series", {"match[]": matches})
+        if isinstance(matches, str):
+            matches = [matches]
+        chunks = [matches[i:i + matches_per_request]
+                  for i in range(0, len(matches), matches_per_request)]
+        if len(chunks) > 1:
+            LOG.debug("Splitting series request into %d chunks", len(chunks))
+            if stream:
+                return _unique_series(itertools.chain.from_iterable(
+                    self._iter_series_chunks(chunks, start, end, limit)
+                ), limit)
+            with futures.ThreadPoolExecutor(
+                    max_workers=min(max_workers, len(chunks))) as executor:
+                results = executor.map(
+                    lambda c: self.series(
+                        c, start=start, end=end, limit=limit,
+                        matches_per_request=matches_per_request),
+                    chunks
+                )
+                return list(_unique_series(
+                    itertools.chain.from_iterable(list(results)), limit
+                ))
+
+        params = _metadata_params(matches, start, end, limit)
+        if stream:
+            return self._get_stream("series", params, ("data",))
+        decoded = self._get("series", params)
 
         return decoded['data']
 
-    def labels(self):
+    def _iter_series_chunks(self, chunks, start, end, limit):
+        # NOTE: Each chunk is requested only once the previous one was
+        # read, so a single response is streamed at a time.
+        for chunk in chunks:
+            yield self._get_stream(
+                "series", _metadata_params(chunk, start, end, limit),
+                ("data",)
+            )
+
+    def labels(self, matches=None, start=None, end=None, limit=None):
         """Query the /labels/ endpoint of prometheus, returns list of labels.
 
-        There isn't a way to tell prometheus to restrict
-        which labels to return. It's not possible to enforce
-        rbac with this for example.
+        :param matches: If set, only the labels of the series selected
+                        by any of these series selectors are returned
+        :type matches: [str]
+        :param start: start of the time range of the selected series
+        :type start: rfc3339 or unix_timestamp
+        :param end: end of the time range of the selected series
+        :type end: rfc3339 or unix_timestamp
+        :param limit: maximum number of returned labels, requires
+                      Prometheus 2.52 or newer
+        :type limit: int
         """
         LOG.debug("Querying prometheus for labels")
-        decoded = self._get("labels")
+        decoded = self._get("labels",
+                            _metadata_params(matches, start, end, limit))
 
         return decoded['data']
 
-    def label_values(self, label):
+    def label_values(self, label, matches=None, start=None, end=None,
+                     limit=None):
         """Query prometheus for values of a specified label.
 
+        The values are deduplicated by Prometheus, so restricting them
+        with matches is much cheaper than collecting them from series().
+
         :param label: Name of label for which to return values
         :type label: str
+        :param matches: If set, only the values of the series selected
+                        by any of these series selectors are returned
+        :type matches: [str]
+        :param start: start of the time range of the selected series
+        :type start: rfc3339 or unix_timestamp
+        :param end: end of the time range of the selected series
+        :type end: rfc3339 or unix_timestamp
+        :param limit: maximum number of returned values, requires
+                      Prometheus 2.52 or newer
+        :type limit: int
         """
         LOG.debug("Querying prometheus for the values of label: %s", label)
-        decoded = self._get(f"label/{label}/values")
+        decoded = self._get(f"label/{label}/values",
+                            _metadata_params(matches, start, end, limit))
 
         return decoded['data']
 
@@ -200,3 +988,233 @@ class PrometheusAPIClient:
         LOG.debug("Taking prometheus data snapshot")
         ret = self._post("admin/tsdb/snapshot")
         return ret["data"]["name"]
+
+
+class AsyncPrometheusAPIClient:
+    """Asyncio counterpart of PrometheusAPIClient.
+
+    Requests are sent with an httpx.AsyncClient, which keeps a pool of
+    at most max_connections connections shared by all the coroutines
+    using the client. So many queries can run concurrently on one event
+    loop without a thread per request. httpx needs to be installed
+    unless a session is passed.
+
+    The TLS and authentication options need to be set before the first
+    request, the connection pool is created with them then. Call aclose()
+    or use the client as an async context manager to close the pool.
+    """
+
+    def __init__(self, host, session=None, root_path="",
+                 max_connections=DEFAULT_ASYNC_MAX_CONNECTIONS):
+        self._host = host
+        if not self._host.endswith('/'):
+            self._host += '/'
+        if session is None and httpx is None:
+            raise ImportError("httpx is required for "
+                              "AsyncPrometheusAPIClient")
+        self._session = session
+        self._verify = False
+        self._cert = None
+        self._auth = None
+        self._max_connections = max_connections
+        self._compression = _CompressionPolicy()
+        self._json_decoder = json_utils.get_decoder()
+        self._post_threshold = DEFAULT_POST_THRESHOLD
+        self._root_path = root_path
+        if root_path != "" and not self._root_path.endswith('/'):
+            self._root_path += '/'
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def set_ca_cert(self, ca_cert):
+        self._verify = ca_cert
+
+    def set_client_cert(self, client_cert, client_key):
+        self._cert = (client_cert, client_key)
+
+    def set_basic_auth(self, auth_user, auth_password):
+        self._auth = (auth_user, auth_password)
+
+    def set_compression(self, enabled=True,
+                        min_size=DEFAULT_COMPRESSION_MIN_SIZE):
+        """Configure compression of the responses.
+
+        Works the same way as PrometheusAPIClient.set_compression().
+        """
+        self._compression = _CompressionPolicy(enabled, min_size)
+
+    def set_json_decoder(self, decoder=None):
+        """Set the decoder of JSON responses.
+
+        Works the same way as PrometheusAPIClient.set_json_decoder().
+        """
+        if decoder is None or isinstance(decoder, str):
+            decoder = json_utils.get_decoder(decoder)
+        self._json_decoder = decoder
+
+    def set_post_threshold(self, threshold=DEFAULT_POST_THRESHOLD):
+        """Configure when the parameters are sent in a POST body.
+
+        Works the same way as PrometheusAPIClient.set_post_threshold().
+        """
+        self._post_threshold = threshold
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = httpx.AsyncClient(
+                verify=self._verify,
+                cert=self._cert,
+                auth=self._auth,
+                limits=httpx.Limits(max_connections=self._max_connections)
+            )
+        return self._session
+
+    async def aclose(self):
+        """Close all pooled connections."""
+        if self._session is not None:
+            await self._session.aclose()
+
+    def _get_url(self, endpoint):
+        scheme = 'https' if self._verify else 'http'
+        return f"{scheme}://{self._host}{self._root_path}api/v1/{endpoint}"
+
+    async def _get(self, endpoint, params=None):
+        url = self._get_url(endpoint)
+        headers = {'Accept': 'application/json',
+                   'Accept-Encoding':
+                       self._compression.accept_encoding(endpoint)}
+        if _use_post(endpoint, params, self._post_threshold):
+            LOG.debug("Sending the parameters of %s in a POST body",
+                      endpoint)
+            resp = await self._get_session().post(url, data=params,
+                                                  headers=headers)
+        else:
+            resp = await self._get_session().get(url, params=params,
+                                                 headers=headers)
+        decoded = _decode_response(resp, self._json_decoder)
+        self._compression.record(endpoint, len(resp.content))
+        return decoded
+
+    async def _post(self, endpoint, params=None):
+        url = self._get_url(endpoint)
+        resp = await self._get_session().post(
+            url, params=params, headers={'Accept': 'application/json'})
+        return _decode_response(resp, self._json_decoder,
+                                require_status=False)
+
+    async def query(self, query):
+        """Send custom queries to Prometheus.
+
+        :param query: the query to send
+        :type query: str
+        """
+        LOG.debug("Querying prometheus with query: %s", query)
+        decoded = await self._get("query", dict(query=query))
+        return _decode_query_result(decoded)
+
+    async def query_range(self, query, start, end, step):
+        """Send a range query to Prometheus.
+
+        :param query: the query to send
+        :type query: str
+        :param start: start of the queried time range
+        :type start: rfc3339 or unix_timestamp
+        :param end: end of the queried time range
+        :type end: rfc3339 or unix_timestamp
+        :param step: query resolution step width
+        :type step: duration or float number of seconds
+        """
+        LOG.debug("Range querying prometheus with query: %s, start: %s, "
+                  "end: %s, step: %s", query, start, end, step)
+        decoded = await self._get("query_range", dict(query=query,
+                                                      start=start,
+                                                      end=end, step=step))
+        return [PrometheusRangeMetric(i) for i in decoded['data']['result']]
+
+    async def series(self, matches, start=None, end=None, limit=None):
+        """Query the /series/ endpoint of prometheus.
+
+        See PrometheusAPIClient.series() for the arguments.
+        """
+        LOG.debug("Querying prometheus for series with matches: %s", matches)
+        decoded = await self._get("series", _metadata_params(matches, start,
+                                                             end, limit))
+
+        return decoded['data']
+
+    async def labels(self, matches=None, start=None, end=None, limit=None):
+        """Query the /labels/ endpoint of prometheus.
+
+        See PrometheusAPIClient.labels() for the arguments.
+        """
+        LOG.debug("Querying prometheus for labels")
+        decoded = await self._get("labels", _metadata_params(matches, start,
+                                                             end, limit))
+
+        return decoded['data']
+
+    async def label_values(self, label, matches=None, start=None, end=None,
+                           limit=None):
+        """Query prometheus for values of a specified label.
+
+        See PrometheusAPIClient.label_values() for the arguments.
+        """
+        LOG.debug("Querying prometheus for the values of label: %s", label)
+        decoded = await self._get(f"label/{label}/values",
+                                  _metadata_params(matches, start, end,
+                                                   limit))
+
+        return decoded['data']
+
+    # ---------
+    # admin api
+    # ---------
+
+    async def delete(self, matches, start=None, end=None):
+        """Delete some metrics from prometheus.
+
+        :param matches: List of matches, that specify which metrics to delete
+        :type matches [str]
+        :param start: Timestamp from which to start deleting.
+                      None for as early as possible.
+        :type start: timestamp
+        :param end: Timestamp until which to delete.
+                    None for as late as possible.
+        :type end: timestamp
+        """
+        LOG.debug("Deleting metrics from prometheus matching: %s", matches)
+        params = {"match[]": matches}
+        # NOTE: Unlike requests, httpx sends parameters set to None
+        # as empty values.
+        if start is not None:
+            params["start"] = start
+        if end is not None:
+            params["end"] = end
+        try:
+            await self._post("admin/tsdb/delete_series", params)
+        except PrometheusAPIClientError as exc:
+            # The 204 is allowed here. 204 is "No Content",
+            # which is expected on a successful call
+            if exc.resp.status_code != 204:
+                raise exc
+
+    async def clean_tombstones(self):
+        """Ask prometheus to clean tombstones."""
+        LOG.debug("Cleaning tombstones from prometheus")
+        try:
+            await self._post("admin/tsdb/clean_tombstones")
+        except PrometheusAPIClientError as exc:
+            # The 204 is allowed here. 204 is "No Content",
+            # which is expected on a successful call
+            if exc.resp.status_code != 204:
+                raise exc
+
+    async def snapshot(self):
+        """Create a snapshot and return the file name containing the data."""
+        LOG.debug("Taking prometheus data snapshot")
+        ret = await self._post("admin/tsdb/snapshot")
+        return ret["data"]["name"]
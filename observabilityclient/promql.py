@@ -0,0 +1,666 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""Lexer and parser for the Prometheus query language."""
+
+import collections
+import re
+
+
+IDENTIFIER = 'IDENTIFIER'
+STRING = 'STRING'
+NUMBER = 'NUMBER'
+DURATION = 'DURATION'
+LEFT_BRACE = 'LEFT_BRACE'
+RIGHT_BRACE = 'RIGHT_BRACE'
+LEFT_PAREN = 'LEFT_PAREN'
+RIGHT_PAREN = 'RIGHT_PAREN'
+LEFT_BRACKET = 'LEFT_BRACKET'
+RIGHT_BRACKET = 'RIGHT_BRACKET'
+COMMA = 'COMMA'
+COLON = 'COLON'
+AT = 'AT'
+OPERATOR = 'OPERATOR'
+MATCH_OPERATOR = 'MATCH_OPERATOR'
+COMMENT = 'COMMENT'
+
+# Keywords, which can never be a metric name in a vector selector.
+KEYWORDS = frozenset((
+    'and', 'or', 'unless', 'by', 'without', 'on', 'ignoring',
+    'group_left', 'group_right', 'offset', 'bool', 'atan2',
+))
+
+Token = collections.namedtuple('Token', ['type', 'value', 'start', 'end'])
+
+_TOKEN_REGEX = re.compile(r"""
+    (?P<WHITESPACE>\s+)
+  | (?P<COMMENT>\#[^\n]*)
+  | (?P<STRING>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`[^`]*`
+               # Be lenient with unterminated strings ending with
+               # a backslash.
+               |"[^"]*"|'[^']*')
+  | (?P<DURATION>(?:\d+(?:ms|[smhdwy]))+(?![a-zA-Z0-9_]))
+  | (?P<NUMBER>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<IDENTIFIER>[a-zA-Z_:][a-zA-Z0-9_:]*)
+  | (?P<LEFT_BRACE>\{)
+  | (?P<RIGHT_BRACE>\})
+  | (?P<LEFT_PAREN>\()
+  | (?P<RIGHT_PAREN>\))
+  | (?P<LEFT_BRACKET>\[)
+  | (?P<RIGHT_BRACKET>\])
+  | (?P<COMMA>,)
+  | (?P<AT>@)
+  | (?P<OPERATOR>==|!=|>=|<=|=~|!~|[-+*/%^<>=])
+""", re.VERBOSE)
+
+
+class PromQLSyntaxError(ValueError):
+    pass
+
+
+def tokenize(query):
+    """Split a PromQL query into tokens in a single pass.
+
+    Whitespace isn't returned. Match operators inside of label
+    sections are returned as MATCH_OPERATOR tokens and colons inside
+    of square brackets (subqueries) as COLON tokens.
+
+    :param query: the query to tokenize
+    :type query: str
+    """
+    position = 0
+    brace_depth = 0
+    bracket_depth = 0
+    length = len(query)
+    while position < length:
+        if bracket_depth and query[position] == ':':
+            yield Token(COLON, ':', position, position + 1)
+            position += 1
+            continue
+        match = _TOKEN_REGEX.match(query, position)
+        if match is None:
+            raise PromQLSyntaxError(
+                f"Unexpected character {query[position]!r} at position "
+                f"{position} in query: {query}"
+            )
+        token_type = match.lastgroup
+        position = match.end()
+        if token_type == 'WHITESPACE':
+            continue
+        if token_type == LEFT_BRACE:
+            brace_depth += 1
+        elif token_type == RIGHT_BRACE:
+            brace_depth -= 1
+        elif token_type == LEFT_BRACKET:
+            bracket_depth += 1
+        elif token_type == RIGHT_BRACKET:
+            bracket_depth -= 1
+        elif (token_type == OPERATOR and brace_depth and
+                match.group() in ('=', '!=', '=~', '!~')):
+            token_type = MATCH_OPERATOR
+        yield Token(token_type, match.group(), match.start(), position)
+
+
+AGGREGATION_OPERATORS = frozenset((
+    'sum', 'avg', 'count', 'min', 'max', 'group', 'stddev', 'stdvar',
+    'topk', 'bottomk', 'count_values', 'quantile', 'limitk', 'limit_ratio',
+))
+# Aggregation operators taking a parameter before the aggregated vector.
+PARAMETRIZED_AGGREGATIONS = frozenset((
+    'topk', 'bottomk', 'count_values', 'quantile', 'limitk', 'limit_ratio',
+))
+# Binary operators by precedence, the highest precedence last.
+_BINARY_PRECEDENCE = {
+    'or': 1,
+    'and': 2, 'unless': 2,
+    '==': 3, '!=': 3, '<=': 3, '<': 3, '>=': 3, '>': 3,
+    '+': 4, '-': 4,
+    '*': 5, '/': 5, '%': 5, 'atan2': 5,
+    '^': 6,
+}
+_COMPARISON_OPERATORS = frozenset(('==', '!=', '<=', '<', '>=', '>'))
+_STRING_ESCAPES = {
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+    'v': '\v', '\\': '\\', '"': '"', "'": "'",
+}
+_STRING_ESCAPE_REGEX = re.compile(
+    r"\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|[0-7]{3}|.)"
+)
+
+
+def unquote(string):
+    """Return the value of a PromQL string literal."""
+    if string.startswith('`'):
+        return string[1:-1]
+
+    def unescape(match):
+        escape = match.group(1)
+        if escape[0] in 'xuU':
+            return chr(int(escape[1:], 16))
+        if escape[0].isdigit():
+            return chr(int(escape, 8))
+        return _STRING_ESCAPES.get(escape, match.group(0))
+
+    return _STRING_ESCAPE_REGEX.sub(unescape, string[1:-1])
+
+
+class Node:
+    """Base class of the nodes of a parsed PromQL expression."""
+
+    def children(self):
+        return ()
+
+    def walk(self):
+        """Iterate over this node and all of its descendants."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children()))
+
+
+class NumberLiteral(Node):
+    def __init__(self, value):
+        self.value = value
+
+
+class StringLiteral(Node):
+    def __init__(self, value):
+        self.value = value
+
+
+class LabelMatcher:
+    def __init__(self, name, op, value):
+        self.name = name
+        self.op = op
+        self.value = value
+
+
+class VectorSelector(Node):
+    """Instant vector selector.
+
+    Besides the parsed name and label matchers, it remembers where
+    in the original query new label matchers can be inserted.
+
+    :ivar name: metric name or None
+    :ivar quoted_name: True if the name is a quoted string inside of the
+                       label section, like in {"utf8.name"}
+    :ivar name_end: position right after the metric name identifier
+    :ivar label_section_end: position of the closing brace of the label
+                             section or None if there is no label section
+    :ivar needs_comma: True if the label section ends with a matcher,
+                       which needs to be separated from a new one
+    """
+
+    def __init__(self, name, quoted_name, matchers, name_end,
+                 label_section_end, needs_comma):
+        self.name = name
+        self.quoted_name = quoted_name
+        self.matchers = matchers
+        self.name_end = name_end
+        self.label_section_end = label_section_end
+        self.needs_comma = needs_comma
+        self.offset = None
+        self.at = None
+
+
+class MatrixSelector(Node):
+    def __init__(self, vector_selector, range):
+        self.vector_selector = vector_selector
+        self.range = range
+        self.offset = None
+        self.at = None
+
+    def children(self):
+        return (self.vector_selector,)
+
+
+class SubqueryExpr(Node):
+    def __init__(self, expr, range, step):
+        self.expr = expr
+        self.range = range
+        self.step = step
+        self.offset = None
+        self.at = None
+
+    def children(self):
+        return (self.expr,)
+
+
+class Call(Node):
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+
+    def children(self):
+        return tuple(self.args)
+
+
+class AggregateExpr(Node):
+    def __init__(self, op, expr, param, grouping, without):
+        self.op = op
+        self.expr = expr
+        self.param = param
+        self.grouping = grouping
+        self.without = without
+
+    def children(self):
+        if self.param is None:
+            return (self.expr,)
+        return (self.param, self.expr)
+
+
+class VectorMatching:
+    def __init__(self, on, labels, card, include):
+        self.on = on
+        self.labels = labels
+        self.card = card
+        self.include = include
+
+
+class BinaryExpr(Node):
+    def __init__(self, op, lhs, rhs, return_bool, matching):
+        self.op = op
+        self.lhs = lhs
+        self.rhs = rhs
+        self.return_bool = return_bool
+        self.matching = matching
+
+    def children(self):
+        return (self.lhs, self.rhs)
+
+
+class UnaryExpr(Node):
+    def __init__(self, op, expr):
+        self.op = op
+        self.expr = expr
+
+    def children(self):
+        return (self.expr,)
+
+
+class ParenExpr(Node):
+    def __init__(self, expr):
+        self.expr = expr
+
+    def children(self):
+        return (self.expr,)
+
+
+class _Parser:
+    def __init__(self, query):
+        self.query = query
+        self.tokens = [t for t in tokenize(query) if t.type != COMMENT]
+        self.position = 0
+
+    def error(self, message):
+        token = self.peek()
+        where = (f"position {token.start}" if token is not None
+                 else "end of query")
+        return PromQLSyntaxError(f"{message} at {where} in query: "
+                                 f"{self.query}")
+
+    def peek(self, offset=0):
+        position = self.position + offset
+        if position < len(self.tokens):
+            return self.tokens[position]
+        return None
+
+    def peek_type(self, offset=0):
+        token = self.peek(offset)
+        return token.type if token is not None else None
+
+    def peek_keyword(self, *keywords):
+        token = self.peek()
+        return (token is not None and token.type == IDENTIFIER and
+                token.value.lower() in keywords)
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise self.error("Unexpected end of query")
+        self.position += 1
+        return token
+
+    def expect(self, token_type):
+        token = self.peek()
+        if token is None or token.type != token_type:
+            raise self.error(f"Expected {token_type}")
+        self.position += 1
+        return token
+
+    def expect_duration(self):
+        # NOTE: Since Prometheus 3, durations can also be written as
+        # a number of seconds, like foo[300] or foo offset 60.
+        if self.peek_type() == NUMBER:
+            return self.next()
+        return self.expect(DURATION)
+
+    def parse(self):
+        expr = self.parse_expr(0)
+        if self.peek() is not None:
+            raise self.error("Unexpected token")
+        return expr
+
+    def binary_operator(self):
+        token = self.peek()
+        if token is None:
+            return None
+        if token.type == OPERATOR and token.value in _BINARY_PRECEDENCE:
+            return token.value
+        if (token.type == IDENTIFIER and
+                token.value.lower() in ('and', 'or', 'unless', 'atan2')):
+            return token.value.lower()
+        return None
+
+    def parse_expr(self, min_precedence):
+        lhs = self.parse_unary()
+        while True:
+            op = self.binary_operator()
+            if op is None or _BINARY_PRECEDENCE[op] < min_precedence:
+                return lhs
+            precedence = _BINARY_PRECEDENCE[op]
+            self.next()
+            return_bool = False
+            if op in _COMPARISON_OPERATORS and self.peek_keyword('bool'):
+                self.next()
+                return_bool = True
+            matching = self.parse_vector_matching()
+            # "^" is right associative, everything else left associative
+            rhs = self.parse_expr(precedence if op == '^'
+                                  else precedence + 1)
+            lhs = BinaryExpr(op, lhs, rhs, return_bool, matching)
+
+    def parse_vector_matching(self):
+        if not self.peek_keyword('on', 'ignoring'):
+            return None
+        on = self.next().value.lower() == 'on'
+        labels = self.parse_label_list()
+        card = 'one-to-one'
+        include = []
+        if self.peek_keyword('group_left', 'group_right'):
+            card = ('many-to-one'
+                    if self.next().value.lower() == 'group_left'
+                    else 'one-to-many')
+            if self.peek_type() == LEFT_PAREN:
+                include = self.parse_label_list()
+        return VectorMatching(on, labels, card, include)
+
+    def parse_label_list(self):
+        self.expect(LEFT_PAREN)
+        labels = []
+        while self.peek_type() != RIGHT_PAREN:
+            token = self.next()
+            if token.type == IDENTIFIER:
+                labels.append(token.value)
+            elif token.type == STRING:
+                labels.append(unquote(token.value))
+            else:
+                self.position -= 1
+                raise self.error("Expected label name")
+            if self.peek_type() == COMMA:
+                self.next()
+            elif self.peek_type() != RIGHT_PAREN:
+                raise self.error("Expected ',' or ')'")
+        self.expect(RIGHT_PAREN)
+        return labels
+
+    def parse_unary(self):
+        token = self.peek()
+        if (token is not None and token.type == OPERATOR and
+                token.value in ('+', '-')):
+            self.next()
+            # Unary operators bind weaker than "^"
+            return UnaryExpr(token.value,
+                             self.parse_expr(_BINARY_PRECEDENCE['^']))
+        return self.parse_postfix(self.parse_primary())
+
+    def parse_postfix(self, expr):
+        while True:
+            token_type = self.peek_type()
+            if token_type == LEFT_BRACKET:
+                expr = self.parse_range(expr)
+            elif self.peek_keyword('offset'):
+                self.next()
+                sign = ''
+                if (self.peek_type() == OPERATOR and
+                        self.peek().value in ('+', '-')):
+                    sign = self.next().value
+                self.set_modifier(expr, 'offset',
+                                  sign + self.expect_duration().value)
+            elif token_type == AT:
+                self.next()
+                if self.peek_keyword('start', 'end'):
+                    at = self.next().value.lower()
+                    self.expect(LEFT_PAREN)
+                    self.expect(RIGHT_PAREN)
+                    at += '()'
+                else:
+                    sign = ''
+                    if (self.peek_type() == OPERATOR and
+                            self.peek().value in ('+', '-')):
+                        sign = self.next().value
+                    at = sign + self.expect(NUMBER).value
+                self.set_modifier(expr, 'at', at)
+            else:
+                return expr
+
+    def set_modifier(self, expr, modifier, value):
+        if not isinstance(expr, (VectorSelector, MatrixSelector,
+                                 SubqueryExpr)):
+            raise self.error(f"{modifier} modifier must follow a selector "
+                             f"or a subquery")
+        if getattr(expr, modifier) is not None:
+            raise self.error(f"Duplicate {modifier} modifier")
+        setattr(expr, modifier, value)
+
+    def parse_range(self, expr):
+        self.expect(LEFT_BRACKET)
+        range = self.expect_duration().value
+        if self.peek_type() == COLON:
+            self.next()
+            step = None
+            if self.peek_type() in (DURATION, NUMBER):
+                step = self.next().value
+            self.expect(RIGHT_BRACKET)
+            return SubqueryExpr(expr, range, step)
+        self.expect(RIGHT_BRACKET)
+        if (not isinstance(expr, VectorSelector) or
+                expr.offset is not None or expr.at is not None):
+            raise self.error("Range must follow an instant vector selector")
+        return MatrixSelector(expr, range)
+
+    def parse_primary(self):
+        token = self.peek()
+        if token is None:
+            raise self.error("Unexpected end of query")
+        if token.type == NUMBER:
+            self.next()
+            return NumberLiteral(float.fromhex(token.value)
+                                 if token.value[:2].lower() == '0x'
+                                 else float(token.value))
+        if token.type == STRING:
+            self.next()
+            return StringLiteral(unquote(token.value))
+        if token.type == LEFT_PAREN:
+            self.next()
+            expr = self.parse_expr(0)
+            self.expect(RIGHT_PAREN)
+            return ParenExpr(expr)
+        if token.type == LEFT_BRACE:
+            return self.parse_vector_selector(None)
+        if token.type == IDENTIFIER:
+            value = token.value.lower()
+            if value in ('inf', 'nan'):
+                self.next()
+                return NumberLiteral(float(value))
+            following = self.peek(1)
+            if value in AGGREGATION_OPERATORS and following is not None and (
+                    following.type == LEFT_PAREN or
+                    (following.type == IDENTIFIER and
+                     following.value.lower() in ('by', 'without'))):
+                return self.parse_aggregation()
+            if value in KEYWORDS:
+                raise self.error(f"Unexpected keyword {token.value}")
+            self.next()
+            if self.peek_type() == LEFT_PAREN:
+                return self.parse_call(token.value)
+            return self.parse_vector_selector(token)
+        raise self.error("Unexpected token")
+
+    def parse_call(self, function):
+        self.expect(LEFT_PAREN)
+        args = []
+        while self.peek_type() != RIGHT_PAREN:
+            args.append(self.parse_expr(0))
+            if self.peek_type() == COMMA:
+                self.next()
+            elif self.peek_type() != RIGHT_PAREN:
+                raise self.error("Expected ',' or ')'")
+        self.expect(RIGHT_PAREN)
+        return Call(function, args)
+
+    def parse_aggregation(self):
+        op = self.next().value.lower()
+        grouping = []
+        without = False
+        modifier_seen = False
+        if self.peek_keyword('by', 'without'):
+            without = self.next().value.lower() == 'without'
+            grouping = self.parse_label_list()
+            modifier_seen = True
+        self.expect(LEFT_PAREN)
+        param = None
+        if op in PARAMETRIZED_AGGREGATIONS:
+            param = self.parse_expr(0)
+            self.expect(COMMA)
+        expr = self.parse_expr(0)
+        self.expect(RIGHT_PAREN)
+        if not modifier_seen and self.peek_keyword('by', 'without'):
+            without = self.next().value.lower() == 'without'
+            grouping = self.parse_label_list()
+        return AggregateExpr(op, expr, param, grouping, without)
+
+    def parse_vector_selector(self, name_token):
+        name = name_token.value if name_token is not None else None
+        name_end = name_token.end if name_token is not None else None
+        quoted_name = False
+        matchers = []
+        label_section_end = None
+        needs_comma = False
+        if self.peek_type() == LEFT_BRACE:
+            self.next()
+            while self.peek_type() != RIGHT_BRACE:
+                token = self.next()
+                if token.type == IDENTIFIER:
+                    label = token.value
+                elif token.type == STRING:
+                    label = unquote(token.value)
+                else:
+                    self.position -= 1
+                    raise self.error("Expected label matcher")
+                if self.peek_type() == MATCH_OPERATOR:
+                    op = self.next().value
+                    value = unquote(self.expect(STRING).value)
+                    matchers.append(LabelMatcher(label, op, value))
+                elif token.type == STRING and name is None:
+                    # Prometheus 3 quoted metric name, like {"utf8.name"}
+                    name = label
+                    quoted_name = True
+                else:
+                    raise self.error("Expected match operator")
+                needs_comma = True
+                if self.peek_type() == COMMA:
+                    self.next()
+                    needs_comma = False
+                elif self.peek_type() != RIGHT_BRACE:
+                    raise self.error("Expected ',' or '}'")
+            label_section_end = self.expect(RIGHT_BRACE).start
+        if name is None and not matchers:
+            raise self.error("Vector selector must contain at least "
+                             "one matcher")
+        return VectorSelector(name, quoted_name, matchers, name_end,
+                              label_section_end, needs_comma)
+
+
+def parse(query):
+    """Parse a PromQL query into a tree of Node objects.
+
+    :param query: the query to parse
+    :type query: str
+    """
+    return _Parser(query).parse()
+
+
+def quote(value):
+    """Return a single quoted PromQL string literal holding value."""
+    escaped = value.replace('\\', '\\\\').replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+def label_insertions(tree):
+    """Find the places where label matchers can be added to a query.
+
+    Returns a sorted list of (position, comma, braces) tuples, one for
+    every vector selector of the parsed query. Position is the position
+    inside of the original query, comma is True if a new matcher needs
+    to be separated from the existing ones and braces is True if the
+    selector doesn't have a label section yet.
+
+    :param tree: parsed query
+    :type tree: Node
+    """
+    insertions = []
+    for node in tree.walk():
+        if not isinstance(node, VectorSelector):
+            continue
+        if node.label_section_end is None:
+            insertions.append((node.name_end, False, True))
+        else:
+            insertions.append((node.label_section_end, node.needs_comma,
+                               False))
+    insertions.sort()
+    return insertions
+
+
+def add_label_matcher(query, matcher, tree=None):
+    """Add a label matcher to every vector selector of a query.
+
+    A call like this:
+    add_label_matcher("rate(a[5m]) + b{c='d'}", "job='x'")
+    returns:
+    "rate(a{job='x'}[5m]) + b{c='d', job='x'}"
+
+    :param query: the query to modify
+    :type query: str
+    :param matcher: formatted label matcher, like "job=~'a|b'"
+    :type matcher: str
+    :param tree: the parsed query, parsed again if not set
+    :type tree: Node
+    """
+    if tree is None:
+        tree = parse(query)
+    parts = []
+    last = 0
+    for position, comma, braces in label_insertions(tree):
+        parts.append(query[last:position])
+        if braces:
+            parts.append(f"{{{matcher}}}")
+        elif comma:
+            parts.append(f", {matcher}")
+        else:
+            parts.append(matcher)
+        last = position
+    parts.append(query[last:])
+    return "".join(parts)
@@ -14,18 +14,188 @@
 
 import re
 
+from observabilityclient import cache
+from observabilityclient import promql
 from observabilityclient.utils.metric_utils import format_labels
 
 
+DEFAULT_QUERY_CACHE_SIZE = 1024
+DEFAULT_MAX_QUERY_LENGTH = 4096
+
+# Functions, which can combine or drop series of different projects
+# even if all of their input series are restricted.
+_CROSS_SERIES_FUNCTIONS = frozenset((
+    'absent', 'absent_over_time', 'scalar', 'info',
+))
+# Functions, which set the label named by their second argument.
+_LABEL_SETTING_FUNCTIONS = frozenset(('label_replace', 'label_join'))
+
+
+def check_project_separable(tree, project_label):
+    """Check that a query never mixes series of different projects.
+
+    Results of such a query can be split by the project label, because
+    each result series is computed only from series of the project in its
+    project label. That's the case when every aggregation groups by the
+    project label, every vector matching matches on the project label and
+    no function drops or rewrites the project label.
+
+    :param tree: parsed query
+    :type tree: promql.Node
+    :param project_label: name of the project label
+    :type project_label: str
+    """
+    for node in tree.walk():
+        if isinstance(node, promql.AggregateExpr):
+            if node.without == (project_label in node.grouping):
+                raise ValueError(
+                    f"Aggregation {node.op} must preserve the "
+                    f"{project_label} label"
+                )
+            if (node.op == 'count_values' and
+                    isinstance(node.param, promql.StringLiteral) and
+                    node.param.value == project_label):
+                raise ValueError(f"count_values can't overwrite the "
+                                 f"{project_label} label")
+        elif isinstance(node, promql.BinaryExpr):
+            matching = node.matching
+            if matching is not None and (
+                    matching.on != (project_label in matching.labels) or
+                    project_label in matching.include):
+                raise ValueError(
+                    f"Vector matching of {node.op} must include the "
+                    f"{project_label} label"
+                )
+        elif isinstance(node, promql.Call):
+            function = node.function.lower()
+            if function in _CROSS_SERIES_FUNCTIONS:
+                raise ValueError(f"Function {node.function} can't be used "
+                                 f"in a multi-project query")
+            if (function in _LABEL_SETTING_FUNCTIONS and
+                    len(node.args) > 1 and
+                    (not isinstance(node.args[1], promql.StringLiteral) or
+                     node.args[1].value == project_label)):
+                raise ValueError(f"Function {node.function} can't set the "
+                                 f"{project_label} label")
+
+
+class PreparedQuery:
+    """Query with precomputed places for the rbac label matcher.
+
+    Returned by PromQLRbac.prepare(). Rendering the query for a project
+    doesn't parse it again, it only joins the precomputed query parts
+    with the label matcher.
+    """
+
+    def __init__(self, query, insertions, project_label, tree=None):
+        self.query = query
+        self.project_label = project_label
+        self.tree = tree
+        self._segments = []
+        self._kinds = []
+        last = 0
+        for position, comma, braces in insertions:
+            self._segments.append(query[last:position])
+            self._kinds.append((comma, braces))
+            last = position
+        self._segments.append(query[last:])
+
+    def _render(self, formatted_labels):
+        braced = f"{{{formatted_labels}}}"
+        separated = f", {formatted_labels}"
+        parts = [self._segments[0]]
+        for (comma, braces), segment in zip(self._kinds,
+                                            self._segments[1:]):
+            if braces:
+                parts.append(braced)
+            elif comma:
+                parts.append(separated)
+            else:
+                parts.append(formatted_labels)
+            parts.append(segment)
+        return "".join(parts)
+
+    def render(self, project_id):
+        """Return the query restricted to the specified project.
+
+        :param project_id: id of the project
+        :type project_id: str
+        """
+        return self._render(format_labels({self.project_label: project_id}))
+
+    def render_projects(self, project_ids,
+                        max_length=DEFAULT_MAX_QUERY_LENGTH):
+        """Return queries restricted to any of the specified projects.
+
+        A single regex label matcher selecting all of the projects is
+        used. The projects are split into chunks, so that no query
+        is longer than max_length, unless a single project doesn't fit.
+
+        Raises ValueError if the result of the query can contain series
+        computed from more than one project, see check_project_separable.
+
+        :param project_ids: ids of the projects
+        :type project_ids: [str]
+        :param max_length: maximum length of each returned query
+        :type max_length: int
+        :returns: list of (project_ids_chunk, query) tuples
+        """
+        if self.tree is None:
+            self.tree = promql.parse(self.query)
+        check_project_separable(self.tree, self.project_label)
+
+        # NOTE: Every additional project makes each of the inserted
+        # matchers longer by its escaped id and a "|" separator.
+        insertions = len(self._kinds)
+        chunks = []
+        chunk = []
+        length = 0
+        for project_id in dict.fromkeys(project_ids):
+            alternative = re.escape(project_id)
+            growth = insertions * len(promql.quote(alternative)[1:-1] + "|")
+            if chunk and length + growth > max_length:
+                chunks.append(chunk)
+                chunk = []
+            if not chunk:
+                length = len(self._render_regex([alternative]))
+            else:
+                length += growth
+            chunk.append((project_id, alternative))
+        if chunk:
+            chunks.append(chunk)
+        return [([project_id for project_id, _ in chunk],
+                 self._render_regex([alt for _, alt in chunk]))
+                for chunk in chunks]
+
+    def _render_regex(self, alternatives):
+        return self._render(
+            f"{self.project_label}=~{promql.quote('|'.join(alternatives))}"
+        )
+
+
 class PromQLRbac:
-    def __init__(self, prom_api_client, project_id, project_label='project'):
+    def __init__(self, prom_api_client, project_id, project_label='project',
+                 query_cache_size=DEFAULT_QUERY_CACHE_SIZE):
+        """Create a new PromQLRbac.
+
+        :param prom_api_client: client used for retrieving metric names
+        :type prom_api_client: PrometheusAPIClient
+        :param project_id: id of the project to restrict the queries to
+        :type project_id: str
+        :param project_label: name of the label holding the project id
+        :type project_label: str
+        :param query_cache_size: maximum number of modified queries to
+                                 remember, 0 disables the cache
+        :type query_cache_size: int
+        """
         self.client = prom_api_client
+        self.query_cache = cache.LRUCache(query_cache_size)
 
         # NOTE(jwysogla): Since Prometheus 3, metric and label names can
         # utilize all unicode characters. But the syntax is a little different
-        # and some parts of the queries need to be quoted or escaped. The
-        # rest of this module doesn't support that right now, so use a
-        # Prometheus 2 regex and raise an exception when it doesn't match.
+        # and some parts of the queries need to be quoted or escaped. Queries
+        # with quoted names are supported by the parser, but the project
+        # label itself is still required to match the Prometheus 2 regex.
         # See https://prometheus.io/docs/concepts/data_model/
         label_name_regex = "[a-zA-Z_][a-zA-Z0-9_]*"
         if not re.fullmatch(label_name_regex, project_label):
@@ -34,137 +204,67 @@ class PromQLRbac:
                 f"label name regex: {label_name_regex}"
             )
 
+        self.project_label = project_label
         self.labels = {
             project_label: project_id
         }
 
-    def _find_label_value_end(self, query, start, quote_char):
-        end = start
-        while (end == start or query[end - 1] == '\\'):
-            # Looking for first unescaped quotes
-            end = query.find(quote_char, end + 1)
-        # returns the quote position or -1
-        return end
-
-    def _find_match_operator(self, query, start):
-        eq_sign_pos = query.find('=', start)
-        tilde_pos = query.find('~', start)
-        if eq_sign_pos == -1:
-            return tilde_pos
-        if tilde_pos == -1:
-            return eq_sign_pos
-        return min(eq_sign_pos, tilde_pos)
-
-    def _find_label_pair_end(self, query, start):
-        match_operator_pos = self._find_match_operator(query, start)
-        quote_char = "'"
-        quote_start_pos = query.find(quote_char, match_operator_pos)
-        if quote_start_pos == -1:
-            quote_char = '"'
-            quote_start_pos = query.find(quote_char, match_operator_pos)
-        end = self._find_label_value_end(query, quote_start_pos, quote_char)
-        # returns the pair end or -1
-        return end
-
-    def _find_label_section_end(self, query, start):
-        if query[start:].startswith('{}'):
-            # We have an empty label section, without any
-            # label pair
-            return start + 1
-        nearest_curly_brace_pos = None
-        while nearest_curly_brace_pos != -1:
-            pair_end = self._find_label_pair_end(query, start)
-            nearest_curly_brace_pos = query.find("}", pair_end)
-            nearest_match_operator_pos = self._find_match_operator(query,
-                                                                   pair_end)
-            if (nearest_curly_brace_pos < nearest_match_operator_pos or
-                    nearest_match_operator_pos == -1):
-                # If we have "}" before the nearest "=" or "~",
-                # then we must be at the end of the label section
-                # and the "=" or "~" is a part of the next section.
-                return nearest_curly_brace_pos
-            start = pair_end
-        # TODO(tkajinam): We should probably raise an exception here because
-        # this indicates illegal format without closing } .
-        return -1
-
-    def _insert_labels(self, query, location, comma=False, braces=False):
-        comma_str = ", " if comma else ""
-        formatted_labels = format_labels(self.labels)
-        labels_str = f"{{{formatted_labels}}}" if braces else formatted_labels
-        return (f"{query[:location]}{comma_str}"
-                f"{labels_str}"
-                f"{query[location:]}")
+    @property
+    def labels(self):
+        return self._labels
+
+    @labels.setter
+    def labels(self, labels):
+        # NOTE: The labels are formatted only once here, so they need
+        # to be reassigned instead of modified in place.
+        self._labels = labels
+        self._formatted_labels = format_labels(labels)
 
     def modify_query(self, query, metric_names=None):
         """Add rbac labels to a query.
 
+        The labels are added to every vector selector of the query,
+        whether its metric is currently stored in Prometheus or not.
+        So a metric created later can't escape the restriction.
+
         :param query: The query to modify
         :type query: str
 
-        :param metric_names: List of metric names currently stored in
-                             prometheus. For correct function of the query
-                             modification, it's important for the list to be
-                             accurate and to include all metrics across all
-                             tenants. This parameter can be unspecified or
-                             None, in which case the list will be retrieved
-                             from Prometheus by sending an API request to it.
-                             It's advised to provide the metric list when
-                             doing a query modification in a loop for
-                             performance purposes.
+        :param metric_names: Ignored, kept for compatibility. The labels
+                             used to be added only to the metric names
+                             in this list, now the parser finds every
+                             selector without retrieving the names.
         :type metric_names: list
+
+        Raises promql.PromQLSyntaxError, a ValueError subclass, if the
+        query can't be parsed.
         """
+        formatted_labels = self._formatted_labels
+        key = (query, formatted_labels)
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            return cached
 
-        if metric_names is None:
-            metric_names = self.client.label_values("__name__")
-
-        # We need to detect the locations of metric names
-        # inside the query
-        # NOTE the locations are the locations within the original query
-        name_end_locations = []
-        for name in metric_names:
-            # Regex for a metric name is: [a-zA-Z_:][a-zA-Z0-9_:]*
-            # We need to make sure, that "name" isn't just a part
-            # of a longer word, so we try to expand it by "name_regex"
-            name_regex = "[a-zA-Z_:]?[a-zA-Z0-9_:]*" + name + "[a-zA-Z0-9_:]*"
-            potential_names = re.finditer(name_regex, query)
-            for potential_name in potential_names:
-                if potential_name.group(0) == name:
-                    name_end_locations.append(potential_name.end())
-
-        name_end_locations = sorted(name_end_locations, reverse=True)
-        if len(name_end_locations) == 0:
-            name_end_locations = [0]
-        for name_end_location in name_end_locations:
-            if (name_end_location < len(query) and
-                    query[name_end_location] == "{"):
-                # There is already a label section
-                labels_end = self._find_label_section_end(
-                    query,
-                    name_end_location
-                )
-                if labels_end == name_end_location + 1:
-                    query = self._insert_labels(
-                        query,
-                        labels_end,
-                        comma=False,
-                        braces=False
-                    )
-                else:
-                    query = self._insert_labels(
-                        query,
-                        labels_end,
-                        comma=True,
-                        braces=False
-                    )
-            else:
-                query = self._insert_labels(
-                    query,
-                    name_end_location,
-                    comma=False,
-                    braces=True
-                )
-        return query
+        insertions = promql.label_insertions(promql.parse(query))
+        modified = PreparedQuery(query, insertions,
+                                 self.project_label)._render(formatted_labels)
+        self.query_cache.put(key, modified)
+        return modified
+
+    def prepare(self, query):
+        """Parse a query once to render it for many projects later.
+
+        A call like this:
+        prepare("sum(name1{label1='value'})").render("project_id")
+        will result in a query string like this:
+        "sum(name1{label1='value', project='project_id'})"
+
+        :param query: The query to prepare
+        :type query: str
+        """
+        tree = promql.parse(query)
+        insertions = promql.label_insertions(tree)
+        return PreparedQuery(query, insertions, self.project_label, tree)
 
     def append_rbac_labels(self, query):
         """Append rbac labels to queries.
@@ -180,4 +280,4 @@ class PromQLRbac:
         if any(c in query for c in "{}"):
             return self.modify_query(query)
         else:
-            return f"{query}{{{format_labels(self.labels)}}}"
+            return f"{query}{{{self._formatted_labels}}}"
@@ -0,0 +1,488 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import threading
+import time
+from unittest import mock
+
+import testtools
+
+from observabilityclient import cache
+from observabilityclient import prometheus_client
+
+
+class LRUCacheTest(testtools.TestCase):
+    def test_lru(self):
+        lru = cache.LRUCache(2)
+        lru.put("a", 1)
+        lru.put("b", 2)
+        self.assertEqual(1, lru.get("a"))
+        lru.put("c", 3)
+
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(1, lru.get("a"))
+        self.assertEqual(3, lru.get("c"))
+        self.assertEqual(2, len(lru))
+        self.assertEqual(3, lru.hits)
+        self.assertEqual(1, lru.misses)
+
+    def test_disabled(self):
+        lru = cache.LRUCache(0)
+        lru.put("a", 1)
+
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(0, len(lru))
+
+
+class SingleFlightTest(testtools.TestCase):
+    def run_concurrently(self, single_flight, keys, fn):
+        """Call single_flight.do() from a thread for each key.
+
+        fn() is blocked until all the calls are running or waiting.
+        """
+        release = threading.Event()
+        results = [None] * len(keys)
+
+        def blocking_fn():
+            release.wait()
+            return fn()
+
+        def run(i):
+            try:
+                results[i] = single_flight.do(keys[i], blocking_fn)
+            except Exception as exc:
+                results[i] = exc
+
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(len(keys))]
+        for t in threads:
+            t.start()
+        while single_flight.calls + single_flight.coalesced < len(keys):
+            time.sleep(0.001)
+        release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_coalesce(self):
+        single_flight = cache.SingleFlight()
+        fn = mock.Mock(side_effect=lambda: object())
+
+        ret = self.run_concurrently(single_flight, ["a", "a", "a", "b"], fn)
+
+        self.assertEqual(2, fn.call_count)
+        self.assertEqual(2, single_flight.calls)
+        self.assertEqual(2, single_flight.coalesced)
+        self.assertIs(ret[0], ret[1])
+        self.assertIs(ret[0], ret[2])
+        self.assertIsNot(ret[0], ret[3])
+        self.assertEqual(0, len(single_flight))
+
+    def test_coalesce_error(self):
+        single_flight = cache.SingleFlight()
+        error = ValueError("failed")
+
+        ret = self.run_concurrently(single_flight, ["a", "a"],
+                                    mock.Mock(side_effect=error))
+
+        self.assertEqual([error, error], ret)
+        self.assertEqual(0, len(single_flight))
+
+    def test_sequential_calls(self):
+        single_flight = cache.SingleFlight()
+        fn = mock.Mock(side_effect=[1, 2])
+
+        self.assertEqual(1, single_flight.do("a", fn))
+        self.assertEqual(2, single_flight.do("a", fn))
+        self.assertEqual(0, single_flight.coalesced)
+
+
+class RangeQueryCacheTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.fetched = []
+        self.cache = cache.RangeQueryCache()
+        time_patcher = mock.patch.object(time, 'time', return_value=100000)
+        time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+
+    def fetch(self, start, end, step=10):
+        self.fetched.append((start, end))
+        values = []
+        t = start
+        while t <= end:
+            values.append([t, str(t)])
+            t += step
+        return [prometheus_client.PrometheusRangeMetric({
+            "metric": {"__name__": "test1"},
+            "values": values
+        })]
+
+    def query_range(self, start, end, query="test1", scope=None):
+        return self.cache.query_range(self.fetch, query, start, end, 10,
+                                      scope=scope)
+
+    def assertTimestamps(self, start, end, result):
+        self.assertEqual(1, len(result))
+        self.assertEqual([float(t) for t in range(start, end + 1, 10)],
+                         list(result[0].timestamps))
+        self.assertEqual(list(result[0].timestamps), list(result[0].values))
+
+    def test_sliding_window_fetches_only_tail(self):
+        ret = self.query_range(0, 600)
+        self.assertTimestamps(0, 600, ret)
+
+        ret = self.query_range(60, 660)
+        self.assertTimestamps(60, 660, ret)
+
+        self.assertEqual([(0, 600), (610, 660)], self.fetched)
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_fetches_only_head(self):
+        self.query_range(300, 600)
+        ret = self.query_range(100, 400)
+
+        self.assertTimestamps(100, 400, ret)
+        self.assertEqual([(300, 600), (100, 290)], self.fetched)
+
+    def test_contained_range_is_served_from_cache(self):
+        self.query_range(0, 600)
+        ret = self.query_range(100, 200)
+
+        self.assertTimestamps(100, 200, ret)
+        self.assertEqual([(0, 600)], self.fetched)
+
+    def test_results_dont_share_cached_samples(self):
+        for _ in range(2):
+            ret = self.query_range(0, 600)
+            for metric in ret:
+                for i in range(len(metric)):
+                    metric.values[i] *= 100
+                metric.labels["__name__"] = "modified"
+
+        ret = self.query_range(0, 600)
+
+        self.assertEqual([(0, 600)], self.fetched)
+        self.assertTimestamps(0, 600, ret)
+        self.assertEqual({"__name__": "test1"}, ret[0].labels)
+
+    def test_range_is_aligned_to_step(self):
+        self.query_range(3, 605)
+
+        self.assertEqual([(0, 600)], self.fetched)
+
+    def test_disjoint_range_replaces_extent(self):
+        self.query_range(0, 100)
+        self.query_range(500, 600)
+        self.query_range(0, 100)
+
+        self.assertEqual([(0, 100), (500, 600), (0, 100)], self.fetched)
+        self.assertEqual(1, len(self.cache))
+
+    def test_fresh_samples_are_not_cached(self):
+        with mock.patch.object(time, 'time', return_value=665):
+            self.query_range(0, 660)
+            ret = self.query_range(0, 660)
+
+        self.assertTimestamps(0, 660, ret)
+        self.assertEqual([(0, 660), (610, 660)], self.fetched)
+
+    def test_key_includes_query_and_scope(self):
+        self.query_range(0, 100)
+        self.query_range(0, 100, query="  test1 ")
+        self.query_range(0, 100, query="test2")
+        self.query_range(0, 100, scope=(("project", "other"),))
+
+        self.assertEqual([(0, 100), (0, 100), (0, 100)], self.fetched)
+
+    def test_lru_eviction(self):
+        self.query_range(0, 100, query="test1")
+        size = self.cache.size
+        self.cache.max_bytes = size * 2
+
+        self.query_range(0, 100, query="test2")
+        self.query_range(0, 100, query="test1")
+        self.query_range(0, 100, query="test3")
+
+        self.assertEqual(2, len(self.cache))
+        self.assertLessEqual(self.cache.size, self.cache.max_bytes)
+
+        self.fetched = []
+        self.query_range(0, 100, query="test1")
+        self.query_range(0, 100, query="test2")
+        self.assertEqual([(0, 100)], self.fetched)
+
+    def test_normalize_query(self):
+        self.assertEqual("sum(rate(a{b=' x  y '}[5m]))",
+                         cache.normalize_query(
+                             " sum(rate(a{b=' x  y '}[5m]))\n"))
+        self.assertEqual('a + b{c="  "}',
+                         cache.normalize_query('a  +\tb{c="  "}'))
+
+
+class InstantQueryCacheTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.fetched = []
+        self.now = 100010
+        time_patcher = mock.patch.object(time, 'time',
+                                         side_effect=lambda: self.now)
+        time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+
+    def fetch(self, t):
+        self.fetched.append(t)
+        return [prometheus_client.PrometheusMetric({
+            "metric": {"__name__": "test1", "instance": "a" * 100},
+            "value": [t, "1"]
+        })]
+
+    def test_aligned_time(self):
+        c = cache.InstantQueryCache(resolution="15s")
+
+        ret1 = c.query(self.fetch, "test1")
+        self.now = 100012
+        ret2 = c.query(self.fetch, " test1\n")
+
+        self.assertEqual([100005], self.fetched)
+        self.assertEqual(100005, ret1[0].timestamp)
+        self.assertEqual((ret1[0].labels, ret1[0].timestamp, ret1[0].value),
+                         (ret2[0].labels, ret2[0].timestamp, ret2[0].value))
+        self.assertEqual((1, 1), (c.hits, c.misses))
+
+    def test_results_are_copies(self):
+        c = cache.InstantQueryCache()
+
+        for _ in range(2):
+            ret = c.query(self.fetch, "test1")
+            ret[0].labels["__name__"] = "modified"
+            ret.append(None)
+
+        ret = c.query(self.fetch, "test1")
+
+        self.assertEqual(1, len(self.fetched))
+        self.assertEqual(1, len(ret))
+        self.assertEqual("test1", ret[0].labels["__name__"])
+
+    def test_matrix_result(self):
+        def fetch(t):
+            self.fetched.append(t)
+            return [prometheus_client.PrometheusRangeMetric({
+                "metric": {"__name__": "test1"},
+                "values": [[t - 60, "1"], [t - 30, "2"], [t, "3"]]
+            })]
+        c = cache.InstantQueryCache()
+
+        ret = c.query(fetch, "test1[1m]")
+        ret[0].values[0] = 100
+        ret[0].labels["__name__"] = "modified"
+        ret = c.query(fetch, "test1[1m]")
+
+        self.assertEqual(1, len(self.fetched))
+        self.assertEqual([1.0, 2.0, 3.0], list(ret[0].values))
+        self.assertEqual({"__name__": "test1"}, ret[0].labels)
+        self.assertEqual(
+            cache._labels_size({"__name__": "test1"}) + 16 * 3, c.size)
+
+    def test_next_window(self):
+        c = cache.InstantQueryCache(resolution=15)
+
+        c.query(self.fetch, "test1")
+        self.now = 100030
+        c.query(self.fetch, "test1")
+
+        self.assertEqual([100005, 100020], self.fetched)
+        # The result of the previous window has expired
+        self.assertEqual(1, len(c))
+
+    def test_ttl(self):
+        c = cache.InstantQueryCache(resolution=60, ttl=5)
+
+        c.query(self.fetch, "test1")
+        self.now = 100014
+        c.query(self.fetch, "test1")
+        self.now = 100016
+        c.query(self.fetch, "test1")
+
+        self.assertEqual([99960, 99960], self.fetched)
+
+    def test_scope(self):
+        c = cache.InstantQueryCache()
+
+        c.query(self.fetch, "test1", scope=(("project", "p1"),))
+        c.query(self.fetch, "test1", scope=(("project", "p2"),))
+        c.query(self.fetch, "test1", scope=(("project", "p1"),))
+
+        self.assertEqual(2, len(self.fetched))
+
+    def test_max_bytes(self):
+        size = cache._InstantResult(0, self.fetch(0)).size
+        c = cache.InstantQueryCache(max_bytes=size * 2)
+
+        c.query(self.fetch, "test1")
+        c.query(self.fetch, "test2")
+        c.query(self.fetch, "test1")
+        c.query(self.fetch, "test3")
+
+        self.assertEqual(2, len(c))
+        self.assertLessEqual(c.size, c.max_bytes)
+        self.fetched = []
+        c.query(self.fetch, "test1")
+        c.query(self.fetch, "test2")
+        self.assertEqual([100005], self.fetched)
+
+
+class PrometheusAPIClientInstantCacheTest(testtools.TestCase):
+    def test_query_uses_cache(self):
+        c = prometheus_client.PrometheusAPIClient("localhost:9090")
+        c.set_instant_cache(cache.InstantQueryCache(resolution=15))
+        returned = {"data": {"resultType": "vector", "result": [
+            {"metric": {"__name__": "up"}, "value": [100005, "1"]}
+        ]}}
+
+        with mock.patch.object(time, 'time', return_value=100010), \
+                mock.patch.object(c, '_get', return_value=returned) as m:
+            c.query("up", cache_scope="p1")
+            ret = c.query("up", cache_scope="p1")
+            c.query("up", time=100000)
+
+        self.assertEqual([
+            mock.call("query", {"query": "up", "time": 100005}),
+            mock.call("query", {"query": "up", "time": 100000}),
+        ], m.call_args_list)
+        self.assertEqual("1", ret[0].value)
+
+    def test_shared_cache_separates_servers(self):
+        instant_cache = cache.InstantQueryCache(resolution=15)
+        returned = {"data": {"resultType": "vector", "result": [
+            {"metric": {"__name__": "up"}, "value": [100005, "1"]}
+        ]}}
+        clients = []
+        for host in ("prometheus1:9090", "prometheus2:9090"):
+            c = prometheus_client.PrometheusAPIClient(host)
+            c.set_instant_cache(instant_cache)
+            clients.append(c)
+
+        with mock.patch.object(time, 'time', return_value=100010), \
+                mock.patch.object(prometheus_client.PrometheusAPIClient,
+                                  '_get', return_value=returned) as m:
+            for c in clients + clients:
+                c.query("up", cache_scope="p1")
+
+        self.assertEqual(2, m.call_count)
+        self.assertEqual(2, len(instant_cache))
+
+
+class PrometheusAPIClientRangeCacheTest(testtools.TestCase):
+    def test_query_range_uses_cache(self):
+        c = prometheus_client.PrometheusAPIClient("localhost:9090")
+        c.set_range_cache(cache.RangeQueryCache())
+        returned = [prometheus_client.PrometheusRangeMetric({
+            "metric": {"__name__": "test1"},
+            "values": [[0, "1"], [30, "2"]]
+        })]
+
+        with mock.patch.object(c, '_query_range',
+                               return_value=returned) as m:
+            c.query_range("test1", 0, 30, "30s")
+            ret = c.query_range("test1", 0, 30, "30s")
+
+        m.assert_called_once_with("test1", 0.0, 30.0, "30s")
+        self.assertEqual([0.0, 30.0], list(ret[0].timestamps))
+
+    def test_shared_cache_separates_servers(self):
+        range_cache = cache.RangeQueryCache()
+        returned = [prometheus_client.PrometheusRangeMetric({
+            "metric": {"__name__": "test1"},
+            "values": [[0, "1"], [30, "2"]]
+        })]
+        clients = []
+        for host in ("prometheus1:9090", "prometheus2:9090"):
+            c = prometheus_client.PrometheusAPIClient(host)
+            c.set_range_cache(range_cache)
+            clients.append(c)
+
+        with mock.patch.object(prometheus_client.PrometheusAPIClient,
+                               '_query_range', return_value=returned) as m:
+            for c in clients + clients:
+                c.query_range("test1", 0, 30, "30s", cache_scope="p1")
+
+        self.assertEqual(2, m.call_count)
+        self.assertEqual(2, len(range_cache))
+
+
+class PrometheusAPIClientSingleFlightTest(testtools.TestCase):
+    def test_get_uses_single_flight(self):
+        c = prometheus_client.PrometheusAPIClient("localhost:9090")
+        single_flight = mock.Mock()
+        single_flight.do.return_value = {"data": []}
+        c.set_single_flight(single_flight)
+
+        c._get("series", {"match[]": ["a", "b"]})
+
+        key, fn = single_flight.do.call_args[0]
+        self.assertEqual((c._session, "http://localhost:9090/api/v1/series",
+                          (("match[]", ("a", "b")),)), key)
+        with mock.patch.object(c, '_request') as m:
+            fn()
+        m.assert_called_once_with("series", {"match[]": ["a", "b"]})
+
+    def test_callers_get_own_copies(self):
+        c = prometheus_client.PrometheusAPIClient("localhost:9090")
+        decoded = {"status": "success",
+                   "data": [{"__name__": "b"}, {"__name__": "a"}]}
+        single_flight = mock.Mock()
+        single_flight.do.return_value = decoded
+        c.set_single_flight(single_flight)
+
+        ret1 = c.series(["a", "b"])
+        ret1.sort(key=lambda labels: labels["__name__"])
+        ret1[0]["job"] = "x"
+        ret1.append({"__name__": "c"})
+        ret2 = c.series(["a", "b"])
+
+        self.assertEqual([{"__name__": "b"}, {"__name__": "a"}], ret2)
+        self.assertEqual([{"__name__": "b"}, {"__name__": "a"}],
+                         decoded["data"])
+
+    def test_query_coalesced(self):
+        c = prometheus_client.PrometheusAPIClient("localhost:9090")
+        single_flight = cache.SingleFlight()
+        c.set_single_flight(single_flight)
+        returned = {"data": {"resultType": "vector", "result": [
+            {"metric": {"__name__": "up"}, "value": [0, "1"]}
+        ]}}
+        release = threading.Event()
+        results = []
+
+        def request(endpoint, params):
+            release.wait()
+            return returned
+
+        with mock.patch.object(c, '_request', side_effect=request) as m:
+            threads = [threading.Thread(
+                target=lambda: results.append(c.query("up"))
+            ) for _ in range(3)]
+            for t in threads:
+                t.start()
+            while single_flight.coalesced < 2:
+                time.sleep(0.001)
+            release.set()
+            for t in threads:
+                t.join()
+
+        m.assert_called_once_with("query", {"query": "up"})
+        self.assertEqual(["up"] * 3,
+                         [r[0].labels["__name__"] for r in results])
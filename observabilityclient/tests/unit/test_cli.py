@@ -12,11 +12,15 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import io
 from unittest import mock
 
+from osc_lib import exceptions
 import testtools
 
+from observabilityclient import export
 from observabilityclient.prometheus_client import PrometheusMetric
+from observabilityclient.prometheus_client import PrometheusRangeMetric
 from observabilityclient.utils import metric_utils
 from observabilityclient.v1 import cli
 
@@ -45,14 +49,33 @@ class CliTest(testtools.TestCase):
                                   return_value=metric_names) as m:
             # NOTE: disable-rbac option is NOOP, RBAC is disabled by default
             ret1 = cli_list.take_action(test_parsed_args_enabled)
-            m.assert_called_with(disable_rbac=True)
+            m.assert_called_with(disable_rbac=True, start=None, limit=None)
 
             ret2 = cli_list.take_action(test_parsed_args_disabled)
-            m.assert_called_with(disable_rbac=True)
+            m.assert_called_with(disable_rbac=True, start=None, limit=None)
 
         self.assertEqual(ret1, expected)
         self.assertEqual(ret2, expected)
 
+    def test_list_since(self):
+        cli_list = cli.List(mock.Mock(), mock.Mock())
+
+        parser = cli_list.get_parser("metric list")
+        test_parsed_args = parser.parse_args([
+            "--since", "1h",
+            "--limit", "10"
+        ])
+
+        with mock.patch.object(metric_utils, 'get_client',
+                               return_value=self.client), \
+                mock.patch.object(self.client.query, 'list',
+                                  return_value=['name1']) as m, \
+                mock.patch.object(cli.time, 'time', return_value=10000.0):
+            ret = cli_list.take_action(test_parsed_args)
+
+        m.assert_called_with(disable_rbac=True, start=6400.0, limit=10)
+        self.assertEqual((['metric_name'], [['name1']]), ret)
+
     def test_show(self):
         metric = {
             'value': [123456, 12],
@@ -83,8 +106,8 @@ class CliTest(testtools.TestCase):
             ret2 = cli_show.take_action(test_parsed_args_disabled)
             m.assert_called_with('metric_name', disable_rbac=True)
 
-        self.assertEqual(ret1, expected)
-        self.assertEqual(ret2, expected)
+        self.assertEqual(expected, (ret1[0], list(ret1[1])))
+        self.assertEqual(expected, (ret2[0], list(ret2[1])))
 
     def test_query(self):
         query = ("some_query{label!~'not_this_value'} - "
@@ -121,8 +144,166 @@ class CliTest(testtools.TestCase):
             ret2 = cli_query.take_action(test_parsed_args_disabled)
             m.assert_called_with(query, disable_rbac=True)
 
-        self.assertEqual(ret1, expected)
-        self.assertEqual(ret2, expected)
+        self.assertEqual(expected, (ret1[0], list(ret1[1])))
+        self.assertEqual(expected, (ret2[0], list(ret2[1])))
+
+    def test_query_matrix(self):
+        query = "some_query[1m]"
+        prom_metric = [PrometheusRangeMetric({
+            'values': [[123456, '12'], [123486, '13']],
+            'metric': {'label1': 'value1'}
+        })]
+        expected = (['label1', 'timestamp', 'value'],
+                    [['value1', 123456.0, 12.0], ['value1', 123486.0, 13.0]])
+
+        cli_query = cli.Query(mock.Mock(), mock.Mock())
+        parser = cli_query.get_parser("metric query")
+
+        with mock.patch.object(metric_utils, 'get_client',
+                               return_value=self.client), \
+                mock.patch.object(self.client.query, 'query',
+                                  return_value=prom_metric):
+            ret = cli_query.take_action(parser.parse_args([query]))
+
+        self.assertEqual(expected, (ret[0], list(ret[1])))
+
+    def test_query_range(self):
+        query = "some_query{label!~'not_this_value'}"
+
+        metric = {
+            'values': [[123456, '12'], [123486, '13']],
+            'metric': {'label1': 'value1'}
+        }
+
+        prom_metric = [PrometheusRangeMetric(metric)]
+        expected = (['label1', 'timestamp', 'value'],
+                    [['value1', 123456.0, 12.0], ['value1', 123486.0, 13.0]])
+
+        cli_query = cli.Query(mock.Mock(), mock.Mock())
+
+        parser = cli_query.get_parser("metric query")
+        test_parsed_args = parser.parse_args([
+            query,
+            "--start", "123456",
+            "--end", "123486",
+            "--step", "30s"
+        ])
+
+        with mock.patch.object(metric_utils, 'get_client',
+                               return_value=self.client), \
+                mock.patch.object(self.client.query, 'query_range',
+                                  return_value=prom_metric) as m:
+            ret = cli_query.take_action(test_parsed_args)
+            m.assert_called_with(query, "123456", "123486", "30s",
+                                 disable_rbac=True)
+
+        self.assertEqual(expected, (ret[0], list(ret[1])))
+
+    def test_query_range_missing_arguments(self):
+        cli_query = cli.Query(mock.Mock(), mock.Mock())
+
+        parser = cli_query.get_parser("metric query")
+        test_parsed_args = parser.parse_args([
+            "some_query",
+            "--start", "123456",
+        ])
+
+        with mock.patch.object(metric_utils, 'get_client',
+                               return_value=self.client):
+            self.assertRaises(exceptions.CommandError,
+                              cli_query.take_action, test_parsed_args)
+
+    def test_query_stream(self):
+        metric = {
+            'value': [123456, '12'],
+            'metric': {'label1': 'value1'}
+        }
+        prom_metric = iter([PrometheusMetric(metric)])
+        app = mock.Mock()
+        app.stdout = io.StringIO()
+        cli_query = cli.Query(app, mock.Mock())
+
+        parser = cli_query.get_parser("metric query")
+        test_parsed_args = parser.parse_args([
+            "some_query",
+            "--stream", "csv",
+            "-c", "label1",
+            "-c", "value"
+        ])
+
+        with mock.patch.object(metric_utils, 'get_client',
+                               return_value=self.client), \
+                mock.patch.object(self.client.query, 'query',
+                                  return_value=prom_metric) as m:
+            cli_query.run(test_parsed_args)
+            m.assert_called_with("some_query", disable_rbac=True,
+                                 stream=True)
+
+        self.assertEqual("label1,value\nvalue1,12\n", app.stdout.getvalue())
+
+    def test_show_stream(self):
+        metric = {
+            'value': [123456, '12'],
+            'metric': {'label1': 'value1'}
+        }
+        prom_metric = iter([PrometheusMetric(metric)])
+        app = mock.Mock()
+        app.stdout = io.StringIO()
+        cli_show = cli.Show(app, mock.Mock())
+
+        parser = cli_show.get_parser("metric show")
+        test_parsed_args = parser.parse_args([
+            "metric_name",
+            "--stream", "ndjson"
+        ])
+
+        with mock.patch.object(metric_utils, 'get_client',
+                               return_value=self.client), \
+                mock.patch.object(self.client.query, 'show',
+                                  return_value=prom_metric) as m:
+            cli_show.run(test_parsed_args)
+            m.assert_called_with("metric_name", disable_rbac=True,
+                                 stream=True)
+
+        self.assertEqual('{"metric": {"label1": "value1"}, '
+                         '"timestamp": 123456, "value": "12"}\n',
+                         app.stdout.getvalue())
+
+    def test_export(self):
+        cli_export = cli.Export(mock.Mock(), mock.Mock())
+
+        parser = cli_export.get_parser("metric export")
+        test_parsed_args = parser.parse_args([
+            "up",
+            "--start", "2024-01-01T00:00:00Z",
+            "--end", "2024-02-01T00:00:00Z",
+            "--step", "60s",
+            "--output-dir", "/tmp/export",
+            "--shard-label", "job",
+            "--shards", "4",
+            "--no-resume"
+        ])
+
+        with mock.patch.object(metric_utils, 'get_client',
+                               return_value=self.client), \
+                mock.patch.object(self.client.query, 'export') as m:
+            cli_export.take_action(test_parsed_args)
+
+        m.assert_called_once_with(
+            "up", "2024-01-01T00:00:00Z", "2024-02-01T00:00:00Z", "60s",
+            "/tmp/export", window=86400, shard_label="job", shards=4,
+            max_workers=4, output_format=None, resume=False,
+            disable_rbac=True, progress=cli_export._print_progress)
+
+    def test_export_progress(self):
+        app = mock.Mock(stderr=io.StringIO())
+        cli_export = cli.Export(app, mock.Mock())
+
+        cli_export._print_progress(export.ExportProgress(
+            done=1, total=4, samples=2000, bytes=3000000, elapsed=2))
+
+        self.assertEqual("1/4 files, 2000 samples, 1000 samples/s, "
+                         "1.50 MB/s\n", app.stderr.getvalue())
 
     def test_delete(self):
         match1 = "some_label_name"
@@ -0,0 +1,163 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
+
+import testtools
+
+from observabilityclient import export
+from observabilityclient.frame import MetricFrame
+from observabilityclient.prometheus_client import PrometheusRangeMetric
+from observabilityclient.v1 import python_api
+
+
+class StubPrometheus:
+    """Prometheus serving two series sampled every 10 seconds."""
+
+    SERIES = [{'__name__': 'up', 'job': 'a'}, {'__name__': 'up', 'job': 'b'}]
+
+    def __init__(self):
+        self.queries = []
+        self.series_calls = []
+        self.lock = threading.Lock()
+
+    def series(self, matches, stream=False, start=None, end=None):
+        self.series_calls.append((matches, start, end))
+        return iter(self.SERIES)
+
+    def query_range(self, query, start, end, step, split_interval=None,
+                    cache_scope=None):
+        with self.lock:
+            self.queries.append((query, start, end))
+        points = range(int(start), int(end) + 1, int(step))
+        return [PrometheusRangeMetric({
+            'metric': labels,
+            'values': [[t, str(t / 10)] for t in points]
+        }) for labels in self.SERIES
+            if "job=~" not in query or f"'{labels['job']}'" in query]
+
+
+class ExportTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.prom = StubPrometheus()
+        client = mock.Mock()
+        client.prometheus_client = self.prom
+        self.manager = python_api.QueryManager(client)
+
+    def read_chunk(self, name):
+        path = os.path.join(self.directory, name + ".frame.gz")
+        with gzip.open(path, 'rb') as f:
+            return MetricFrame.read(f)
+
+    def test_export(self):
+        progress = []
+        ret = self.manager.export("up", 0, 50, 10, self.directory,
+                                  window=30, output_format='frame',
+                                  progress=progress.append)
+
+        self.assertEqual(2, ret.total)
+        self.assertEqual(2, ret.done)
+        self.assertEqual(12, ret.samples)
+        self.assertEqual([1, 2], sorted(p.done for p in progress))
+        self.assertEqual([("up", 0, 20), ("up", 30, 50)],
+                         sorted(self.prom.queries))
+        chunk = self.read_chunk("00001-000")
+        self.assertTrue(chunk.is_range)
+        self.assertEqual(['a', 'a', 'a', 'b', 'b', 'b'], chunk.label('job'))
+        self.assertEqual([30.0, 40.0, 50.0] * 2, list(chunk.timestamps))
+        self.assertEqual([3.0, 4.0, 5.0] * 2, list(chunk.values))
+
+    def test_export_shards(self):
+        self.manager.export("up", 0, 20, 10, self.directory,
+                            shard_label='job', shards=2,
+                            output_format='frame')
+
+        self.assertEqual([(["up"], 0, 20)], self.prom.series_calls)
+        self.assertEqual([("up{job=~'a'}", 0, 20), ("up{job=~'b'}", 0, 20)],
+                         sorted(self.prom.queries))
+        self.assertEqual(['a'] * 3, self.read_chunk("00000-000").label('job'))
+        self.assertEqual(['b'] * 3, self.read_chunk("00000-001").label('job'))
+
+    def test_export_shards_requires_selector(self):
+        self.assertRaises(ValueError, self.manager.export, "sum(up)", 0, 20,
+                          10, self.directory, shard_label='job', shards=2,
+                          output_format='frame')
+        self.assertEqual([], self.prom.series_calls)
+
+    def test_export_resume(self):
+        original = self.prom.query_range
+
+        def query_range(query, start, end, step, **kwargs):
+            if start == 30:
+                raise RuntimeError("interrupted")
+            return original(query, start, end, step, **kwargs)
+
+        with mock.patch.object(self.prom, 'query_range',
+                               side_effect=query_range):
+            self.assertRaises(RuntimeError, self.manager.export, "up",
+                              0, 50, 10, self.directory, window=30,
+                              max_workers=1, output_format='frame')
+
+        with open(os.path.join(self.directory,
+                               export.CHECKPOINT_FILE_NAME)) as f:
+            self.assertEqual(["00000-000"], json.load(f)['done'])
+
+        self.prom.queries = []
+        ret = self.manager.export("up", 0, 50, 10, self.directory,
+                                  window=30, output_format='frame')
+
+        self.assertEqual([("up", 30, 50)], self.prom.queries)
+        self.assertEqual(2, ret.done)
+        self.assertEqual(6, ret.samples)
+
+    def test_export_no_resume(self):
+        self.manager.export("up", 0, 20, 10, self.directory,
+                            output_format='frame')
+        self.manager.export("up", 0, 20, 10, self.directory,
+                            output_format='frame', resume=False)
+
+        self.assertEqual(2, len(self.prom.queries))
+
+    def test_export_different_parameters(self):
+        self.manager.export("up", 0, 20, 10, self.directory,
+                            output_format='frame')
+
+        self.assertRaises(ValueError, self.manager.export, "up", 0, 30, 10,
+                          self.directory, output_format='frame')
+
+    def test_export_parquet_missing(self):
+        with mock.patch.object(export, 'parquet', None):
+            self.assertEqual('frame', export.default_format())
+            self.assertRaises(ImportError, self.manager.export, "up", 0, 20,
+                              10, self.directory, output_format='parquet')
+
+    def test_export_parquet(self):
+        if export.parquet is None:
+            self.skipTest("pyarrow isn't installed")
+        self.manager.export("up", 0, 20, 10, self.directory,
+                            output_format='parquet')
+
+        table = export.parquet.read_table(
+            os.path.join(self.directory, "00000-000.parquet")
+        )
+        self.assertEqual(6, table.num_rows)
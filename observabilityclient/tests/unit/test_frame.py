@@ -0,0 +1,159 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import io
+import math
+from unittest import mock
+
+import testtools
+
+from observabilityclient import frame
+from observabilityclient.frame import MetricFrame
+from observabilityclient.prometheus_client import PrometheusMetric
+from observabilityclient.prometheus_client import PrometheusRangeMetric
+
+
+def vector_metrics():
+    return [
+        PrometheusMetric({'metric': {'__name__': 'm', 'project': 'p1'},
+                          'value': [100, '1']}),
+        PrometheusMetric({'metric': {'__name__': 'm', 'project': 'p2',
+                                     'job': 'j'},
+                          'value': [100.5, '2.5']}),
+        PrometheusMetric({'metric': {'__name__': 'm', 'project': 'p1'},
+                          'value': [101, 'NaN']}),
+    ]
+
+
+def range_metrics():
+    return [
+        PrometheusRangeMetric({'metric': {'project': 'p1'},
+                               'values': [[100, '1'], [130, '2']]}),
+        PrometheusRangeMetric({'metric': {'project': 'p2', 'job': 'j'},
+                               'values': [[100, '3']]}),
+    ]
+
+
+class MetricFrameTest(testtools.TestCase):
+    def test_from_metrics(self):
+        f = MetricFrame.from_metrics(vector_metrics())
+
+        self.assertEqual(['__name__', 'job', 'project'], f.columns)
+        self.assertEqual(3, len(f))
+        self.assertFalse(f.is_range)
+        self.assertEqual([0, 1, 0], list(f.codes['project']))
+        self.assertEqual(['p1', 'p2'], f.categories['project'])
+        self.assertEqual([None, 'j', None], f.label('job'))
+        self.assertEqual([100.0, 100.5, 101.0], list(f.timestamps))
+        self.assertEqual([1.0, 2.5], list(f.values)[:2])
+        self.assertTrue(math.isnan(f.values[2]))
+
+    def test_from_metrics_range(self):
+        f = MetricFrame.from_metrics(range_metrics())
+
+        self.assertTrue(f.is_range)
+        self.assertEqual(3, len(f))
+        self.assertEqual(['p1', 'p1', 'p2'], f.label('project'))
+        self.assertEqual([None, None, 'j'], f.label('job'))
+        self.assertEqual([100.0, 130.0, 100.0], list(f.timestamps))
+        self.assertEqual([1.0, 2.0, 3.0], list(f.values))
+
+    def test_from_metrics_empty(self):
+        f = MetricFrame.from_metrics([])
+
+        self.assertEqual([], f.columns)
+        self.assertEqual(0, len(f))
+        self.assertFalse(f.is_range)
+
+    def test_write_read(self):
+        f = MetricFrame.from_metrics(range_metrics())
+        data = io.BytesIO()
+
+        f.write(data)
+        data.seek(0)
+        ret = MetricFrame.read(data)
+
+        self.assertTrue(ret.is_range)
+        self.assertEqual(f.columns, ret.columns)
+        self.assertEqual(f.categories, ret.categories)
+        self.assertEqual([-1, -1, 0], list(ret.codes['job']))
+        self.assertEqual(list(f.timestamps), list(ret.timestamps))
+        self.assertEqual(list(f.values), list(ret.values))
+
+    def test_read_invalid(self):
+        self.assertRaises(ValueError, MetricFrame.read,
+                          io.BytesIO(b"not a frame"))
+        data = io.BytesIO()
+        MetricFrame.from_metrics(vector_metrics()).write(data)
+        self.assertRaises(ValueError, MetricFrame.read,
+                          io.BytesIO(data.getvalue()[:-1]))
+
+    def test_format_value(self):
+        self.assertEqual('12', frame.format_value(12.0))
+        self.assertEqual('0.5', frame.format_value(0.5))
+        self.assertEqual('+Inf', frame.format_value(math.inf))
+        self.assertEqual('-Inf', frame.format_value(-math.inf))
+        self.assertEqual('NaN', frame.format_value(math.nan))
+        self.assertEqual('100000000000000000000',
+                         frame.format_value(1e20))
+        self.assertEqual('0.00000125', frame.format_value(1.25e-6))
+
+    def test_to_numpy(self):
+        if frame.numpy is None:
+            self.skipTest("NumPy isn't installed")
+        f = MetricFrame.from_metrics(vector_metrics())
+
+        ret = f.to_numpy()
+
+        self.assertEqual([None, 'j', None], list(ret['job']))
+        self.assertEqual(['p1', 'p2', 'p1'], list(ret['project']))
+        self.assertEqual([100.0, 100.5, 101.0], list(ret['timestamp']))
+        # The value column shares the memory of the frame
+        f.values[0] = 42.0
+        self.assertEqual(42.0, ret['value'][0])
+
+    def test_to_numpy_missing(self):
+        f = MetricFrame.from_metrics(vector_metrics())
+        with mock.patch.object(frame, 'numpy', None):
+            self.assertRaises(ImportError, f.to_numpy)
+
+    def test_to_pandas(self):
+        if frame.pandas is None or frame.numpy is None:
+            self.skipTest("pandas isn't installed")
+        df = MetricFrame.from_metrics(vector_metrics()).to_pandas()
+
+        self.assertEqual(['__name__', 'job', 'project', 'timestamp',
+                          'value'], list(df.columns))
+        self.assertEqual(['p1', 'p2', 'p1'], list(df['project']))
+        self.assertTrue(df['job'].isna()[0])
+
+    def test_to_pandas_missing(self):
+        f = MetricFrame.from_metrics(vector_metrics())
+        with mock.patch.object(frame, 'pandas', None):
+            self.assertRaises(ImportError, f.to_pandas)
+
+    def test_to_arrow(self):
+        if frame.pyarrow is None:
+            self.skipTest("pyarrow isn't installed")
+        table = MetricFrame.from_metrics(range_metrics()).to_arrow()
+
+        self.assertEqual(['job', 'project', 'timestamp', 'value'],
+                         table.column_names)
+        self.assertEqual([None, None, 'j'], table['job'].to_pylist())
+        self.assertEqual([1.0, 2.0, 3.0], table['value'].to_pylist())
+
+    def test_to_arrow_missing(self):
+        f = MetricFrame.from_metrics(vector_metrics())
+        with mock.patch.object(frame, 'pyarrow', None):
+            self.assertRaises(ImportError, f.to_arrow)
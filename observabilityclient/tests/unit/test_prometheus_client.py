@@ -12,8 +12,14 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import array
+import asyncio
+import json
+import math
+import socket
 from unittest import mock
 
+from keystoneauth1 import session
 import requests
 
 import testtools
@@ -63,6 +69,7 @@ class PrometheusAPIClientTestBase(testtools.TestCase):
     class GoodResponse:
         def __init__(self):
             self.status_code = 200
+            self.content = b'{"status": "success"}'
 
         def json(self):
             return {"status": "success"}
@@ -101,7 +108,54 @@ class PrometheusAPIClientTest(PrometheusAPIClientTestBase):
         m.assert_called_with(expected_url,
                              params=expected_params,
                              headers={'Accept': 'application/json',
-                                      'Accept-Encoding': 'identity'})
+                                      'Accept-Encoding': 'gzip'})
+
+    def test_get_compression(self):
+        small = self.GoodResponse()
+        large = self.GoodResponse()
+        large.content += b' ' * 4096
+        with mock.patch.object(requests.Session, 'get',
+                               side_effect=[small, small, large, small,
+                                            small]) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            c._get("labels")
+            # The small response makes the next one uncompressed
+            c._get("labels")
+            c._get("series")
+            c._get("series")
+            c.set_compression(enabled=False)
+            c._get("query")
+
+        self.assertEqual(['gzip', 'identity', 'gzip', 'gzip', 'identity'],
+                         [call.kwargs['headers']['Accept-Encoding']
+                          for call in m.call_args_list])
+
+    def test_get_post(self):
+        query = "sum(up{project=~'" + "|".join(
+            f"project{i}" for i in range(300)) + "'})"
+        with mock.patch.object(requests.Session, 'post',
+                               return_value=self.GoodResponse()) as m, \
+                mock.patch.object(requests.Session, 'get') as get:
+            c = client.PrometheusAPIClient("localhost:9090")
+            c._get("query", {"query": query})
+            # Only some endpoints accept POST requests
+            get.return_value = self.GoodResponse()
+            c._get("label/project/values", {"match[]": [query]})
+
+        m.assert_called_once_with("http://localhost:9090/api/v1/query",
+                                  data={"query": query},
+                                  headers={'Accept': 'application/json',
+                                           'Accept-Encoding': 'gzip'})
+        get.assert_called_once()
+
+    def test_get_post_disabled(self):
+        with mock.patch.object(requests.Session, 'get',
+                               return_value=self.GoodResponse()) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            c.set_post_threshold(None)
+            c._get("query", {"query": "up" * 5000})
+
+        m.assert_called_once()
 
     def test_get_error(self):
         url = "test"
@@ -157,6 +211,56 @@ class PrometheusAPIClientTest(PrometheusAPIClientTestBase):
                               c._post, url, params)
 
 
+class PrometheusAPIClientConnectionPoolTest(testtools.TestCase):
+    def test_set_connection_pool(self):
+        c = client.PrometheusAPIClient("localhost:9090", pool_maxsize=20,
+                                       max_retries=3, retry_backoff=0.5,
+                                       tcp_keepalive=True)
+
+        adapter = c._session.get_adapter("http://localhost:9090/")
+        self.assertIs(adapter, c._session.get_adapter("https://localhost/"))
+        self.assertEqual(20, adapter._pool_maxsize)
+        self.assertEqual(3, adapter.max_retries.total)
+        self.assertEqual(0.5, adapter.max_retries.backoff_factor)
+        # Long queries are sent as POST requests
+        self.assertTrue(adapter.max_retries.is_retry('GET', 503))
+        self.assertTrue(adapter.max_retries.is_retry('POST', 503))
+        self.assertFalse(adapter.max_retries.is_retry('POST', 500))
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+                      adapter.poolmanager.connection_pool_kw[
+                          'socket_options'])
+
+    def test_default_session_is_unchanged(self):
+        c = client.PrometheusAPIClient("localhost:9090")
+
+        adapter = c._session.get_adapter("http://localhost:9090/")
+        self.assertNotIsInstance(adapter, client._PoolAdapter)
+
+    def test_keystone_session(self):
+        keystone_session = session.Session()
+        c = client.PrometheusAPIClient("localhost:9090", keystone_session,
+                                       pool_maxsize=20)
+
+        adapter = keystone_session.session.get_adapter("http://localhost/")
+        self.assertEqual(20, adapter._pool_maxsize)
+        self.assertEqual([], c.pool_stats())
+
+    def test_pool_stats(self):
+        c = client.PrometheusAPIClient("localhost:9090", pool_maxsize=5)
+        adapter = c._session.get_adapter("http://localhost:9090/")
+        pool = adapter.poolmanager.connection_from_url(
+            "http://localhost:9090/"
+        )
+        pool.num_requests = 3
+
+        self.assertEqual([{'host': 'http://localhost:9090',
+                           'connections': 0,
+                           'requests': 3,
+                           'idle': 0,
+                           'in_use': 0,
+                           'maxsize': 5}], c.pool_stats())
+
+
 class PrometheusAPIClientQueryTest(PrometheusAPIClientTestBase):
     def setUp(self):
         super().setUp()
@@ -233,6 +337,406 @@ class PrometheusAPIClientQueryTest(PrometheusAPIClientTestBase):
 
             self.assertRaises(client.PrometheusAPIClientError, c.query, query)
 
+    def test_query_interns_labels(self):
+        # Equal strings, which are distinct objects like after decoding
+        job = "".join(["ceilo", "meter"])
+        return_value = {
+            "status": "success",
+            "data": {
+                "resultType": "vector",
+                "result": [
+                    {"metric": {"job": "ceilometer", "i": "1"},
+                     "value": [103254, "1.5"]},
+                    {"metric": {"job": job, "i": "2"},
+                     "value": [103254, "NaN"]},
+                ]
+            }
+        }
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               return_value=return_value):
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = c.query("up")
+
+        self.assertIs(ret[0].labels["job"], ret[1].labels["job"])
+        self.assertEqual({"job": "ceilometer", "i": "2"}, ret[1].labels)
+        self.assertEqual("1.5", ret[0].value)
+        self.assertEqual(1.5, ret[0].float_value)
+        self.assertTrue(math.isnan(ret[1].float_value))
+        self.assertFalse(hasattr(ret[0], '__dict__'))
+
+    def test_metric_float_value_of_string(self):
+        metric = client.PrometheusMetric({"metric": {},
+                                          "value": [103254, "text"]})
+        self.assertTrue(math.isnan(metric.float_value))
+
+
+class PrometheusAPIClientJSONDecoderTest(PrometheusAPIClientTestBase):
+    def test_set_json_decoder(self):
+        decoder = mock.Mock(return_value={"status": "success"})
+        with mock.patch.object(requests.Session, 'get',
+                               return_value=self.GoodResponse()):
+            c = client.PrometheusAPIClient("localhost:9090")
+            c.set_json_decoder(decoder)
+            c._get("labels")
+            c.set_json_decoder("json")
+            ret = c._get("labels")
+
+        decoder.assert_called_once_with(b'{"status": "success"}')
+        self.assertEqual({"status": "success"}, ret)
+
+    def test_set_unknown_json_decoder(self):
+        c = client.PrometheusAPIClient("localhost:9090")
+        self.assertRaises(ValueError, c.set_json_decoder, "unknown")
+
+
+class PrometheusAPIClientStreamTest(PrometheusAPIClientTestBase):
+    class StreamResponse:
+        def __init__(self, document, status_code=200):
+            self.status_code = status_code
+            self.data = json.dumps(document).encode()
+            self.closed = False
+
+        def iter_content(self, chunk_size):
+            for i in range(0, len(self.data), 5):
+                yield self.data[i:i + 5]
+
+        def json(self):
+            return json.loads(self.data)
+
+        def close(self):
+            self.closed = True
+
+    def test_query_stream(self):
+        resp = self.StreamResponse({
+            "status": "success",
+            "data": {
+                "resultType": "vector",
+                "result": [
+                    {"metric": {"__name__": "up"}, "value": [12345, "1"]},
+                    {"metric": {"__name__": "up", "job": "a"},
+                     "value": [12345, "0"]},
+                ]
+            }
+        })
+        with mock.patch.object(requests.Session, 'get',
+                               return_value=resp) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = c.query("up", stream=True)
+            self.assertFalse(resp.closed)
+            ret = list(ret)
+
+        self.assertTrue(m.call_args.kwargs['stream'])
+        self.assertTrue(resp.closed)
+        self.assertEqual([{"__name__": "up"}, {"__name__": "up", "job": "a"}],
+                         [metric.labels for metric in ret])
+        self.assertEqual(["1", "0"], [metric.value for metric in ret])
+
+    def test_query_stream_matrix_and_scalar(self):
+        matrix = self.StreamResponse({
+            "status": "success",
+            "data": {"resultType": "matrix", "result": [
+                {"metric": {}, "values": [[1, "1"], [2, "2"]]}
+            ]}
+        })
+        scalar = self.StreamResponse({
+            "status": "success",
+            "data": {"resultType": "scalar", "result": [12345, "3"]}
+        })
+        with mock.patch.object(requests.Session, 'get',
+                               side_effect=[matrix, scalar]):
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret1 = list(c.query("up[2s]", stream=True))
+            ret2 = list(c.query("scalar(up)", stream=True))
+
+        self.assertEqual([1.0, 2.0], list(ret1[0].values))
+        self.assertEqual(12345, ret2[0].timestamp)
+        self.assertEqual("3", ret2[0].value)
+
+    def test_query_range_stream(self):
+        resp = self.StreamResponse({
+            "status": "success",
+            "data": {"resultType": "matrix", "result": [
+                {"metric": {"job": "a"}, "values": [[1, "1"], [2, "2"]]}
+            ]}
+        })
+        with mock.patch.object(requests.Session, 'get',
+                               return_value=resp) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            c.set_range_cache(mock.Mock())
+            ret = list(c.query_range("up", 1, 2, 1, stream=True))
+
+        self.assertEqual("http://localhost:9090/api/v1/query_range",
+                         m.call_args.args[0])
+        self.assertTrue(m.call_args.kwargs['stream'])
+        self.assertEqual({"job": "a"}, ret[0].labels)
+        self.assertEqual([1.0, 2.0], list(ret[0].timestamps))
+        c._range_cache.query_range.assert_not_called()
+
+    def test_query_range_stream_split(self):
+        c = client.PrometheusAPIClient("localhost:9090")
+        self.assertRaises(ValueError, c.query_range, "up", 1, 2, 1,
+                          split_interval=60, stream=True)
+
+    def test_series_stream(self):
+        resp = self.StreamResponse({
+            "status": "success",
+            "data": [{"__name__": "up"}, {"__name__": "down"}]
+        })
+        with mock.patch.object(requests.Session, 'get', return_value=resp):
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = list(c.series(["up", "down"], stream=True))
+
+        self.assertEqual([{"__name__": "up"}, {"__name__": "down"}], ret)
+
+    def test_series_stream_chunks(self):
+        responses = [
+            self.StreamResponse({"status": "success",
+                                 "data": [{"__name__": "up"}]}),
+            self.StreamResponse({"status": "success",
+                                 "data": [{"__name__": "up"},
+                                          {"__name__": "down"}]}),
+        ]
+        with mock.patch.object(requests.Session, 'get',
+                               side_effect=responses) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = list(c.series(["up", "down"], stream=True,
+                                matches_per_request=1))
+
+        self.assertEqual(2, m.call_count)
+        self.assertEqual([{"__name__": "up"}, {"__name__": "down"}], ret)
+
+    def test_stream_error(self):
+        resp = self.StreamResponse({"status": "error", "error": "bad"},
+                                   status_code=400)
+        with mock.patch.object(requests.Session, 'get', return_value=resp):
+            c = client.PrometheusAPIClient("localhost:9090")
+            self.assertRaises(client.PrometheusAPIClientError,
+                              c.query, "up", stream=True)
+
+
+class PrometheusAPIClientQueryRangeTest(PrometheusAPIClientTestBase):
+    def setUp(self):
+        super().setUp()
+
+    class GoodQueryRangeResponse(PrometheusAPIClientTestBase.GoodResponse):
+        def __init__(self):
+            super().__init__()
+            self.result1 = {
+                "metric": {
+                    "__name__": "test1",
+                },
+                "values": [[100, "1"], [130, "2.5"], [160, "NaN"]]
+            }
+            self.result2 = {
+                "metric": {
+                    "__name__": "test2",
+                },
+                "values": [[160, "+Inf"]]
+            }
+
+        def json(self):
+            return {
+                "status": "success",
+                "data": {
+                    "resultType": "matrix",
+                    "result": [self.result1, self.result2]
+                }
+            }
+
+    def test_query_range(self):
+        query = "ceilometer_image_size{publisher='localhost.localdomain'}"
+
+        return_value = self.GoodQueryRangeResponse().json()
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               return_value=return_value) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = c.query_range(query, 100, 160, "30s")
+
+        m.assert_called_with("query_range", {"query": query,
+                                             "start": 100,
+                                             "end": 160,
+                                             "step": "30s"})
+        self.assertEqual(2, len(ret))
+        self.assertEqual({"__name__": "test1"}, ret[0].labels)
+        self.assertEqual([100.0, 130.0, 160.0], list(ret[0].timestamps))
+        self.assertEqual([1.0, 2.5], list(ret[0].values)[:2])
+        self.assertTrue(math.isnan(ret[0].values[2]))
+        self.assertEqual(3, len(ret[0]))
+        self.assertEqual([math.inf], list(ret[1].values))
+
+    def test_query_range_without_numpy(self):
+        return_value = self.GoodQueryRangeResponse().json()
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               return_value=return_value), \
+                mock.patch.object(client, 'numpy', None):
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = c.query_range("test1", 100, 160, 30)
+
+        self.assertIsInstance(ret[0].timestamps, array.array)
+        self.assertIsInstance(ret[0].values, array.array)
+        self.assertEqual('d', ret[0].values.typecode)
+
+    def test_query_returning_matrix(self):
+        return_value = self.GoodQueryRangeResponse().json()
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               return_value=return_value):
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = c.query("test1[1m]")
+
+        self.assertEqual(2, len(ret))
+        for metric in ret:
+            self.assertIsInstance(metric, client.PrometheusRangeMetric)
+        self.assertEqual([160.0], list(ret[1].timestamps))
+
+    def test_query_returning_scalar(self):
+        return_value = {
+            "status": "success",
+            "data": {
+                "resultType": "scalar",
+                "result": [103254, "42"]
+            }
+        }
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               return_value=return_value):
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = c.query("scalar(vector(42))")
+
+        self.assertEqual(1, len(ret))
+        self.assertEqual({}, ret[0].labels)
+        self.assertEqual(103254, ret[0].timestamp)
+        self.assertEqual("42", ret[0].value)
+
+    def test_query_returning_unknown_type(self):
+        return_value = {
+            "status": "success",
+            "data": {"resultType": "histogram", "result": []}
+        }
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               return_value=return_value):
+            c = client.PrometheusAPIClient("localhost:9090")
+            self.assertRaises(ValueError, c.query, "up")
+
+    def test_query_range_error(self):
+        client_exception = client.PrometheusAPIClientError(self.BadResponse())
+
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               side_effect=client_exception):
+            c = client.PrometheusAPIClient("localhost:9090")
+
+            self.assertRaises(client.PrometheusAPIClientError,
+                              c.query_range, "test1", 100, 160, 30)
+
+
+class PrometheusAPIClientQueryRangeSplitTest(PrometheusAPIClientTestBase):
+    def setUp(self):
+        super().setUp()
+        self.windows = []
+
+    class TooManyPointsResponse:
+        def __init__(self):
+            self.status_code = 400
+
+        def json(self):
+            return {"status": "error",
+                    "errorType": "bad_data",
+                    "error": "exceeded maximum resolution of 11,000 points "
+                             "per timeseries. Try decreasing the query "
+                             "resolution (?step=XX)"}
+
+    def fake_query_range(self, query, start, end, step, max_points=None):
+        self.windows.append((start, end))
+        if max_points is not None and (end - start) // step + 1 > max_points:
+            raise client.PrometheusAPIClientError(self.TooManyPointsResponse())
+        timestamps = []
+        t = start
+        while t <= end:
+            timestamps.append(t)
+            t += step
+        return [client.PrometheusRangeMetric({
+            "metric": {"__name__": "test1"},
+            "values": [[t, str(t)] for t in timestamps]
+        })]
+
+    def test_query_range_split(self):
+        c = client.PrometheusAPIClient("localhost:9090")
+        with mock.patch.object(c, '_query_range',
+                               side_effect=self.fake_query_range):
+            ret = c.query_range("test1", 0, 1000, 10, split_interval="5m",
+                                max_workers=2)
+
+        self.assertEqual([(0, 290), (300, 590), (600, 890), (900, 1000)],
+                         sorted(self.windows))
+        self.assertEqual(1, len(ret))
+        self.assertEqual([float(t) for t in range(0, 1001, 10)],
+                         list(ret[0].timestamps))
+        self.assertEqual(list(ret[0].timestamps), list(ret[0].values))
+
+    def test_query_range_split_limits_points_per_window(self):
+        c = client.PrometheusAPIClient("localhost:9090")
+        with mock.patch.object(c, '_query_range',
+                               side_effect=self.fake_query_range):
+            c.query_range("test1", 0, 30000, 1, split_interval="1d")
+
+        self.assertEqual([(0, 10999), (11000, 21999), (22000, 30000)],
+                         sorted(self.windows))
+
+    def test_query_range_split_rfc3339(self):
+        c = client.PrometheusAPIClient("localhost:9090")
+        with mock.patch.object(c, '_query_range',
+                               side_effect=self.fake_query_range):
+            c.query_range("test1", "1970-01-01T00:00:00Z",
+                          "1970-01-01T00:01:00Z", "30s", split_interval=30)
+
+        self.assertEqual([(0, 0), (30, 30), (60, 60)], sorted(self.windows))
+
+    def test_query_range_split_adapts_to_rejected_windows(self):
+        c = client.PrometheusAPIClient("localhost:9090")
+
+        def fake_query_range(*args):
+            return self.fake_query_range(*args, max_points=3)
+
+        with mock.patch.object(c, '_query_range',
+                               side_effect=fake_query_range):
+            ret = c.query_range("test1", 0, 90, 10, split_interval=100)
+
+        self.assertEqual([float(t) for t in range(0, 91, 10)],
+                         list(ret[0].timestamps))
+        # (0, 90) is rejected, then (0, 40) and (50, 90) and finally
+        # the windows with at most 3 points.
+        self.assertEqual([(0, 90), (0, 40), (0, 10), (20, 40),
+                          (50, 90), (50, 60), (70, 90)], self.windows)
+
+    def test_query_range_split_other_errors_are_raised(self):
+        c = client.PrometheusAPIClient("localhost:9090")
+        client_exception = client.PrometheusAPIClientError(self.BadResponse())
+        with mock.patch.object(c, '_query_range',
+                               side_effect=client_exception) as m:
+            self.assertRaises(client.PrometheusAPIClientError,
+                              c.query_range, "test1", 0, 90, 10,
+                              split_interval=100)
+        m.assert_called_once()
+
+    def test_merge_range_results_deduplicates_boundaries(self):
+        window1 = [client.PrometheusRangeMetric({
+            "metric": {"__name__": "test1", "a": "1"},
+            "values": [[0, "0"], [10, "1"], [20, "2"]]
+        })]
+        window2 = [client.PrometheusRangeMetric({
+            "metric": {"a": "1", "__name__": "test1"},
+            "values": [[20, "2"], [30, "3"]]
+        }), client.PrometheusRangeMetric({
+            "metric": {"__name__": "test2"},
+            "values": [[30, "4"]]
+        })]
+
+        ret = client.merge_range_results([window1, window2])
+
+        self.assertEqual(2, len(ret))
+        self.assertEqual([0.0, 10.0, 20.0, 30.0], list(ret[0].timestamps))
+        self.assertEqual([0.0, 1.0, 2.0, 3.0], list(ret[0].values))
+        self.assertEqual({"__name__": "test2"}, ret[1].labels)
+        self.assertEqual([4.0], list(ret[1].values))
+
 
 class PrometheusAPIClientSeriesTest(PrometheusAPIClientTestBase):
     def setUp(self):
@@ -295,6 +799,47 @@ class PrometheusAPIClientSeriesTest(PrometheusAPIClientTestBase):
             m.assert_called_with("series", {"match[]": matches})
             self.assertEqual(ret, self.EmptySeriesResponse().data)
 
+    def test_series_time_range(self):
+        return_value = self.GoodSeriesResponse().json()
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               return_value=return_value) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            c.series(["up"], start="2024-01-01T00:00:00Z", limit=100)
+
+            m.assert_called_with("series", {"match[]": ["up"],
+                                            "start": "2024-01-01T00:00:00Z",
+                                            "limit": 100})
+
+    def test_series_chunks(self):
+        matches = [f"up{{instance='{i}'}}" for i in range(5)]
+
+        def get(endpoint, params):
+            return {"status": "success",
+                    "data": [{"__name__": "up", "i": m[-3]}
+                             for m in params["match[]"]] +
+                    [{"__name__": "up", "i": "shared"}]}
+
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               side_effect=get) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = c.series(matches, matches_per_request=2)
+
+        self.assertEqual(3, m.call_count)
+        self.assertEqual(sorted(["0", "1", "2", "3", "4", "shared"]),
+                         sorted(s["i"] for s in ret))
+
+    def test_series_chunks_limit(self):
+        def get(endpoint, params):
+            return {"status": "success",
+                    "data": [{"__name__": m} for m in params["match[]"]]}
+
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               side_effect=get):
+            c = client.PrometheusAPIClient("localhost:9090")
+            ret = c.series(["a", "b", "c"], limit=2, matches_per_request=1)
+
+        self.assertEqual(2, len(ret))
+
     def test_series_error(self):
         matches = ["up", "ceilometer_image_size"]
         client_exception = client.PrometheusAPIClientError(self.BadResponse())
@@ -330,9 +875,21 @@ class PrometheusAPIClientLabelsTest(PrometheusAPIClientTestBase):
             c = client.PrometheusAPIClient("localhost:9090")
             ret = c.labels()
 
-            m.assert_called_with("labels")
+            m.assert_called_with("labels", {})
             self.assertEqual(ret, self.GoodLabelsResponse().labels)
 
+    def test_labels_matches(self):
+        return_value = self.GoodLabelsResponse().json()
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               return_value=return_value) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            c.labels(matches=["{project='p1'}"], start=100, end=200,
+                     limit=5)
+
+            m.assert_called_with("labels", {"match[]": ["{project='p1'}"],
+                                            "start": 100, "end": 200,
+                                            "limit": 5})
+
     def test_labels_error(self):
         client_exception = client.PrometheusAPIClientError(self.BadResponse())
         with mock.patch.object(client.PrometheusAPIClient, '_get',
@@ -377,7 +934,7 @@ class PrometheusAPIClientLabelValuesTest(PrometheusAPIClientTestBase):
             c = client.PrometheusAPIClient("localhost:9090")
             ret = c.label_values(label_name)
 
-            m.assert_called_with(f"label/{label_name}/values")
+            m.assert_called_with(f"label/{label_name}/values", {})
             self.assertEqual(ret, self.GoodLabelValuesResponse().values)
 
         return_value = self.EmptyLabelValuesResponse().json()
@@ -386,9 +943,21 @@ class PrometheusAPIClientLabelValuesTest(PrometheusAPIClientTestBase):
             c = client.PrometheusAPIClient("localhost:9090")
             ret = c.label_values(label_name)
 
-            m.assert_called_with(f"label/{label_name}/values")
+            m.assert_called_with(f"label/{label_name}/values", {})
             self.assertEqual(ret, self.EmptyLabelValuesResponse().values)
 
+    def test_label_values_matches(self):
+        return_value = self.GoodLabelValuesResponse().json()
+        with mock.patch.object(client.PrometheusAPIClient, '_get',
+                               return_value=return_value) as m:
+            c = client.PrometheusAPIClient("localhost:9090")
+            c.label_values("__name__", matches=["{project='p1'}"],
+                           start="2024-01-01T00:00:00Z")
+
+            m.assert_called_with("label/__name__/values",
+                                 {"match[]": ["{project='p1'}"],
+                                  "start": "2024-01-01T00:00:00Z"})
+
     def test_label_values_error(self):
         label_name = "job"
         client_exception = client.PrometheusAPIClientError(self.BadResponse())
@@ -516,3 +1085,90 @@ class PrometheusAPIClientSnapshotTest(PrometheusAPIClientTestBase):
 
             self.assertRaises(client.PrometheusAPIClientError,
                               c.snapshot)
+
+
+class AsyncPrometheusAPIClientTest(PrometheusAPIClientTestBase):
+    def setUp(self):
+        super().setUp()
+        self.session = mock.Mock()
+        self.session.get = mock.AsyncMock()
+        self.session.post = mock.AsyncMock()
+        self.client = client.AsyncPrometheusAPIClient(
+            "localhost:9090", session=self.session, root_path="root_path"
+        )
+
+    def test_get(self):
+        self.session.get.return_value = self.GoodResponse()
+        params = {"query": "ceilometer_image_size{publisher='localhost'}"}
+
+        asyncio.run(self.client._get("test", params))
+
+        self.session.get.assert_called_with(
+            "http://localhost:9090/root_path/api/v1/test",
+            params=params,
+            headers={'Accept': 'application/json',
+                     'Accept-Encoding': 'gzip'})
+
+    def test_get_post(self):
+        self.session.post.return_value = self.GoodResponse()
+        params = {"query": "up" * 2000}
+
+        asyncio.run(self.client._get("query", params))
+
+        self.session.post.assert_called_with(
+            "http://localhost:9090/root_path/api/v1/query",
+            data=params,
+            headers={'Accept': 'application/json',
+                     'Accept-Encoding': 'gzip'})
+        self.session.get.assert_not_called()
+
+    def test_get_error(self):
+        self.session.get.return_value = self.BadResponse()
+
+        self.assertRaises(client.PrometheusAPIClientError, asyncio.run,
+                          self.client._get("test"))
+
+    def test_query(self):
+        self.session.get.return_value = mock.Mock(
+            status_code=200,
+            content=json.dumps({
+                "status": "success",
+                "data": {
+                    "resultType": "vector",
+                    "result": [{"metric": {"__name__": "up"},
+                                "value": [1234567, "1"]}]
+                }
+            }).encode()
+        )
+
+        ret = asyncio.run(self.client.query("up"))
+
+        self.assertEqual(1, len(ret))
+        self.assertEqual({"__name__": "up"}, ret[0].labels)
+        self.assertEqual("1", ret[0].value)
+
+    def test_delete(self):
+        self.session.post.return_value = self.NoContentResponse()
+
+        asyncio.run(self.client.delete(["up"], end=12))
+
+        self.session.post.assert_called_with(
+            "http://localhost:9090/root_path/api/v1/admin/tsdb/delete_series",
+            params={"match[]": ["up"], "end": 12},
+            headers={'Accept': 'application/json'})
+
+    def test_snapshot_error(self):
+        self.session.post.return_value = self.BadResponse()
+
+        self.assertRaises(client.PrometheusAPIClientError, asyncio.run,
+                          self.client.snapshot())
+
+    def test_aclose(self):
+        self.session.aclose = mock.AsyncMock()
+
+        async def use_client():
+            async with self.client:
+                pass
+
+        asyncio.run(use_client())
+        self.session.aclose.assert_awaited_once()
@@ -0,0 +1,230 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import testtools
+
+from observabilityclient import promql
+
+
+class TokenizeTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+
+    def tokens(self, query):
+        return [(t.type, t.value) for t in promql.tokenize(query)]
+
+    def test_selector(self):
+        expected = [
+            (promql.IDENTIFIER, "test:query_1"),
+            (promql.LEFT_BRACE, "{"),
+            (promql.IDENTIFIER, "a"),
+            (promql.MATCH_OPERATOR, "=~"),
+            (promql.STRING, "'x|y'"),
+            (promql.COMMA, ","),
+            (promql.IDENTIFIER, "b"),
+            (promql.MATCH_OPERATOR, "!="),
+            (promql.STRING, '"{}"'),
+            (promql.RIGHT_BRACE, "}"),
+        ]
+        self.assertEqual(expected,
+                         self.tokens("test:query_1{a=~'x|y', b!=\"{}\"}"))
+
+    def test_expression(self):
+        expected = [
+            (promql.IDENTIFIER, "sum"),
+            (promql.IDENTIFIER, "by"),
+            (promql.LEFT_PAREN, "("),
+            (promql.IDENTIFIER, "le"),
+            (promql.RIGHT_PAREN, ")"),
+            (promql.LEFT_PAREN, "("),
+            (promql.IDENTIFIER, "rate"),
+            (promql.LEFT_PAREN, "("),
+            (promql.IDENTIFIER, "m"),
+            (promql.LEFT_BRACKET, "["),
+            (promql.DURATION, "1h30m"),
+            (promql.COLON, ":"),
+            (promql.DURATION, "5m"),
+            (promql.RIGHT_BRACKET, "]"),
+            (promql.IDENTIFIER, "offset"),
+            (promql.OPERATOR, "-"),
+            (promql.DURATION, "1w"),
+            (promql.RIGHT_PAREN, ")"),
+            (promql.RIGHT_PAREN, ")"),
+            (promql.OPERATOR, ">="),
+            (promql.NUMBER, "1.5e3"),
+            (promql.AT, "@"),
+            (promql.NUMBER, "1609746000"),
+        ]
+        self.assertEqual(
+            expected,
+            self.tokens("sum by (le) (rate(m[1h30m:5m] offset -1w)) "
+                        ">= 1.5e3 @ 1609746000")
+        )
+
+    def test_positions(self):
+        query = "a + \n  b"
+        tokens = list(promql.tokenize(query))
+        self.assertEqual([(0, 1), (2, 3), (7, 8)],
+                         [(t.start, t.end) for t in tokens])
+
+    def test_escaped_strings(self):
+        self.assertEqual(
+            [(promql.STRING, r"'a\'b'"), (promql.STRING, r'"c\"}"')],
+            self.tokens(r"""'a\'b' "c\"}" """)
+        )
+
+    def test_comment(self):
+        self.assertEqual([(promql.IDENTIFIER, "a"),
+                          (promql.COMMENT, "# comment {"),
+                          (promql.IDENTIFIER, "b")],
+                         self.tokens("a # comment {\nb"))
+
+    def test_invalid_character(self):
+        self.assertRaises(promql.PromQLSyntaxError, list,
+                          promql.tokenize("a ? b"))
+
+
+class ParseTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+
+    def test_vector_selector(self):
+        query = "test_query{a='b', \"c.d\"!~\"e\",}"
+        node = promql.parse(query)
+
+        self.assertIsInstance(node, promql.VectorSelector)
+        self.assertEqual("test_query", node.name)
+        self.assertFalse(node.quoted_name)
+        self.assertEqual([("a", "=", "b"), ("c.d", "!~", "e")],
+                         [(m.name, m.op, m.value) for m in node.matchers])
+        self.assertEqual(len("test_query"), node.name_end)
+        self.assertEqual(len(query) - 1, node.label_section_end)
+        self.assertFalse(node.needs_comma)
+
+    def test_quoted_metric_name(self):
+        node = promql.parse('{"utf8.name"}')
+
+        self.assertEqual("utf8.name", node.name)
+        self.assertTrue(node.quoted_name)
+        self.assertIsNone(node.name_end)
+        self.assertTrue(node.needs_comma)
+
+    def test_precedence(self):
+        node = promql.parse("a + b * c ^ d ^ e or f")
+
+        self.assertEqual("or", node.op)
+        self.assertEqual("+", node.lhs.op)
+        self.assertEqual("*", node.lhs.rhs.op)
+        self.assertEqual("^", node.lhs.rhs.rhs.op)
+        self.assertEqual("^", node.lhs.rhs.rhs.rhs.op)
+
+    def test_unary_binds_weaker_than_power(self):
+        node = promql.parse("-a ^ 2 * b")
+
+        self.assertEqual("*", node.op)
+        self.assertIsInstance(node.lhs, promql.UnaryExpr)
+        self.assertEqual("^", node.lhs.expr.op)
+
+    def test_vector_matching(self):
+        node = promql.parse("a > bool ignoring (x) group_left (y, z) b")
+
+        self.assertTrue(node.return_bool)
+        self.assertFalse(node.matching.on)
+        self.assertEqual(["x"], node.matching.labels)
+        self.assertEqual("many-to-one", node.matching.card)
+        self.assertEqual(["y", "z"], node.matching.include)
+
+    def test_aggregation(self):
+        for query in ("topk by (job) (5, a)", "topk(5, a) by (job)"):
+            node = promql.parse(query)
+
+            self.assertIsInstance(node, promql.AggregateExpr)
+            self.assertEqual("topk", node.op)
+            self.assertEqual(5.0, node.param.value)
+            self.assertEqual("a", node.expr.name)
+            self.assertEqual(["job"], node.grouping)
+            self.assertFalse(node.without)
+
+    def test_modifiers(self):
+        node = promql.parse("rate(a[5m] offset -1h @ 100)")
+        matrix = node.args[0]
+
+        self.assertIsInstance(matrix, promql.MatrixSelector)
+        self.assertEqual("5m", matrix.range)
+        self.assertEqual("-1h", matrix.offset)
+        self.assertEqual("100", matrix.at)
+
+    def test_subquery(self):
+        node = promql.parse("max_over_time(rate(a[5m])[1h:] @ start())")
+        subquery = node.args[0]
+
+        self.assertIsInstance(subquery, promql.SubqueryExpr)
+        self.assertEqual("1h", subquery.range)
+        self.assertIsNone(subquery.step)
+        self.assertEqual("start()", subquery.at)
+
+    def test_numeric_durations(self):
+        node = promql.parse("rate(foo[300] offset 60) + "
+                            "max_over_time(bar[3600:1.5] offset -0.5)")
+        matrix = node.lhs.args[0]
+        subquery = node.rhs.args[0]
+
+        self.assertEqual("300", matrix.range)
+        self.assertEqual("60", matrix.offset)
+        self.assertEqual("3600", subquery.range)
+        self.assertEqual("1.5", subquery.step)
+        self.assertEqual("-0.5", subquery.offset)
+
+    def test_walk(self):
+        node = promql.parse("sum(a) / on (x) count(b{c='d'}) + 1")
+
+        self.assertEqual(["a", "b"],
+                         [n.name for n in node.walk()
+                          if isinstance(n, promql.VectorSelector)])
+
+    def test_string_unquoting(self):
+        node = promql.parse(r'label_replace(a, "dst\x41", `\n`, "\"", "")')
+
+        self.assertEqual('dstA', node.args[1].value)
+        self.assertEqual('\\n', node.args[2].value)
+        self.assertEqual('"', node.args[3].value)
+
+    def test_invalid_queries(self):
+        for query in ("a{", "a{b}", "sum(a", "a +", "{}", "a offset 5m[5m]",
+                      "1 offset 5m", "a b", "by (a)"):
+            self.assertRaises(promql.PromQLSyntaxError, promql.parse, query)
+
+
+class LabelMatcherTest(testtools.TestCase):
+    def test_add_label_matcher(self):
+        query = ("rate(a[5m]) + b{c='d'} + on() e{f='g',} "
+                 "+ {__name__='h'}")
+
+        self.assertEqual(
+            "rate(a{job='x'}[5m]) + b{c='d', job='x'} + on() "
+            "e{f='g',job='x'} + {__name__='h', job='x'}",
+            promql.add_label_matcher(query, "job='x'")
+        )
+
+    def test_add_label_matcher_parsed(self):
+        tree = promql.parse("sum(a{})")
+
+        self.assertEqual("sum(a{job='x'})",
+                         promql.add_label_matcher("sum(a{})", "job='x'",
+                                                  tree))
+
+    def test_quote(self):
+        self.assertEqual("'a\\'b\\\\c'", promql.quote("a'b\\c"))
+        self.assertEqual("a'b\\c",
+                         promql.unquote(promql.quote("a'b\\c")))
@@ -12,10 +12,12 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import asyncio
 from unittest import mock
 
 import testtools
 
+from observabilityclient.frame import MetricFrame
 from observabilityclient import prometheus_client
 from observabilityclient import rbac
 from observabilityclient.tests.unit.test_prometheus_client import (
@@ -51,18 +53,43 @@ class QueryManagerTest(testtools.TestCase):
             ret2 = self.manager.list(disable_rbac=True)
             self.assertEqual(expected, ret2)
 
+    def test_list_rbac(self):
+        returned_data = {'data': ['metric1', 'abc2']}
+
+        with mock.patch.object(prometheus_client.PrometheusAPIClient, '_get',
+                               return_value=returned_data) as m:
+            ret = self.manager.list(disable_rbac=False)
+
+        self.assertEqual(['abc2', 'metric1'], ret)
+        m.assert_called_once_with("label/__name__/values",
+                                  {"match[]": ["{project='project_id'}"]})
+
+    def test_list_time_range(self):
+        returned_data = {'data': ['metric1']}
+
+        with mock.patch.object(prometheus_client.PrometheusAPIClient, '_get',
+                               return_value=returned_data) as m:
+            ret = self.manager.list(start=100, end=200, limit=10)
+
+        self.assertEqual(['metric1'], ret)
+        m.assert_called_once_with("label/__name__/values",
+                                  {"start": 100, "end": 200, "limit": 10})
+
     def test_show(self):
         query = 'some_metric'
-        returned_by_prom = {
-            'data': {
-                'resultType': 'non-vector'
-            },
-            'value': [1234567, 42],
+        sample = {
+            'value': [1234567, '42'],
             'metric': {
                 'label': 'label_value'
             }
         }
-        expected = [prometheus_client.PrometheusMetric(returned_by_prom)]
+        returned_by_prom = {
+            'data': {
+                'resultType': 'vector',
+                'result': [sample]
+            }
+        }
+        expected = [prometheus_client.PrometheusMetric(sample)]
         expected_matcher = MetricListMatcher(expected)
 
         with mock.patch.object(prometheus_client.PrometheusAPIClient, '_get',
@@ -81,16 +108,19 @@ class QueryManagerTest(testtools.TestCase):
     def test_query(self):
         queried_metric_name = 'some_metric'
         query = queried_metric_name
-        returned_by_prom = {
-            'data': {
-                'resultType': 'non-vector'
-            },
-            'value': [1234567, 42],
+        sample = {
+            'value': [1234567, '42'],
             'metric': {
                 'label': 'label_value'
             }
         }
-        expected = [prometheus_client.PrometheusMetric(returned_by_prom)]
+        returned_by_prom = {
+            'data': {
+                'resultType': 'vector',
+                'result': [sample]
+            }
+        }
+        expected = [prometheus_client.PrometheusMetric(sample)]
         expected_matcher = MetricListMatcher(expected)
         with mock.patch.object(prometheus_client.PrometheusAPIClient, '_get',
                                return_value=returned_by_prom), \
@@ -106,6 +136,157 @@ class QueryManagerTest(testtools.TestCase):
         self.assertThat(ret1, expected_matcher)
         self.assertThat(ret2, expected_matcher)
 
+    def test_query_cache_scope(self):
+        with mock.patch.object(self.manager.prom, 'query',
+                               return_value=[]) as m, \
+                mock.patch.object(self.rbac, 'modify_query',
+                                  return_value="q{project='project_id'}"):
+            self.manager.query("q", disable_rbac=False)
+            self.manager.query("q")
+
+        self.assertEqual([
+            mock.call("q{project='project_id'}",
+                      cache_scope=(('project', 'project_id'),)),
+            mock.call("q", cache_scope=None),
+        ], m.call_args_list)
+
+    def test_query_frame(self):
+        returned_by_prom = {
+            'data': {
+                'resultType': 'vector',
+                'result': [
+                    {'metric': {'label': 'a'}, 'value': [1234567, '42']},
+                    {'metric': {'label': 'b'}, 'value': [1234567, '43']},
+                ]
+            }
+        }
+        with mock.patch.object(prometheus_client.PrometheusAPIClient, '_get',
+                               return_value=returned_by_prom):
+            ret = self.manager.query('some_metric', frame=True)
+
+        self.assertIsInstance(ret, MetricFrame)
+        self.assertEqual(['a', 'b'], ret.label('label'))
+        self.assertEqual([42.0, 43.0], list(ret.values))
+
+    def test_query_range(self):
+        query = 'some_metric'
+        returned_by_prom = {
+            'data': {
+                'resultType': 'matrix',
+                'result': [{
+                    'metric': {'label': 'label_value'},
+                    'values': [[1234567, '42'], [1234597, '43']]
+                }]
+            }
+        }
+        with mock.patch.object(prometheus_client.PrometheusAPIClient, '_get',
+                               return_value=returned_by_prom) as m:
+            ret1 = self.manager.query_range(query, 1234567, 1234597, 30,
+                                            disable_rbac=True)
+            self.rbac.modify_query.assert_not_called()
+
+            ret2 = self.manager.query_range(query, 1234567, 1234597, 30)
+            self.rbac.modify_query.assert_not_called()
+
+        m.assert_called_with('query_range', {'query': query,
+                                             'start': 1234567,
+                                             'end': 1234597,
+                                             'step': 30})
+        for ret in (ret1, ret2):
+            self.assertEqual(1, len(ret))
+            self.assertEqual({'label': 'label_value'}, ret[0].labels)
+            self.assertEqual([1234567.0, 1234597.0],
+                             list(ret[0].timestamps))
+            self.assertEqual([42.0, 43.0], list(ret[0].values))
+
+    def test_query_many(self):
+        def query(q):
+            if q == 'failing':
+                raise prometheus_client.PrometheusAPIClientError(
+                    mock.Mock(status_code=400, reason='bad query'))
+            return [q]
+
+        queries = ['metric1', 'failing', 'metric2', 'metric1']
+        with mock.patch.object(prometheus_client.PrometheusAPIClient,
+                               'query', side_effect=query) as m:
+            ret = self.manager.query_many(queries, disable_rbac=True)
+
+        self.assertEqual(3, m.call_count)
+        self.assertEqual(list(range(4)), [r.index for r in ret])
+        self.assertEqual(queries, [r.query for r in ret])
+        self.assertEqual([['metric1'], None, ['metric2'], ['metric1']],
+                         [r.result for r in ret])
+        self.assertIsNone(ret[0].error)
+        self.assertIsInstance(ret[1].error,
+                              prometheus_client.PrometheusAPIClientError)
+
+    def test_query_many_rbac(self):
+        self.rbac.modify_query = mock.Mock(side_effect=lambda q: q + '{}')
+        queries = ['metric1', 'metric2', 'metric1']
+        with mock.patch.object(prometheus_client.PrometheusAPIClient,
+                               'query', side_effect=lambda q: [q]):
+            ret = self.manager.query_many(queries, disable_rbac=False,
+                                          ordered=False)
+            ret = sorted(ret)
+
+        self.assertEqual(2, self.rbac.modify_query.call_count)
+        self.assertEqual([['metric1{}'], ['metric2{}'], ['metric1{}']],
+                         [r.result for r in ret])
+
+    def test_query_many_empty(self):
+        self.assertEqual([], self.manager.query_many([]))
+
+    def test_query_projects(self):
+        query = 'sum by (project) (some_metric)'
+        returned_by_prom = {
+            'data': {
+                'resultType': 'vector',
+                'result': [
+                    {'metric': {'project': 'p2'}, 'value': [1234567, '2']},
+                    {'metric': {'project': 'p1'}, 'value': [1234567, '1']},
+                ]
+            }
+        }
+        with mock.patch.object(prometheus_client.PrometheusAPIClient, '_get',
+                               return_value=returned_by_prom) as m:
+            ret = self.manager.query_projects(query, ['p1', 'p2', 'p3'])
+
+        m.assert_called_once_with('query', {
+            'query': "sum by (project) (some_metric{project=~'p1|p2|p3'})"
+        })
+        self.assertEqual(['p1', 'p2', 'p3'], list(ret))
+        self.assertEqual(['1'], [m.value for m in ret['p1']])
+        self.assertEqual(['2'], [m.value for m in ret['p2']])
+        self.assertEqual([], ret['p3'])
+
+    def test_query_projects_chunks(self):
+        returned_by_prom = {
+            'data': {'resultType': 'vector', 'result': []}
+        }
+        project_ids = [f'project{i}' for i in range(10)]
+        with mock.patch.object(prometheus_client.PrometheusAPIClient, '_get',
+                               return_value=returned_by_prom) as m:
+            ret = self.manager.query_projects('some_metric', project_ids,
+                                              max_query_length=60)
+
+        self.assertGreater(m.call_count, 1)
+        self.assertEqual(project_ids, list(ret))
+
+    def test_query_projects_rejects_unknown_project(self):
+        returned_by_prom = {
+            'data': {
+                'resultType': 'vector',
+                'result': [
+                    {'metric': {'project': 'p1'}, 'value': [1234567, '1']},
+                    {'metric': {}, 'value': [1234567, '2']},
+                ]
+            }
+        }
+        with mock.patch.object(prometheus_client.PrometheusAPIClient, '_get',
+                               return_value=returned_by_prom):
+            self.assertRaises(ValueError, self.manager.query_projects,
+                              'vector(1) + some_metric', ['p1'])
+
     def test_delete(self):
         matches = "some_metric"
         start = 0
@@ -126,3 +307,73 @@ class QueryManagerTest(testtools.TestCase):
                                'snapshot') as m:
             self.manager.snapshot()
         m.assert_called_once()
+
+
+class AsyncQueryManagerTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.prom = mock.Mock()
+        self.prom.query = mock.AsyncMock(side_effect=lambda q: [q])
+        self.prom.label_values = mock.AsyncMock(
+            return_value=['metric1', 'metric2']
+        )
+        self.prom.series = mock.AsyncMock(
+            return_value=[{'__name__': 'metric2'}, {'__name__': 'metric1'}]
+        )
+        self.rbac = rbac.PromQLRbac(mock.Mock(), 'project_id')
+        self.manager = python_api.AsyncQueryManager(self.prom, self.rbac)
+
+    def test_query(self):
+        ret1 = asyncio.run(self.manager.query('metric1'))
+        ret2 = asyncio.run(self.manager.query('metric1',
+                                              disable_rbac=False))
+
+        self.assertEqual(['metric1'], ret1)
+        self.assertEqual(["metric1{project='project_id'}"], ret2)
+        self.prom.label_values.assert_not_called()
+        self.rbac.client.label_values.assert_not_called()
+
+    def test_show(self):
+        ret1 = asyncio.run(self.manager.show('metric1', disable_rbac=False))
+        ret2 = asyncio.run(self.manager.show("metric1{a='b'}",
+                                             disable_rbac=False))
+
+        self.assertEqual(
+            ["last_over_time(metric1{project='project_id'}[5m])"], ret1)
+        self.assertEqual(
+            ["last_over_time(metric1{a='b', project='project_id'}[5m])"],
+            ret2)
+
+    def test_query_rbac_required(self):
+        manager = python_api.AsyncQueryManager(self.prom)
+
+        self.assertRaises(ValueError, asyncio.run,
+                          manager.query('metric1', disable_rbac=False))
+
+    def test_query_many(self):
+        def query(q):
+            if q == 'failing':
+                raise ValueError(q)
+            return [q]
+        self.prom.query.side_effect = query
+
+        ret = asyncio.run(self.manager.query_many(
+            ['metric1', 'failing', 'metric1']
+        ))
+
+        self.assertEqual(2, self.prom.query.await_count)
+        self.assertEqual([['metric1'], None, ['metric1']],
+                         [r.result for r in ret])
+        self.assertIsInstance(ret[1].error, ValueError)
+
+    def test_list(self):
+        ret1 = asyncio.run(self.manager.list())
+        ret2 = asyncio.run(self.manager.list(disable_rbac=False))
+
+        self.assertEqual(['metric1', 'metric2'], ret1)
+        self.assertEqual(['metric1', 'metric2'], ret2)
+        self.prom.label_values.assert_awaited_with(
+            '__name__', matches=["{project='project_id'}"], start=None,
+            end=None, limit=None
+        )
+        self.prom.series.assert_not_called()
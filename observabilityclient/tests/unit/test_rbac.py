@@ -178,6 +178,86 @@ class PromQLRbacTest(testtools.TestCase):
             )
         ]
 
+    def test_modify_query_only_modifies_vector_selectors(self):
+        test_cases = [
+            (
+                "test_query{label='test_query'}",
+
+                (f"test_query{{label='test_query', "
+                 f"project='{self.project_id}'}}")
+            ), (
+                "sum by (http_requests) (http_requests)",
+
+                (f"sum by (http_requests) (http_requests"
+                 f"{{project='{self.project_id}'}})")
+            ), (
+                "max_over_time(rate(http_requests[5m])[1h:5m])",
+
+                (f"max_over_time(rate(http_requests"
+                 f"{{project='{self.project_id}'}}[5m])[1h:5m])")
+            ), (
+                "test_query {label='a',}",
+
+                (f"test_query {{label='a',"
+                 f"project='{self.project_id}'}}")
+            ), (
+                "unknown_metric + test_query",
+
+                (f"unknown_metric{{project='{self.project_id}'}} + "
+                 f"test_query{{project='{self.project_id}'}}")
+            ),
+        ]
+        for query, expected in test_cases:
+            ret = self.rbac.modify_query(query)
+            self.assertEqual(expected, ret)
+
+    def test_modify_query_utf8_names_and_modifiers(self):
+        test_cases = [
+            (
+                '{"utf8.name"}',
+
+                f'{{"utf8.name", project=\'{self.project_id}\'}}'
+            ), (
+                '{"utf8.name", "label.name"="value"}',
+
+                (f'{{"utf8.name", "label.name"="value", '
+                 f'project=\'{self.project_id}\'}}')
+            ), (
+                'sum by ("label.name") (rate({"utf8.name"}[5m]))',
+
+                (f'sum by ("label.name") (rate({{"utf8.name", '
+                 f'project=\'{self.project_id}\'}}[5m]))')
+            ), (
+                "max_over_time(test_query[1h:5m] offset 1h @ end())",
+
+                (f"max_over_time(test_query"
+                 f"{{project='{self.project_id}'}}"
+                 f"[1h:5m] offset 1h @ end())")
+            ), (
+                "avg_over_time((test_query + http_requests)[30m:])",
+
+                (f"avg_over_time((test_query"
+                 f"{{project='{self.project_id}'}} + http_requests"
+                 f"{{project='{self.project_id}'}})[30m:])")
+            ),
+        ]
+        for query, expected in test_cases:
+            ret = self.rbac.modify_query(query)
+            self.assertEqual(expected, ret)
+
+    def test_modify_query_invalid_query(self):
+        for query in ("test_query{", "sum(test_query", "test_query{a}",
+                      "test_query +", "{}"):
+            self.assertRaises(ValueError, self.rbac.modify_query, query)
+
+    def test_modify_query_function_named_as_metric(self):
+        query = "test_query(http_requests)"
+        expected = f"test_query(http_requests{{project='{self.project_id}'}})"
+
+        ret = self.rbac.modify_query(query)
+
+        self.assertEqual(expected, ret)
+
     def test_constructor(self):
         r = rbac.PromQLRbac("client", "123")
         self.assertEqual(r.labels, {
@@ -189,6 +269,100 @@ class PromQLRbacTest(testtools.TestCase):
             ret = self.rbac.modify_query(query)
             self.assertEqual(expected, ret)
 
+    def test_prepare(self):
+        for query, expected in self.test_cases:
+            prepared = self.rbac.prepare(query)
+            self.assertEqual(expected, prepared.render(self.project_id))
+
+    def test_prepared_query_renders_without_parsing(self):
+        query = "sum(test_query{a='b'}) / count(unknown_metric)"
+        prepared = self.rbac.prepare(query)
+
+        with mock.patch.object(rbac.promql, 'parse') as m:
+            ret1 = prepared.render("p1")
+            ret2 = prepared.render("p2")
+
+        m.assert_not_called()
+        self.rbac.client.label_values.assert_not_called()
+        self.assertEqual("sum(test_query{a='b', project='p1'}) / "
+                         "count(unknown_metric{project='p1'})", ret1)
+        self.assertEqual("sum(test_query{a='b', project='p2'}) / "
+                         "count(unknown_metric{project='p2'})", ret2)
+
+    def test_prepare_uses_project_label(self):
+        promql_rbac = rbac.PromQLRbac(mock.Mock(), "p1",
+                                      project_label="tenant")
+
+        self.assertEqual("test_query{tenant='p2'}",
+                         promql_rbac.prepare("test_query").render("p2"))
+
+    def test_render_projects(self):
+        prepared = self.rbac.prepare(
+            "sum by (project) (rate(test_query[5m])) / "
+            "on(project) group_left count by (project) (http_requests)"
+        )
+
+        ret = prepared.render_projects(["p1", "p.2", "p1", "it's"])
+
+        self.assertEqual(
+            [(["p1", "p.2", "it's"],
+              "sum by (project) (rate(test_query{project=~'p1|p\\\\.2|"
+              "it\\'s'}[5m])) / on(project) group_left count by (project) "
+              "(http_requests{project=~'p1|p\\\\.2|it\\'s'})")],
+            ret
+        )
+
+    def test_render_projects_chunks(self):
+        prepared = self.rbac.prepare("test_query + http_requests")
+        project_ids = [f"project{i}" for i in range(10)]
+
+        ret = prepared.render_projects(project_ids, max_length=100)
+
+        self.assertEqual(project_ids,
+                         [i for chunk, _ in ret for i in chunk])
+        self.assertGreater(len(ret), 1)
+        for chunk, query in ret:
+            self.assertLessEqual(len(query), 100)
+            self.assertIn("|".join(chunk), query)
+        # A single project is never split
+        ret = prepared.render_projects(["a" * 200], max_length=100)
+        self.assertEqual([["a" * 200]], [chunk for chunk, _ in ret])
+
+    def test_render_projects_rejects_mixing_projects(self):
+        queries = [
+            "sum(test_query)",
+            "sum by (job) (test_query)",
+            "sum without (project) (test_query)",
+            "count_values('project', test_query)",
+            "test_query / on(job) http_requests",
+            "test_query / ignoring(project) http_requests",
+            "test_query * on(project) group_left(project) http_requests",
+            "scalar(test_query)",
+            "absent(test_query)",
+            "label_replace(test_query, 'project', '$1', 'job', '(.*)')",
+            "label_join(test_query, 'project', ',', 'job')",
+        ]
+        for query in queries:
+            prepared = self.rbac.prepare(query)
+            self.assertRaises(ValueError, prepared.render_projects, ["p1"])
+
+    def test_render_projects_allows_separable_queries(self):
+        queries = [
+            "test_query",
+            "rate(test_query[5m]) * 2",
+            "sum by (project, job) (test_query)",
+            "sum without (job) (test_query)",
+            "topk by (project) (3, test_query)",
+            "test_query / http_requests",
+            "test_query / ignoring(job) http_requests",
+            "test_query * on(project, job) group_left(instance) "
+            "http_requests",
+            "label_replace(test_query, 'job', '$1', 'project', '(.*)')",
+        ]
+        for query in queries:
+            prepared = self.rbac.prepare(query)
+            self.assertEqual(1, len(prepared.render_projects(["p1"])))
+
     def test_append_rbac_labels(self):
         query = "test_query"
         expected = f"{query}{{project='{self.project_id}'}}"
@@ -254,4 +428,62 @@ class PromQLRbacTest(testtools.TestCase):
         ret = self.rbac.modify_query(query)
 
         self.assertEqual(expected, ret)
-        self.rbac.client.label_values.assert_called_once()
+        self.rbac.client.label_values.assert_not_called()
+
+    def test_metric_created_after_names_were_retrieved(self):
+        # The client doesn't know new_metric, like when it's created
+        # after the metric names were retrieved.
+        ret = self.rbac.modify_query("sum(new_metric) + foo")
+
+        self.assertEqual("sum(new_metric{project='project123'}) + "
+                         "foo{project='project123'}", ret)
+        self.assertEqual("sum(new_metric{project='project123'})",
+                         self.rbac.modify_query("sum(new_metric)",
+                                                ['test_query']))
+
+
+class PromQLRbacQueryCacheTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = mock.Mock()
+        self.rbac = rbac.PromQLRbac(self.client, "project1")
+
+    def test_modified_queries_are_cached(self):
+        query = "sum(test_query) / sum(http_requests)"
+        expected = ("sum(test_query{project='project1'}) / "
+                    "sum(http_requests{project='project1'})")
+
+        with mock.patch.object(rbac.promql, 'parse',
+                               wraps=rbac.promql.parse) as m:
+            self.assertEqual(expected, self.rbac.modify_query(query))
+            self.assertEqual(expected, self.rbac.modify_query(query))
+
+        m.assert_called_once()
+        self.assertEqual(1, self.rbac.query_cache.hits)
+        self.assertEqual(1, self.rbac.query_cache.misses)
+
+    def test_cache_key_includes_labels(self):
+        self.rbac.modify_query("test_query")
+        self.rbac.labels = {"project": "project2"}
+
+        self.assertEqual("test_query{project='project2'}",
+                         self.rbac.modify_query("test_query"))
+        self.assertEqual("test_query{project='project2'}",
+                         self.rbac.append_rbac_labels("test_query"))
+
+    def test_metric_names_are_ignored(self):
+        self.rbac.modify_query("test_query", ["test_query"])
+
+        self.assertEqual("test_query{project='project1'}",
+                         self.rbac.modify_query("test_query", ["other"]))
+        self.assertEqual(1, self.rbac.query_cache.hits)
+        self.client.label_values.assert_not_called()
+
+    def test_disabled_cache(self):
+        promql_rbac = rbac.PromQLRbac(self.client, "project1",
+                                      query_cache_size=0)
+        promql_rbac.modify_query("test_query")
+        promql_rbac.modify_query("test_query")
+
+        self.assertEqual(0, len(promql_rbac.query_cache))
+        self.assertEqual(0, promql_rbac.query_cache.hits)
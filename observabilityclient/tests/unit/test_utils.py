@@ -12,7 +12,10 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import io
+import json
 import os
+import types
 from unittest import mock
 
 from keystoneauth1 import adapter
@@ -20,7 +23,9 @@ from keystoneauth1 import session
 import testtools
 
 from observabilityclient import prometheus_client
+from observabilityclient.utils import json_utils
 from observabilityclient.utils import metric_utils
+from observabilityclient.utils import time_utils
 
 
 class GetConfigFileTest(testtools.TestCase):
@@ -92,6 +97,32 @@ class GetPrometheusClientTest(testtools.TestCase):
             metric_utils.get_prometheus_client()
         m.assert_called_with("env_override:env_port", None, "root_path_env")
 
+    def test_get_prometheus_client_pool_options(self):
+        config_data = ('host: "somehost"\nport: "1234"\n'
+                       'pool_maxsize: 20\nmax_retries: 3\n'
+                       'tcp_keepalive: true')
+        config_file = mock.mock_open(read_data=config_data)("name", 'r')
+        patched_env = {'PROMETHEUS_MAX_RETRIES': '5',
+                       'PROMETHEUS_RETRY_BACKOFF': '0.5'}
+        with mock.patch.dict(os.environ, patched_env), \
+                mock.patch.object(metric_utils, 'get_config_file',
+                                  return_value=config_file), \
+                mock.patch.object(prometheus_client.PrometheusAPIClient,
+                                  "set_connection_pool") as m:
+            metric_utils.get_prometheus_client()
+        m.assert_called_with(pool_maxsize=20, max_retries=5,
+                             retry_backoff=0.5, tcp_keepalive=True)
+
+    def test_get_prometheus_client_invalid_pool_option(self):
+        patched_env = {'PROMETHEUS_HOST': 'somehost',
+                       'PROMETHEUS_PORT': '1234',
+                       'PROMETHEUS_TCP_KEEPALIVE': 'maybe'}
+        with mock.patch.dict(os.environ, patched_env), \
+                mock.patch.object(metric_utils, 'get_config_file',
+                                  return_value=None):
+            self.assertRaises(metric_utils.ConfigurationError,
+                              metric_utils.get_prometheus_client)
+
     def test_get_prometheus_client_missing_configuration(self):
         with mock.patch.dict(os.environ, {}), \
                 mock.patch.object(metric_utils, 'get_config_file',
@@ -291,3 +322,205 @@ class Metrics2ColsTest(testtools.TestCase):
 
         ret = metric_utils.metrics2cols(input_metrics)
         self.assertEqual(expected, ret)
+
+    def test_metrics2rows(self):
+        input_metrics = [
+            prometheus_client.PrometheusMetric({
+                'value': [1234567, '5'],
+                'metric': {'b_label': 'value1'}
+            }),
+            prometheus_client.PrometheusMetric({
+                'value': [1234567, '6'],
+                'metric': {'a_label': 'value2'}
+            }),
+        ]
+
+        cols, rows = metric_utils.metrics2rows(input_metrics)
+
+        self.assertEqual(['a_label', 'b_label', 'value'], cols)
+        self.assertIsInstance(rows, types.GeneratorType)
+        self.assertEqual(['', 'value1', '5'], next(rows))
+        self.assertEqual([['value2', '', '6']], list(rows))
+
+
+class RangeMetrics2ColsTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+
+    def test_range_metrics2cols(self):
+        metric1 = {
+            'values': [[100, '1'], [130, '2']],
+            'metric': {
+                'b_label1': 'value1',
+            }
+        }
+        metric2 = {
+            'values': [[100, '3']],
+            'metric': {
+                'b_label1': 'value2',
+                'a_label2': 'value3',
+            }
+        }
+        input_metrics = [prometheus_client.PrometheusRangeMetric(metric1),
+                         prometheus_client.PrometheusRangeMetric(metric2)]
+        expected = (['a_label2', 'b_label1', 'timestamp', 'value'],
+                    [['', 'value1', 100.0, 1.0],
+                     ['', 'value1', 130.0, 2.0],
+                     ['value3', 'value2', 100.0, 3.0]])
+
+        ret = metric_utils.range_metrics2cols(input_metrics)
+        self.assertEqual(expected, ret)
+
+    def test_range_metrics2rows(self):
+        input_metrics = [prometheus_client.PrometheusRangeMetric({
+            'values': [[100, '1'], [130, '2']],
+            'metric': {'label': 'value'}
+        })]
+
+        cols, rows = metric_utils.range_metrics2rows(input_metrics)
+
+        self.assertEqual(['label', 'timestamp', 'value'], cols)
+        self.assertIsInstance(rows, types.GeneratorType)
+        self.assertEqual([['value', 100.0, 1.0], ['value', 130.0, 2.0]],
+                         list(rows))
+
+
+class WriteMetricsTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.metrics = [
+            prometheus_client.PrometheusMetric({
+                'value': [1234567, '5'],
+                'metric': {'b': 'value1', 'a': 'x"y'}
+            }),
+            prometheus_client.PrometheusRangeMetric({
+                'values': [[100, '1'], [130, '+Inf']],
+                'metric': {'a': 'value2'}
+            }),
+        ]
+
+    def test_write_metrics_ndjson(self):
+        out = io.StringIO()
+        metric_utils.write_metrics(iter(self.metrics), 'ndjson', out)
+
+        self.assertEqual([
+            {"metric": {"b": "value1", "a": 'x"y'}, "timestamp": 1234567,
+             "value": "5"},
+            {"metric": {"a": "value2"}, "timestamp": 100.0, "value": "1"},
+            {"metric": {"a": "value2"}, "timestamp": 130.0,
+             "value": "+Inf"},
+        ], [json.loads(line) for line in out.getvalue().splitlines()])
+
+    def test_write_metrics_csv(self):
+        out = io.StringIO()
+        metric_utils.write_metrics(iter(self.metrics), 'csv', out)
+
+        self.assertEqual('labels,timestamp,value\n'
+                         '"{a=""x\\""y"",b=""value1""}",1234567,5\n'
+                         '"{a=""value2""}",100.0,1\n'
+                         '"{a=""value2""}",130.0,+Inf\n',
+                         out.getvalue())
+
+    def test_write_metrics_tsv_columns(self):
+        out = io.StringIO()
+        metric_utils.write_metrics(iter(self.metrics), 'tsv', out,
+                                   columns=['b', 'value'])
+
+        self.assertEqual('b\tvalue\n'
+                         'value1\t5\n'
+                         '\t1\n'
+                         '\t+Inf\n',
+                         out.getvalue())
+
+    def test_write_metrics_unknown_format(self):
+        self.assertRaises(ValueError, metric_utils.write_metrics,
+                          self.metrics, 'xml', io.StringIO())
+
+
+class TimeUtilsTest(testtools.TestCase):
+    def setUp(self):
+        super().setUp()
+
+    def test_parse_duration(self):
+        self.assertEqual(30.0, time_utils.parse_duration(30))
+        self.assertEqual(1.5, time_utils.parse_duration("1.5"))
+        self.assertEqual(30.0, time_utils.parse_duration("30s"))
+        self.assertEqual(5400.0, time_utils.parse_duration("1h30m"))
+        self.assertEqual(0.25, time_utils.parse_duration("250ms"))
+        self.assertEqual(8 * 86400.0, time_utils.parse_duration("1w1d"))
+
+    def test_parse_duration_invalid(self):
+        for duration in ("", "1x", "m", "1h 30m", "h1"):
+            self.assertRaises(ValueError, time_utils.parse_duration, duration)
+
+    def test_parse_timestamp(self):
+        self.assertEqual(100.0, time_utils.parse_timestamp(100))
+        self.assertEqual(100.5, time_utils.parse_timestamp("100.5"))
+        self.assertEqual(86400.0,
+                         time_utils.parse_timestamp("1970-01-02T00:00:00Z"))
+        self.assertEqual(
+            82800.0,
+            time_utils.parse_timestamp("1970-01-02T00:00:00+01:00")
+        )
+        self.assertEqual(86400.0,
+                         time_utils.parse_timestamp("1970-01-02T00:00:00"))
+
+
+class JSONUtilsTest(testtools.TestCase):
+    def chunked(self, document, size):
+        data = json.dumps(document).encode()
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def test_iter_items(self):
+        document = {
+            "status": "success",
+            "data": {
+                "resultType": "vector",
+                "result": [
+                    {"metric": {"name": "ž\"]}"}, "value": [1.5, "1"]},
+                    {"metric": {}, "value": [12345, "2"]},
+                ]
+            },
+            "warnings": ["w"],
+        }
+        for size in (1, 2, 7, 1000):
+            meta = {}
+            items = list(json_utils.iter_items(
+                self.chunked(document, size), ("data", "result"), meta
+            ))
+            self.assertEqual(document["data"]["result"], items)
+            self.assertEqual({"status": "success", "resultType": "vector",
+                              "warnings": ["w"]}, meta)
+
+    def test_iter_items_numbers(self):
+        document = {"data": [1, 23456, 7.5e10]}
+        for size in (1, 3, 100):
+            self.assertEqual(document["data"], list(json_utils.iter_items(
+                self.chunked(document, size), ("data",)
+            )))
+
+    def test_iter_items_empty_and_missing(self):
+        self.assertEqual([], list(json_utils.iter_items(
+            self.chunked({"data": []}, 3), ("data",)
+        )))
+        self.assertEqual([], list(json_utils.iter_items(
+            self.chunked({"status": "error"}, 3), ("data",)
+        )))
+
+    def test_get_decoder(self):
+        data = b'{"a": [1, 2.5, "\xc5\xbe"]}'
+        for name in json_utils.DECODERS:
+            self.assertEqual({"a": [1, 2.5, "ž"]},
+                             json_utils.get_decoder(name)(data))
+        self.assertIs(json_utils.get_decoder(),
+                      next(iter(json_utils.DECODERS.values())))
+        self.assertIs(json.loads, json_utils.get_decoder("json"))
+        self.assertRaises(ValueError, json_utils.get_decoder, "unknown")
+
+    def test_iter_items_truncated(self):
+        chunks = self.chunked({"data": [{"a": 1}, {"b": 2}]}, 4)[:-2]
+
+        iterator = json_utils.iter_items(chunks, ("data",))
+
+        self.assertEqual({"a": 1}, next(iterator))
+        self.assertRaises(ValueError, next, iterator)
@@ -0,0 +1,177 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import codecs
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+
+# Decoders of JSON documents in bytes, the fastest ones first
+DECODERS = {}
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+if simdjson is not None:
+    DECODERS['simdjson'] = simdjson.loads
+DECODERS['json'] = json.loads
+
+_WHITESPACE_REGEX = re.compile(r"[ \t\n\r]*")
+_NUMBER_TAIL_REGEX = re.compile(r"[0-9.eE+-]*")
+
+
+def get_decoder(name=None):
+    """Return a function decoding a JSON document from bytes.
+
+    The accelerated decoders parse the bytes directly, without
+    decoding them into a str first.
+
+    :param name: name of the decoder, one of "orjson", "simdjson" or
+                 "json", None for the fastest installed one
+    :type name: str
+    """
+    if name is None:
+        return next(iter(DECODERS.values()))
+    try:
+        return DECODERS[name]
+    except KeyError:
+        raise ValueError(f"JSON decoder {name} isn't available")
+
+
+class _JSONStream:
+    """JSON text read from an iterable of byte chunks as it's needed."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+
+    def _read(self):
+        """Append the next chunk to the buffer, return False at the end."""
+        if self._eof:
+            return False
+        text = ""
+        while not text:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._eof = True
+                text = self._text_decoder.decode(b"", final=True)
+                break
+            text = self._text_decoder.decode(chunk)
+        # Drop the already parsed text, so the buffer doesn't keep
+        # the whole document.
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+        return bool(text) or not self._eof
+
+    def peek(self):
+        while True:
+            self._position = _WHITESPACE_REGEX.match(
+                self._buffer, self._position
+            ).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at JSON position "
+                             f"{self._position}, got {char!r}")
+        self._position += 1
+        return char
+
+    def value(self):
+        """Decode a complete JSON value starting at the current position."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer,
+                                                      self._position)
+            except json.JSONDecodeError:
+                if self._read():
+                    continue
+                raise
+            # A number at the end of the buffer might continue
+            # in the next chunk.
+            if (self._buffer[end - 1] not in '}]"' and
+                    _NUMBER_TAIL_REGEX.fullmatch(self._buffer, end) and
+                    self._read()):
+                continue
+            self._position = end
+            return value
+
+
+def _iter_object_items(stream, path, meta):
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.expect('}')
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key != path[0]:
+            meta[key] = stream.value()
+        elif len(path) > 1:
+            yield from _iter_object_items(stream, path[1:], meta)
+        elif stream.peek() != '[':
+            meta[key] = stream.value()
+        else:
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.expect(']')
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.expect(',]') == ']':
+                        break
+        if stream.expect(',}') == '}':
+            return
+
+
+def iter_items(chunks, path, meta=None):
+    """Iterate over items of an array inside of a JSON document.
+
+    The document is parsed incrementally, each item is yielded as soon
+    as all of its text is read. Only the text of a single item needs
+    to be kept in memory at once.
+
+    A call like this:
+    iter_items(chunks, ("data", "result"))
+    yields the items of the "result" array of the "data" object of
+    the top level object.
+
+    :param chunks: the JSON document split into chunks of bytes
+    :type chunks: iterable of bytes
+    :param path: keys of the nested objects leading to the array
+    :type path: tuple of str
+    :param meta: if set, the values of the other keys of the objects
+                 on the path are stored into it
+    :type meta: dict
+    """
+    if meta is None:
+        meta = {}
+    yield from _iter_object_items(_JSONStream(chunks), path, meta)
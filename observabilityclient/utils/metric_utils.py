@@ -12,6 +12,8 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import csv
+import json
 import logging
 import os
 from urllib import parse
@@ -19,9 +21,12 @@ from urllib import parse
 from keystoneauth1 import adapter
 from keystoneauth1.exceptions import catalog as keystone_exception
 from oslo_utils import netutils
+from oslo_utils import strutils
 import yaml
 
+from observabilityclient.frame import format_value
 from observabilityclient.prometheus_client import PrometheusAPIClient
+from observabilityclient.prometheus_client import PrometheusRangeMetric
 
 
 DEFAULT_CONFIG_LOCATIONS = (
@@ -30,6 +35,18 @@ DEFAULT_CONFIG_LOCATIONS = (
     else ["/etc/openstack/"]
 )
 CONFIG_FILE_NAME = "prometheus.yaml"
+# Output formats of write_metrics()
+STREAM_FORMATS = ('ndjson', 'csv', 'tsv')
+# Connection pool options of the config file, their environment
+# variables and types
+POOL_OPTIONS = (
+    ('pool_connections', 'PROMETHEUS_POOL_CONNECTIONS', int),
+    ('pool_maxsize', 'PROMETHEUS_POOL_MAXSIZE', int),
+    ('max_retries', 'PROMETHEUS_MAX_RETRIES', int),
+    ('retry_backoff', 'PROMETHEUS_RETRY_BACKOFF', float),
+    ('tcp_keepalive', 'PROMETHEUS_TCP_KEEPALIVE',
+     lambda v: strutils.bool_from_string(v, strict=True)),
+)
 LOG = logging.getLogger(__name__)
 
 
@@ -76,6 +93,7 @@ def get_prom_client_from_keystone(session, adapter_options=None):
 def get_prom_client_from_file_or_env():
     host = port = ca_cert = None
     root_path = ''
+    pool_options = {}
     conf_file = get_config_file()
     if conf_file is not None:
         conf = yaml.safe_load(conf_file)
@@ -87,6 +105,9 @@ def get_prom_client_from_file_or_env():
             ca_cert = conf['ca_cert']
         if 'root_path' in conf:
             root_path = conf['root_path']
+        for option, _, _ in POOL_OPTIONS:
+            if option in conf:
+                pool_options[option] = conf[option]
         conf_file.close()
     if 'PROMETHEUS_HOST' in os.environ:
         host = os.environ['PROMETHEUS_HOST']
@@ -96,6 +117,17 @@ def get_prom_client_from_file_or_env():
         ca_cert = os.environ['PROMETHEUS_CA_CERT']
     if 'PROMETHEUS_ROOT_PATH' in os.environ:
         root_path = os.environ['PROMETHEUS_ROOT_PATH']
+    for option, env_var, _ in POOL_OPTIONS:
+        if env_var in os.environ:
+            pool_options[option] = os.environ[env_var]
+    for option, _, option_type in POOL_OPTIONS:
+        if option in pool_options:
+            try:
+                pool_options[option] = option_type(pool_options[option])
+            except ValueError:
+                raise ConfigurationError(
+                    f"Invalid value of {option}: {pool_options[option]}"
+                )
     if host is None or port is None:
         raise ConfigurationError("Can't find prometheus host and "
                                  "port configuration in config file or "
@@ -106,6 +138,8 @@ def get_prom_client_from_file_or_env():
     )
     if ca_cert is not None:
         client.set_ca_cert(ca_cert)
+    if pool_options:
+        client.set_connection_pool(**pool_options)
     return client
 
 
@@ -163,16 +197,127 @@ def format_labels(d: dict) -> str:
     return ret
 
 
-def metrics2cols(m):
-    # get all label keys
-    cols = list(set().union(*(d.labels.keys() for d in m)))
-    cols.sort()
-    cols.append("value")
-    fields = []
+def _label_columns(m):
+    keys = set()
+    for metric in m:
+        keys.update(metric.labels)
+    cols = sorted(keys)
+    return cols, {key: i for i, key in enumerate(cols)}
+
+
+def _iter_metric_rows(m, index):
+    value_index = len(index)
+    for metric in m:
+        row = [""] * (value_index + 1)
+        for key, value in metric.labels.items():
+            row[index[key]] = value
+        row[value_index] = metric.value
+        yield row
+
+
+def _iter_range_metric_rows(m, index):
     for metric in m:
-        row = [""] * len(cols)
+        labels = [""] * len(index)
         for key, value in metric.labels.items():
-            row[cols.index(key)] = value
-        row[cols.index("value")] = metric.value
-        fields.append(row)
-    return cols, fields
+            labels[index[key]] = value
+        for timestamp, value in zip(metric.timestamps, metric.values):
+            yield labels + [timestamp, value]
+
+
+def metrics2rows(m):
+    """Return the columns and a generator of rows of a query result.
+
+    The rows are built only as they are consumed, so the output can be
+    formatted without keeping the whole table in memory.
+
+    :param m: result of a query
+    :type m: [PrometheusMetric]
+    """
+    cols, index = _label_columns(m)
+    return cols + ["value"], _iter_metric_rows(m, index)
+
+
+def range_metrics2rows(m):
+    """Return the columns and a generator of rows of a range query result.
+
+    Each sample of each series is a separate row.
+
+    :param m: result of a range query
+    :type m: [PrometheusRangeMetric]
+    """
+    cols, index = _label_columns(m)
+    return cols + ["timestamp", "value"], _iter_range_metric_rows(m, index)
+
+
+def metrics2cols(m):
+    cols, rows = metrics2rows(m)
+    return cols, list(rows)
+
+
+def range_metrics2cols(m):
+    cols, rows = range_metrics2rows(m)
+    return cols, list(rows)
+
+
+def _iter_samples(metrics):
+    for metric in metrics:
+        if isinstance(metric, PrometheusRangeMetric):
+            for timestamp, value in zip(metric.timestamps, metric.values):
+                yield metric.labels, float(timestamp), format_value(value)
+        else:
+            yield metric.labels, metric.timestamp, metric.value
+
+
+def _format_label_set(labels):
+    escaped = (
+        (key, value.replace('\\', '\\\\').replace('"', '\\"')
+         .replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def write_metrics(metrics, stream_format, out, columns=None):
+    """Write a query result to out, one sample at a time.
+
+    The metrics are consumed one by one and nothing is kept after
+    a sample is written, so a result streamed from Prometheus is
+    written with constant memory use.
+
+    The "ndjson" format writes a JSON object with the "metric",
+    "timestamp" and "value" keys for each sample. The "csv" and "tsv"
+    formats write a header and a row for each sample. Without columns,
+    the rows have a "labels" column with the label set in the PromQL
+    notation and the "timestamp" and "value" columns.
+
+    :param metrics: result of a query or a range query
+    :type metrics: iterable of PrometheusMetric or PrometheusRangeMetric
+    :param stream_format: one of STREAM_FORMATS
+    :type stream_format: str
+    :param out: file to write to
+    :type out: text file
+    :param columns: label names, "timestamp" or "value", selecting
+                    the columns of the csv and tsv formats
+    :type columns: [str]
+    """
+    if stream_format == 'ndjson':
+        for labels, timestamp, value in _iter_samples(metrics):
+            out.write(json.dumps({"metric": labels, "timestamp": timestamp,
+                                  "value": value}))
+            out.write("\n")
+        return
+    if stream_format not in STREAM_FORMATS:
+        raise ValueError(f"Unknown output format {stream_format}")
+
+    dialect = 'excel' if stream_format == 'csv' else 'excel-tab'
+    writer = csv.writer(out, dialect=dialect, lineterminator="\n")
+    if not columns:
+        writer.writerow(["labels", "timestamp", "value"])
+        for labels, timestamp, value in _iter_samples(metrics):
+            writer.writerow([_format_label_set(labels), timestamp, value])
+        return
+    writer.writerow(columns)
+    for labels, timestamp, value in _iter_samples(metrics):
+        sample = {"timestamp": timestamp, "value": value}
+        writer.writerow([sample[c] if c in sample else labels.get(c, "")
+                         for c in columns])
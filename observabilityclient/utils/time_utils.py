@@ -0,0 +1,78 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import datetime
+import re
+
+
+DURATION_UNITS = {
+    'ms': 0.001,
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+    'w': 7 * 24 * 60 * 60,
+    'y': 365 * 24 * 60 * 60,
+}
+DURATION_REGEX = re.compile(r"(\d+(?:\.\d+)?)(ms|[smhdwy])")
+
+
+def parse_duration(duration) -> float:
+    """Convert a Prometheus duration to a number of seconds.
+
+    :param duration: Prometheus duration like "1h30m" or a number
+                     of seconds
+    :type duration: str or float
+    """
+    if isinstance(duration, (int, float)):
+        return float(duration)
+    try:
+        return float(duration)
+    except ValueError:
+        pass
+    seconds = 0.0
+    position = 0
+    for match in DURATION_REGEX.finditer(duration):
+        if match.start() != position:
+            break
+        seconds += float(match.group(1)) * DURATION_UNITS[match.group(2)]
+        position = match.end()
+    if position == 0 or position != len(duration):
+        raise ValueError(f"Invalid duration: {duration}")
+    return seconds
+
+
+def parse_timestamp(timestamp) -> float:
+    """Convert a Prometheus timestamp to a unix timestamp.
+
+    :param timestamp: rfc3339 string or unix timestamp
+    :type timestamp: str or float
+    """
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    if isinstance(timestamp, datetime.datetime):
+        parsed = timestamp
+    else:
+        try:
+            return float(timestamp)
+        except ValueError:
+            pass
+        # NOTE: datetime.fromisoformat() doesn't accept the "Z" suffix
+        # before Python 3.11
+        if timestamp.endswith(('Z', 'z')):
+            timestamp = timestamp[:-1] + '+00:00'
+        parsed = datetime.datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
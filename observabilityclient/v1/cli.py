@@ -12,23 +12,71 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import time
+
 from cliff import lister
+from osc_lib import exceptions
 
+from observabilityclient import export
 from observabilityclient.i18n import _
+from observabilityclient.prometheus_client import PrometheusRangeMetric
 from observabilityclient.utils import metric_utils
+from observabilityclient.utils import time_utils
 from observabilityclient.v1 import base
 
 
 class List(base.ObservabilityBaseCommand, lister.Lister):
     """Query prometheus for list of all metrics."""
 
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            '--since',
+            help=_("List only metrics with samples within this duration "
+                   "before now, for example 1h. Prometheus then searches "
+                   "only its recent data."))
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help=_("Maximum number of listed metrics. Requires "
+                   "Prometheus 2.52 or newer."))
+        return parser
+
     def take_action(self, parsed_args):
         client = metric_utils.get_client(self)
-        metrics = client.query.list(disable_rbac=parsed_args.disable_rbac)
+        start = None
+        if parsed_args.since is not None:
+            start = time.time() - time_utils.parse_duration(parsed_args.since)
+        metrics = client.query.list(disable_rbac=parsed_args.disable_rbac,
+                                    start=start, limit=parsed_args.limit)
         return ["metric_name"], [[m] for m in metrics]
 
 
-class Show(base.ObservabilityBaseCommand, lister.Lister):
+class _StreamingLister(base.ObservabilityBaseCommand, lister.Lister):
+    """Base class for commands able to stream the queried metrics."""
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            '--stream',
+            choices=metric_utils.STREAM_FORMATS,
+            help=_("Write each sample to the output as soon as it's "
+                   "received, in the given format, instead of formatting "
+                   "the whole result at once. The -c option selects "
+                   "the columns of the csv and tsv formats."))
+        return parser
+
+    def produce_output(self, parsed_args, column_names, data):
+        if getattr(parsed_args, 'stream', None) is None:
+            return super().produce_output(parsed_args, column_names, data)
+        # NOTE: In stream mode, take_action() returns the metrics
+        # themselves instead of the rows.
+        metric_utils.write_metrics(data, parsed_args.stream, self.app.stdout,
+                                   parsed_args.columns)
+        return 0
+
+
+class Show(_StreamingLister):
     """Query prometheus for the current value of metric."""
 
     def get_parser(self, prog_name):
@@ -40,13 +88,16 @@ class Show(base.ObservabilityBaseCommand, lister.Lister):
 
     def take_action(self, parsed_args):
         client = metric_utils.get_client(self)
+        if parsed_args.stream is not None:
+            return None, client.query.show(
+                parsed_args.name, disable_rbac=parsed_args.disable_rbac,
+                stream=True)
         metric = client.query.show(parsed_args.name,
                                    disable_rbac=parsed_args.disable_rbac)
-        ret = metric_utils.metrics2cols(metric)
-        return ret
+        return metric_utils.metrics2rows(metric)
 
 
-class Query(base.ObservabilityBaseCommand, lister.Lister):
+class Query(_StreamingLister):
     """Query prometheus with a custom query string."""
 
     def get_parser(self, prog_name):
@@ -54,14 +105,128 @@ class Query(base.ObservabilityBaseCommand, lister.Lister):
         parser.add_argument(
             'query',
             help=_("Custom PromQL query"))
+        parser.add_argument(
+            '--start',
+            help=_("Start timestamp of a range query in rfc3339 or "
+                   "unix timestamp. Requires --end and --step."))
+        parser.add_argument(
+            '--end',
+            help=_("End timestamp of a range query in rfc3339 or "
+                   "unix timestamp. Requires --start and --step."))
+        parser.add_argument(
+            '--step',
+            help=_("Resolution step of a range query as a duration "
+                   "or a number of seconds. Requires --start and --end."))
         return parser
 
     def take_action(self, parsed_args):
         client = metric_utils.get_client(self)
+        range_args = (parsed_args.start, parsed_args.end, parsed_args.step)
+        if any(arg is not None for arg in range_args):
+            if any(arg is None for arg in range_args):
+                raise exceptions.CommandError(
+                    _("--start, --end and --step must be specified "
+                      "together"))
+            if parsed_args.stream is not None:
+                return None, client.query.query_range(
+                    parsed_args.query, *range_args,
+                    disable_rbac=parsed_args.disable_rbac, stream=True)
+            metric = client.query.query_range(
+                parsed_args.query, *range_args,
+                disable_rbac=parsed_args.disable_rbac)
+            return metric_utils.range_metrics2rows(metric)
+        if parsed_args.stream is not None:
+            return None, client.query.query(
+                parsed_args.query, disable_rbac=parsed_args.disable_rbac,
+                stream=True)
         metric = client.query.query(parsed_args.query,
                                     disable_rbac=parsed_args.disable_rbac)
-        ret = metric_utils.metrics2cols(metric)
-        return ret
+        # NOTE: Range vector selectors, like foo[5m], return a matrix
+        # from an instant query too.
+        if metric and isinstance(metric[0], PrometheusRangeMetric):
+            return metric_utils.range_metrics2rows(metric)
+        return metric_utils.metrics2rows(metric)
+
+
+class Export(base.ObservabilityBaseCommand):
+    """Export samples of series over a range of time into files."""
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            'selector',
+            help=_("Series selector or PromQL query to export. Only "
+                   "a series selector can be split with --shards."))
+        parser.add_argument(
+            '--start',
+            required=True,
+            help=_("Start timestamp in rfc3339 or unix timestamp."))
+        parser.add_argument(
+            '--end',
+            required=True,
+            help=_("End timestamp in rfc3339 or unix timestamp."))
+        parser.add_argument(
+            '--step',
+            required=True,
+            help=_("Resolution step as a duration or a number of "
+                   "seconds."))
+        parser.add_argument(
+            '--output-dir',
+            required=True,
+            help=_("Directory to write the exported files to. Running "
+                   "the same export into the same directory resumes it."))
+        parser.add_argument(
+            '--window',
+            default=export.DEFAULT_EXPORT_WINDOW,
+            help=_("Length of the time range of a single file as a "
+                   "duration or a number of seconds. Defaults to 1d."))
+        parser.add_argument(
+            '--shard-label',
+            help=_("Label dividing the series into shards. Each shard is "
+                   "fetched and written separately."))
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=1,
+            help=_("Number of series shards, requires --shard-label."))
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            default=export.DEFAULT_EXPORT_WORKERS,
+            help=_("Maximum number of files fetched in parallel."))
+        parser.add_argument(
+            '--format',
+            dest='output_format',
+            choices=sorted(export.FORMATS),
+            help=_("Format of the files. Defaults to parquet when "
+                   "pyarrow is installed, to gzip compressed MetricFrame "
+                   "files otherwise."))
+        parser.add_argument(
+            '--no-resume',
+            action='store_false',
+            dest='resume',
+            help=_("Export everything again, even if a previous run "
+                   "already exported a part of it."))
+        return parser
+
+    def _print_progress(self, status):
+        elapsed = max(status.elapsed, 1e-9)
+        self.app.stderr.write(
+            f"{status.done}/{status.total} files, {status.samples} "
+            f"samples, {status.samples / elapsed:.0f} samples/s, "
+            f"{status.bytes / elapsed / 1e6:.2f} MB/s\n")
+
+    def take_action(self, parsed_args):
+        client = metric_utils.get_client(self)
+        client.query.export(
+            parsed_args.selector, parsed_args.start, parsed_args.end,
+            parsed_args.step, parsed_args.output_dir,
+            window=parsed_args.window, shard_label=parsed_args.shard_label,
+            shards=parsed_args.shards, max_workers=parsed_args.parallel,
+            output_format=parsed_args.output_format,
+            resume=parsed_args.resume,
+            disable_rbac=parsed_args.disable_rbac,
+            progress=self._print_progress)
 
 
 class Delete(base.ObservabilityBaseCommand):
@@ -12,43 +12,89 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import asyncio
+import collections
+from concurrent import futures
+
+from observabilityclient import export
+from observabilityclient.frame import MetricFrame
+from observabilityclient import rbac
 from observabilityclient.utils.metric_utils import format_labels
 from observabilityclient.v1 import base
 
 
+DEFAULT_QUERY_WORKERS = 8
+
+QueryResult = collections.namedtuple(
+    'QueryResult', ['index', 'query', 'result', 'error']
+)
+QueryResult.__doc__ = """Result of one of the queries sent by query_many().
+
+:ivar index: position of the query in the list passed to query_many()
+:ivar query: the query as passed to query_many()
+:ivar result: list of returned metrics or None if the query failed
+:ivar error: the raised exception or None if the query succeeded
+"""
+
+
 class QueryManager(base.Manager):
-    def list(self, disable_rbac=True):
+    def list(self, disable_rbac=True, start=None, end=None, limit=None):
         """List metric names.
 
         :param disable_rbac: Disables rbac injection if set to True
         :type disable_rbac: boolean
+        :param start: If set, only metrics with samples after start
+                      are listed. Prometheus then searches only the data
+                      blocks covering the time range.
+        :type start: rfc3339 or unix_timestamp
+        :param end: If set, only metrics with samples before end
+                    are listed
+        :type end: rfc3339 or unix_timestamp
+        :param limit: maximum number of listed names, requires
+                      Prometheus 2.52 or newer
+        :type limit: int
         """
-        if disable_rbac:
-            metric_names = self.prom.label_values("__name__")
-            return sorted(metric_names)
-        else:
-            match = f"{{{format_labels(self.client.rbac.labels)}}}"
-            metrics = self.prom.series(match)
-            if metrics == []:
-                return []
-            unique_metric_names = list({m['__name__'] for m in metrics})
-            return sorted(unique_metric_names)
-
-    def show(self, name, disable_rbac=True):
+        matches = None
+        if not disable_rbac:
+            # NOTE: Prometheus deduplicates the names, so the label sets
+            # of all of the series of the project aren't transferred.
+            matches = [f"{{{format_labels(self.client.rbac.labels)}}}"]
+        metric_names = self.prom.label_values("__name__", matches=matches,
+                                              start=start, end=end,
+                                              limit=limit)
+        return sorted(metric_names)
+
+    def show(self, name, disable_rbac=True, frame=False, stream=False):
         """Show current values for metrics of a specified name.
 
         :param disable_rbac: Disables rbac injection if set to True
         :type disable_rbac: boolean
+        :param frame: Return the result as a MetricFrame if set to True
+        :type frame: boolean
+        :param stream: Return an iterator decoding the response
+                       incrementally instead of a list if set to True,
+                       see PrometheusAPIClient.query()
+        :type stream: boolean
         """
         query = ""
+        cache_scope = None
         if disable_rbac:
             query = name
         else:
             query = self.client.rbac.append_rbac_labels(name)
+            cache_scope = tuple(sorted(self.client.rbac.labels.items()))
         last_metric_query = f"last_over_time({query}[5m])"
-        return self.prom.query(last_metric_query)
+        if stream:
+            result = self.prom.query(last_metric_query, stream=True)
+        else:
+            result = self.prom.query(last_metric_query,
+                                     cache_scope=cache_scope)
+        if frame:
+            return MetricFrame.from_metrics(result)
+        return result
 
-    def query(self, query, disable_rbac=True):
+    def query(self, query, disable_rbac=True, frame=False,
+              stream=False):
         """Send a query to prometheus.
 
         The query can be any PromQL query. Labels for enforcing
@@ -65,10 +111,225 @@ class QueryManager(base.Manager):
         :type query: str
         :param disable_rbac: Disables rbac injection if set to True
         :type disable_rbac: boolean
+        :param frame: Return the result as a MetricFrame if set to True
+        :type frame: boolean
+        :param stream: Return an iterator decoding the response
+                       incrementally instead of a list if set to True,
+                       see PrometheusAPIClient.query()
+        :type stream: boolean
+        """
+        cache_scope = None
+        if not disable_rbac:
+            query = self.client.rbac.modify_query(query)
+            cache_scope = tuple(sorted(self.client.rbac.labels.items()))
+        if stream:
+            result = self.prom.query(query, stream=True)
+        else:
+            result = self.prom.query(query, cache_scope=cache_scope)
+        if frame:
+            return MetricFrame.from_metrics(result)
+        return result
+
+    def query_many(self, queries, disable_rbac=True,
+                   max_workers=DEFAULT_QUERY_WORKERS, ordered=True):
+        """Send many queries to prometheus concurrently.
+
+        The queries are sent from a pool of at most max_workers threads
+        sharing the connections of the Prometheus client. Every unique
+        query is modified for rbac and sent only once, repeated queries
+        get the same result.
+
+        A failing query doesn't stop the other ones. Its exception is
+        returned in the error attribute of its QueryResult instead.
+
+        :param queries: Custom query strings
+        :type queries: [str]
+        :param disable_rbac: Disables rbac injection if set to True
+        :type disable_rbac: boolean
+        :param max_workers: maximum number of queries sent at once
+        :type max_workers: int
+        :param ordered: If True, a list of results in the order of the
+                        queries is returned. Otherwise an iterator
+                        yielding the results as soon as they arrive
+                        is returned.
+        :type ordered: boolean
+        """
+        indexes = collections.defaultdict(list)
+        for index, query in enumerate(queries):
+            indexes[query].append(index)
+
+        results = self._query_many(indexes, disable_rbac, max_workers)
+        if not ordered:
+            return results
+        ret = [None] * len(queries)
+        for result in results:
+            ret[result.index] = result
+        return ret
+
+    def _query_many(self, indexes, disable_rbac, max_workers):
+        def send(query):
+            if not disable_rbac:
+                query = self.client.rbac.modify_query(query)
+            return self.prom.query(query)
+
+        if not indexes:
+            return
+        with futures.ThreadPoolExecutor(
+                max_workers=min(max_workers, len(indexes))) as executor:
+            pending = {executor.submit(send, query): query
+                       for query in indexes}
+            for future in futures.as_completed(pending):
+                query = pending[future]
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                for index in indexes[query]:
+                    yield QueryResult(index, query, result, error)
+
+    def query_projects(self, query, project_ids,
+                       max_query_length=rbac.DEFAULT_MAX_QUERY_LENGTH):
+        """Send one query for many projects and split its result.
+
+        Instead of sending the query once for every project, labels
+        matching any of the projects are added to all metric names
+        inside the query. The returned series are split by their
+        project label afterwards.
+
+        To keep the results of the projects apart, the query must never
+        combine series of different projects. For example aggregations
+        need to group by the project label and vector matching needs
+        to match on it:
+        query_projects("sum by (project) (rate(name1[5m]))", ["p1", "p2"])
+
+        :param query: Custom query string
+        :type query: str
+        :param project_ids: ids of the projects to query
+        :type project_ids: [str]
+        :param max_query_length: If the modified query would be longer,
+                                 the projects are split between more
+                                 queries
+        :type max_query_length: int
+        :returns: dictionary mapping each project id to its list of metrics
+
+        Raises ValueError if the query can combine series of different
+        projects or if a returned series doesn't belong to any of
+        the queried projects.
+        """
+        prepared = self.client.rbac.prepare(query)
+        project_label = prepared.project_label
+        ret = {project_id: [] for project_id in project_ids}
+        for chunk, chunk_query in prepared.render_projects(
+                project_ids, max_length=max_query_length):
+            chunk = set(chunk)
+            for metric in self.prom.query(chunk_query):
+                project_id = metric.labels.get(project_label)
+                if project_id not in chunk:
+                    raise ValueError(
+                        f"Query returned a series without a valid "
+                        f"{project_label} label: {metric.labels}"
+                    )
+                ret[project_id].append(metric)
+        return ret
+
+    def query_range(self, query, start, end, step, disable_rbac=True,
+                    split_interval=None, frame=False, stream=False):
+        """Send a range query to prometheus.
+
+        Works the same way as query(), but evaluates the query over
+        a range of time. Each returned series holds its samples
+        in compact timestamp and value arrays.
+
+        :param query: Custom query string
+        :type query: str
+        :param start: start of the queried time range
+        :type start: rfc3339 or unix_timestamp
+        :param end: end of the queried time range
+        :type end: rfc3339 or unix_timestamp
+        :param step: query resolution step width
+        :type step: duration or float number of seconds
+        :param disable_rbac: Disables rbac injection if set to True
+        :type disable_rbac: boolean
+        :param split_interval: If set, the time range gets split into
+                               windows of this length, which are queried
+                               in parallel
+        :type split_interval: duration or float number of seconds
+        :param frame: Return the result as a MetricFrame if set to True
+        :type frame: boolean
+        :param stream: Return an iterator decoding the response
+                       incrementally instead of a list if set to True,
+                       see PrometheusAPIClient.query_range()
+        :type stream: boolean
         """
+        cache_scope = None
         if not disable_rbac:
             query = self.client.rbac.modify_query(query)
-        return self.prom.query(query)
+            cache_scope = tuple(sorted(self.client.rbac.labels.items()))
+        if stream:
+            result = self.prom.query_range(query, start, end, step,
+                                           split_interval=split_interval,
+                                           stream=True)
+        else:
+            result = self.prom.query_range(query, start, end, step,
+                                           split_interval=split_interval,
+                                           cache_scope=cache_scope)
+        if frame:
+            return MetricFrame.from_metrics(result)
+        return result
+
+    def export(self, selector, start, end, step, directory,
+               window=export.DEFAULT_EXPORT_WINDOW, shard_label=None,
+               shards=1, max_workers=export.DEFAULT_EXPORT_WORKERS,
+               output_format=None, resume=True, disable_rbac=True,
+               progress=None):
+        """Export the samples of series over a range of time into files.
+
+        The time range is split into windows and the series into shards
+        by the values of shard_label. Each combination is a chunk, which
+        is fetched with query_range() and written to its own file in
+        directory. The chunks are fetched in parallel.
+
+        The exported chunks are recorded in a checkpoint file in
+        directory. Running the same export again resumes it, only
+        the missing chunks are fetched.
+
+        :param selector: query to export, usually a series selector
+        :type selector: str
+        :param start: start of the exported time range
+        :type start: rfc3339 or unix_timestamp
+        :param end: end of the exported time range
+        :type end: rfc3339 or unix_timestamp
+        :param step: resolution step width
+        :type step: duration or float number of seconds
+        :param directory: directory to write the chunk files to
+        :type directory: str
+        :param window: length of the time window of a chunk
+        :type window: duration or float number of seconds
+        :param shard_label: label to divide the series into shards by,
+                            selector must be a series selector then
+        :type shard_label: str
+        :param shards: number of series shards
+        :type shards: int
+        :param max_workers: maximum number of chunks fetched in parallel
+        :type max_workers: int
+        :param output_format: "parquet" or "frame", defaults to "parquet"
+                              when pyarrow is installed, see
+                              export.FORMATS
+        :type output_format: str
+        :param resume: Skips chunks exported by a previous run if set
+                       to True, exports everything again otherwise
+        :type resume: boolean
+        :param disable_rbac: Disables rbac injection if set to True
+        :type disable_rbac: boolean
+        :param progress: called with an ExportProgress after each chunk
+        :type progress: callable
+        :returns: the final ExportProgress
+        """
+        return export.export(self, selector, start, end, step, directory,
+                             window=window, shard_label=shard_label,
+                             shards=shards, max_workers=max_workers,
+                             output_format=output_format, resume=resume,
+                             disable_rbac=disable_rbac, progress=progress)
 
     def delete(self, matches, start=None, end=None):
         """Delete metrics from Prometheus.
@@ -98,3 +359,135 @@ class QueryManager(base.Manager):
     def snapshot(self):
         """Create a snapshot of the current data."""
         return self.prom.snapshot()
+
+
+class AsyncQueryManager:
+    """Asyncio counterpart of QueryManager.
+
+    Sends the queries with an AsyncPrometheusAPIClient. The queries
+    are modified with the same PromQLRbac as in the synchronous API,
+    which doesn't send any requests of its own.
+
+    :param prom: client used for sending the queries
+    :type prom: observabilityclient.prometheus_client.AsyncPrometheusAPIClient
+    :param rbac: rbac used for modifying the queries, required unless
+                 rbac is disabled for every call
+    :type rbac: observabilityclient.rbac.PromQLRbac
+    """
+
+    def __init__(self, prom, rbac=None):
+        self.prom = prom
+        self.rbac = rbac
+
+    def _check_rbac(self):
+        if self.rbac is None:
+            raise ValueError("Rbac can't be enabled without a PromQLRbac")
+
+    def _modify_query(self, query):
+        self._check_rbac()
+        return self.rbac.modify_query(query)
+
+    async def list(self, disable_rbac=True, start=None, end=None,
+                   limit=None):
+        """List metric names.
+
+        See QueryManager.list() for the arguments.
+        """
+        matches = None
+        if not disable_rbac:
+            self._check_rbac()
+            matches = [f"{{{format_labels(self.rbac.labels)}}}"]
+        metric_names = await self.prom.label_values(
+            "__name__", matches=matches, start=start, end=end, limit=limit
+        )
+        return sorted(metric_names)
+
+    async def show(self, name, disable_rbac=True):
+        """Show current values for metrics of a specified name.
+
+        :param disable_rbac: Disables rbac injection if set to True
+        :type disable_rbac: boolean
+        """
+        query = name
+        if not disable_rbac:
+            self._check_rbac()
+            query = self.rbac.append_rbac_labels(name)
+        return await self.prom.query(f"last_over_time({query}[5m])")
+
+    async def query(self, query, disable_rbac=True):
+        """Send a query to prometheus.
+
+        :param query: Custom query string
+        :type query: str
+        :param disable_rbac: Disables rbac injection if set to True
+        :type disable_rbac: boolean
+        """
+        if not disable_rbac:
+            query = self._modify_query(query)
+        return await self.prom.query(query)
+
+    async def query_many(self, queries, disable_rbac=True):
+        """Send many queries to prometheus concurrently.
+
+        Works the same way as QueryManager.query_many(), but the queries
+        run as coroutines on the current event loop and the number of
+        concurrent requests is limited by the connection pool of the
+        client. The results are returned in the order of the queries.
+
+        :param queries: Custom query strings
+        :type queries: [str]
+        :param disable_rbac: Disables rbac injection if set to True
+        :type disable_rbac: boolean
+        """
+        unique = list(dict.fromkeys(queries))
+        results = await asyncio.gather(
+            *(self.query(q, disable_rbac=disable_rbac) for q in unique),
+            return_exceptions=True
+        )
+        by_query = dict(zip(unique, results))
+        ret = []
+        for index, query in enumerate(queries):
+            result = by_query[query]
+            if isinstance(result, Exception):
+                ret.append(QueryResult(index, query, None, result))
+            else:
+                ret.append(QueryResult(index, query, result, None))
+        return ret
+
+    async def query_range(self, query, start, end, step, disable_rbac=True):
+        """Send a range query to prometheus.
+
+        :param query: Custom query string
+        :type query: str
+        :param start: start of the queried time range
+        :type start: rfc3339 or unix_timestamp
+        :param end: end of the queried time range
+        :type end: rfc3339 or unix_timestamp
+        :param step: query resolution step width
+        :type step: duration or float number of seconds
+        :param disable_rbac: Disables rbac injection if set to True
+        :type disable_rbac: boolean
+        """
+        if not disable_rbac:
+            query = self._modify_query(query)
+        return await self.prom.query_range(query, start, end, step)
+
+    async def delete(self, matches, start=None, end=None):
+        """Delete metrics from Prometheus.
+
+        :param matches: List of matches to match which metrics to delete
+        :type matches: [str]
+        :param start: timestamp from which to start deleting
+        :type start: rfc3339 or unix_timestamp
+        :param end: timestamp until which to delete
+        :type end: rfc3339 or unix_timestamp
+        """
+        return await self.prom.delete(matches, start, end)
+
+    async def clean_tombstones(self):
+        """Instruct prometheus to clean tombstones."""
+        return await self.prom.clean_tombstones()
+
+    async def snapshot(self):
+        """Create a snapshot of the current data."""
+        return await self.prom.snapshot()
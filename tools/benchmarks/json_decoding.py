@@ -0,0 +1,74 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""Benchmark of the JSON decoders of Prometheus responses.
+
+Decodes synthetic vector, matrix and series responses with every
+installed decoder. The "resp.json()" row decodes the bytes into a str
+first, like requests does.
+
+Usage: tox -e venv -- python tools/benchmarks/json_decoding.py [series]
+"""
+
+import json
+import sys
+import timeit
+
+from observabilityclient.utils import json_utils
+
+
+def labels(i):
+    return {
+        "__name__": "ceilometer_cpu",
+        "instance": f"compute-{i % 50}.example.com:9100",
+        "job": "ceilometer",
+        "project": f"{i % 200:032x}",
+        "resource": f"{i:08x}-4a2c-4c2e-9d6b-3f0c1e2a5b7d",
+    }
+
+
+def generate_payloads(count):
+    vector = [{"metric": labels(i), "value": [1700000000.123, str(i * 1.5)]}
+              for i in range(count)]
+    matrix = [{"metric": labels(i),
+               "values": [[1700000000 + 30 * j, str(i + j * 0.25)]
+                          for j in range(120)]}
+              for i in range(count // 100)]
+    series = [labels(i) for i in range(count)]
+    return {
+        "vector": {"status": "success",
+                   "data": {"resultType": "vector", "result": vector}},
+        "matrix": {"status": "success",
+                   "data": {"resultType": "matrix", "result": matrix}},
+        "series": {"status": "success", "data": series},
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    payloads = {name: json.dumps(payload).encode()
+                for name, payload in generate_payloads(count).items()}
+    decoders = dict(json_utils.DECODERS)
+    decoders["resp.json()"] = lambda data: json.loads(data.decode('utf-8'))
+
+    print(f"{count} series")
+    for payload_name, data in payloads.items():
+        print(f"{payload_name} ({len(data) / 1e6:.1f} MB)")
+        for name, decoder in decoders.items():
+            number, total = timeit.Timer(lambda: decoder(data)).autorange()
+            print(f"{name:>14}: {total / number * 1e3:10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""Benchmark of listing the metric names of a project.
+
+Serves the series of a single project from a local stub server and
+compares collecting the distinct metric names from the /series endpoint,
+like QueryManager.list() used to do, with asking the
+/label/__name__/values endpoint with a match[] selector.
+
+Usage: tox -e venv -- python tools/benchmarks/metric_list.py \
+       [series] [metric_names]
+"""
+
+from http import server
+import json
+import sys
+import threading
+import time
+
+from observabilityclient import prometheus_client
+
+
+class StubServer(server.ThreadingHTTPServer):
+    def __init__(self, count, names):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        series = [{
+            "__name__": f"ceilometer_metric_{i % names}",
+            "instance": f"compute-{i % 50}.example.com:9100",
+            "job": "ceilometer",
+            "project": "2dd8edd6c8c24f49bf04670534f6b357",
+            "resource": f"{i:08x}-4a2c-4c2e-9d6b-3f0c1e2a5b7d",
+        } for i in range(count)]
+        values = sorted({s["__name__"] for s in series})
+        self.bodies = {
+            "series": json.dumps({"status": "success",
+                                  "data": series}).encode(),
+            "values": json.dumps({"status": "success",
+                                  "data": values}).encode(),
+        }
+        self.bytes_sent = 0
+
+
+class StubHandler(server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        endpoint = self.path.split('?')[0].rsplit('/', 1)[-1]
+        body = self.server.bodies[endpoint]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def series_names(client, match):
+    return sorted({s["__name__"] for s in client.series([match])})
+
+
+def label_values_names(client, match):
+    return sorted(client.label_values("__name__", matches=[match]))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    names = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    stub = StubServer(count, names)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    client = prometheus_client.PrometheusAPIClient(
+        f"127.0.0.1:{stub.server_port}"
+    )
+    client.set_compression(enabled=False)
+    match = "{project='2dd8edd6c8c24f49bf04670534f6b357'}"
+
+    print(f"{count} series, {names} metric names")
+    for name, function in (("series", series_names),
+                           ("label_values", label_values_names)):
+        stub.bytes_sent = 0
+        start = time.perf_counter()
+        result = function(client, match)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>14}: {len(result)} names, "
+              f"{stub.bytes_sent / 1e6:10.2f} MB {elapsed * 1e3:10.1f} ms")
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""Memory benchmark of decoded vector query results.
+
+Measures the memory kept by a decoded result with tracemalloc and
+compares PrometheusMetric with the previous implementation, which had
+a per-instance __dict__ and kept the decoded label dicts as they were.
+
+Usage: tox -e venv -- python tools/benchmarks/metric_memory.py [series]
+"""
+
+import json
+import sys
+import tracemalloc
+
+from observabilityclient import prometheus_client
+
+
+class LegacyPrometheusMetric:
+    def __init__(self, input):
+        self.timestamp = input['value'][0]
+        self.labels = input['metric']
+        self.value = input['value'][1]
+
+
+def generate_payload(count):
+    return json.dumps({
+        "status": "success",
+        "data": {
+            "resultType": "vector",
+            "result": [{
+                "metric": {
+                    "__name__": "ceilometer_cpu",
+                    "instance": f"compute-{i % 50}.example.com:9100",
+                    "job": "ceilometer",
+                    "project": f"{i % 200:032x}",
+                    "resource": f"{i:08x}-4a2c-4c2e-9d6b-3f0c1e2a5b7d",
+                    "type": "instance",
+                },
+                "value": [1700000000.123, str(i % 1000)],
+            } for i in range(count)]
+        }
+    }).encode()
+
+
+def legacy_decode(data):
+    decoded = json.loads(data)
+    return [LegacyPrometheusMetric(i) for i in decoded['data']['result']]
+
+
+def decode(data):
+    return prometheus_client._decode_query_result(json.loads(data))
+
+
+def measure(function, data):
+    tracemalloc.start()
+    result = function(data)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = generate_payload(count)
+
+    print(f"{count} series")
+    for name, function in (("legacy", legacy_decode),
+                           ("PrometheusMetric", decode)):
+        size, peak = measure(function, data)
+        print(f"{name:>18}: {size / count:8.1f} bytes per series kept, "
+              f"{peak / 1e6:8.1f} MB peak")
+
+
+if __name__ == '__main__':
+    main()
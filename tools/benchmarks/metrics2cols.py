@@ -0,0 +1,65 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""Benchmark of building the CLI table of a vector query result.
+
+Compares metrics2cols with the previous implementation, which looked
+up the position of every cell with cols.index().
+
+Usage: tox -e venv -- python tools/benchmarks/metrics2cols.py [rows] [labels]
+"""
+
+import sys
+import timeit
+
+from observabilityclient import prometheus_client
+from observabilityclient.utils import metric_utils
+
+
+def legacy_metrics2cols(m):
+    cols = list(set().union(*(d.labels.keys() for d in m)))
+    cols.sort()
+    cols.append("value")
+    fields = []
+    for metric in m:
+        row = [""] * len(cols)
+        for key, value in metric.labels.items():
+            row[cols.index(key)] = value
+        row[cols.index("value")] = metric.value
+        fields.append(row)
+    return cols, fields
+
+
+def generate_metrics(rows, labels):
+    return [prometheus_client.PrometheusMetric({
+        "metric": {f"label_{j:02}": f"value-{i % (j + 2)}"
+                   for j in range(labels)},
+        "value": [1700000000.123, str(i)],
+    }) for i in range(rows)]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    labels = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    metrics = generate_metrics(rows, labels)
+
+    print(f"{rows} rows, {labels} labels")
+    for name, function in (("legacy", legacy_metrics2cols),
+                           ("metrics2cols", metric_utils.metrics2cols)):
+        number, total = timeit.Timer(lambda: function(metrics)).autorange()
+        print(f"{name:>14}: {total / number * 1e3:10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
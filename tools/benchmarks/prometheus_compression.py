@@ -0,0 +1,127 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""Benchmark of compressed Prometheus responses.
+
+Serves synthetic series and vector responses from a local stub server
+and compares transfer size and latency of uncompressed and gzip
+compressed responses. The stub server can limit its bandwidth to
+simulate a WAN link.
+
+Usage: tox -e venv -- python tools/benchmarks/prometheus_compression.py \
+       [series] [mbit_per_second]
+"""
+
+import gzip
+from http import server
+import json
+import sys
+import threading
+import time
+
+from observabilityclient import prometheus_client
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def generate_payloads(count):
+    series = [{
+        "__name__": "ceilometer_cpu",
+        "instance": f"compute-{i % 50}.example.com:9100",
+        "job": "ceilometer",
+        "project": f"{i % 200:032x}",
+        "resource": f"{i:08x}-4a2c-4c2e-9d6b-3f0c1e2a5b7d",
+        "type": "instance",
+    } for i in range(count)]
+    vector = [{"metric": labels, "value": [1700000000.123, str(i * 1.5)]}
+              for i, labels in enumerate(series)]
+    return {
+        "series": {"status": "success", "data": series},
+        "query": {"status": "success",
+                  "data": {"resultType": "vector", "result": vector}},
+    }
+
+
+class StubServer(server.ThreadingHTTPServer):
+    def __init__(self, payloads, bandwidth):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.bodies = {}
+        for endpoint, payload in payloads.items():
+            body = json.dumps(payload).encode()
+            self.bodies[endpoint] = (body, gzip.compress(body, 6))
+        self.bandwidth = bandwidth
+        self.bytes_sent = 0
+
+
+class StubHandler(server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        endpoint = self.path.split('?')[0].rsplit('/', 1)[-1]
+        body, compressed = self.server.bodies[endpoint]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = compressed
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for start in range(0, len(body), CHUNK_SIZE):
+            chunk = body[start:start + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            if self.server.bandwidth:
+                time.sleep(len(chunk) * 8 / self.server.bandwidth)
+        self.server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(stub, function, repeat=5):
+    stub.bytes_sent = 0
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return stub.bytes_sent / repeat, best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    mbit = float(sys.argv[2]) if len(sys.argv) > 2 else 100
+    stub = StubServer(generate_payloads(count), mbit * 1e6)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    client = prometheus_client.PrometheusAPIClient(
+        f"127.0.0.1:{stub.server_port}"
+    )
+
+    print(f"{count} series, {mbit} Mbit/s")
+    for enabled in (False, True):
+        client.set_compression(enabled=enabled)
+        for name, function in (
+            ("series", lambda: client.series(["ceilometer_cpu"])),
+            ("query", lambda: client.query("ceilometer_cpu")),
+        ):
+            size, elapsed = measure(stub, function)
+            encoding = "gzip" if enabled else "identity"
+            print(f"{name:>8} {encoding:>8}: {size / 1e6:10.2f} MB "
+                  f"{elapsed * 1e3:10.1f} ms")
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#   Copyright 2023 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""Benchmark of PromQLRbac.modify_query.
+
+Compares the tokenizer based implementation with the previous one,
+which ran a regex search over the query for every known metric name.
+
+Usage: tox -e venv -- python tools/benchmarks/rbac_modify_query.py [names]
+"""
+
+import re
+import sys
+import timeit
+from unittest import mock
+
+from observabilityclient import rbac
+
+
+QUERIES = [
+    "test_query",
+    "sum by (foo) (test_query{label_1='baz'})",
+    "delta(cpu_temp_celsius{host='zeus'}[2h]) - sum(http_requests) + "
+    "sum(http_requests{instance=~'.*'})",
+    "histogram_quantile(0.9, sum by (le) (rate(http_requests[10m])))",
+]
+
+
+def legacy_find_name_end_locations(query, metric_names):
+    # The metric name detection used by modify_query before it was
+    # replaced by a tokenizer.
+    name_end_locations = []
+    for name in metric_names:
+        name_regex = "[a-zA-Z_:]?[a-zA-Z0-9_:]*" + name + "[a-zA-Z0-9_:]*"
+        potential_names = re.finditer(name_regex, query)
+        for potential_name in potential_names:
+            if potential_name.group(0) == name:
+                name_end_locations.append(potential_name.end())
+    return sorted(name_end_locations, reverse=True)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    metric_names = [f"generated_metric_{i}_total" for i in range(count)]
+    metric_names += ['test_query', 'cpu_temp_celsius', 'http_requests']
+    promql_rbac = rbac.PromQLRbac(mock.Mock(), "project123",
+                                  query_cache_size=0)
+    cached_rbac = rbac.PromQLRbac(mock.Mock(), "project123")
+
+    print(f"{count} metric names, {len(QUERIES)} queries")
+    for name, function in (
+        ("legacy name scan",
+         lambda: [legacy_find_name_end_locations(q, metric_names)
+                  for q in QUERIES]),
+        ("modify_query",
+         lambda: [promql_rbac.modify_query(q)
+                  for q in QUERIES]),
+        ("modify_query cached",
+         lambda: [cached_rbac.modify_query(q)
+                  for q in QUERIES]),
+    ):
+        number, total = timeit.Timer(function).autorange()
+        per_query = total / number / len(QUERIES)
+        print(f"{name:>20}: {per_query * 1e6:12.1f} us per query")
+
+
+if __name__ == '__main__':
+    main()